@@ -0,0 +1,247 @@
+# Standard library imports
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# Local imports
+from config import app_config
+from metrics import record_stage, span
+
+# Priority lanes: interactive requests from a user's page load go ahead of background sync
+INTERACTIVE = 0
+BACKGROUND = 1
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+MAX_USER_BUCKETS = 10000
+
+def is_retriable(error):
+    if not isinstance(error, HttpError):
+        return False
+    return error.resp.status in RETRY_STATUSES or is_rate_limited(error)
+
+def is_rate_limited(error):
+    # Google answers quota errors with 429, or with 403 and a rate limit reason
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    if error.resp.status == 403:
+        details = getattr(error, 'error_details', None) or []
+        if isinstance(details, list):
+            return any(detail.get('reason') in RATE_LIMIT_REASONS for detail in details if isinstance(detail, dict))
+    return False
+
+def backoff_delay(attempt, cap=32.0):
+    # Full-jitter exponential backoff
+    return random.uniform(0, min(cap, 2 ** attempt))
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self.refill(now)
+        return self.tokens
+
+    def time_until(self, cost, now):
+        self.refill(now)
+        return max(0.0, (cost - self.tokens) / self.rate)
+
+    def reserve(self, cost, now):
+        # Take the tokens now, possibly into debt, and return how long to wait for them
+        self.refill(now)
+        self.tokens -= cost
+        return max(0.0, -self.tokens / self.rate)
+
+class GoogleRequestScheduler:
+    # Every Google call goes through here: per-project and per-user token buckets,
+    # priority lanes, jittered backoff on rate limits, and coalescing of identical calls
+    def __init__(self, project_qps=None, project_burst=None, user_qps=None, user_burst=None, max_retries=None):
+        self.project_bucket = TokenBucket(
+            project_qps or app_config.GOOGLE_PROJECT_QPS,
+            project_burst or app_config.GOOGLE_PROJECT_BURST
+        )
+        self.user_qps = user_qps or app_config.GOOGLE_USER_QPS
+        self.user_burst = user_burst or app_config.GOOGLE_USER_BURST
+        self.max_retries = max_retries if max_retries is not None else app_config.GOOGLE_MAX_RETRIES
+
+        self.user_buckets = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        self.waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.stats = {
+            'requests': 0,
+            'throttled': 0,
+            'throttle_seconds': 0.0,
+            'retries': 0,
+            'rate_limited': 0,
+            'coalesced': 0,
+            'errors': 0,
+        }
+
+    def user_bucket(self, user_key):
+        if user_key is None:
+            return None
+        bucket = self.user_buckets.get(user_key)
+        if bucket is None:
+            bucket = TokenBucket(self.user_qps, self.user_burst)
+            self.user_buckets[user_key] = bucket
+            while len(self.user_buckets) > MAX_USER_BUCKETS:
+                self.user_buckets.popitem(last=False)
+        else:
+            self.user_buckets.move_to_end(user_key)
+        return bucket
+
+    def max_cost(self, user_key=None):
+        # The most one reservation can take; a larger cost would never be free at once
+        if user_key is None:
+            return int(self.project_bucket.capacity)
+        return int(min(self.project_bucket.capacity, self.user_burst))
+
+    def try_reserve(self, user_key, priority, cost):
+        # Returns (granted, seconds to wait)
+        with self.lock:
+            now = time.monotonic()
+            buckets = [self.project_bucket]
+            user_bucket = self.user_bucket(user_key)
+            if user_bucket is not None:
+                buckets.append(user_bucket)
+
+            # Background work only takes tokens that are free right now and never while
+            # interactive requests are waiting, so it can't push them back
+            if priority == BACKGROUND:
+                if self.waiting[INTERACTIVE]:
+                    return False, 0.05
+                delay = max(bucket.time_until(cost, now) for bucket in buckets)
+                if delay > 0:
+                    return False, delay
+
+            return True, max(bucket.reserve(cost, now) for bucket in buckets)
+
+    def acquire(self, user_key=None, priority=INTERACTIVE, cost=1):
+        started = time.monotonic()
+        with self.lock:
+            self.waiting[priority] += 1
+        try:
+            while True:
+                granted, delay = self.try_reserve(user_key, priority, cost)
+                if delay > 0:
+                    time.sleep(delay)
+                if granted:
+                    break
+        finally:
+            with self.lock:
+                self.waiting[priority] -= 1
+        self.record_throttle(time.monotonic() - started)
+
+    async def acquire_async(self, user_key=None, priority=INTERACTIVE, cost=1):
+        started = time.monotonic()
+        with self.lock:
+            self.waiting[priority] += 1
+        try:
+            while True:
+                granted, delay = self.try_reserve(user_key, priority, cost)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if granted:
+                    break
+        finally:
+            with self.lock:
+                self.waiting[priority] -= 1
+        self.record_throttle(time.monotonic() - started)
+
+    def record_throttle(self, waited):
+        record_stage('google_throttle', waited)
+        with self.lock:
+            self.stats['requests'] += 1
+            if waited > 0.001:
+                self.stats['throttled'] += 1
+                self.stats['throttle_seconds'] += waited
+
+    def execute(self, request, user_key=None, priority=INTERACTIVE):
+        # Identical requests for the same user share one in-flight call
+        key = None
+        if user_key is not None:
+            key = (user_key, request.method, request.uri, request.body)
+            with self.lock:
+                future = self.in_flight.get(key)
+                if future is not None:
+                    self.stats['coalesced'] += 1
+                else:
+                    self.in_flight[key] = Future()
+            if future is not None:
+                return future.result()
+
+        try:
+            result = self.execute_with_backoff(request, user_key, priority)
+        except Exception as e:
+            if key is not None:
+                self.finish(key).set_exception(e)
+            raise
+
+        if key is not None:
+            self.finish(key).set_result(result)
+        return result
+
+    def finish(self, key):
+        with self.lock:
+            return self.in_flight.pop(key)
+
+    def execute_with_backoff(self, request, user_key, priority):
+        attempt = 0
+        while True:
+            self.acquire(user_key, priority)
+            try:
+                with span('google', method=getattr(request, 'methodId', None) or 'unknown'):
+                    return request.execute()
+            except HttpError as error:
+                if error.resp.status in (403, 429) and is_retriable(error):
+                    with self.lock:
+                        self.stats['rate_limited'] += 1
+                if not is_retriable(error) or attempt >= self.max_retries:
+                    with self.lock:
+                        self.stats['errors'] += 1
+                    raise
+
+            attempt += 1
+            with self.lock:
+                self.stats['retries'] += 1
+            time.sleep(backoff_delay(attempt))
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['queue_depth_interactive'] = self.waiting[INTERACTIVE]
+            stats['queue_depth_background'] = self.waiting[BACKGROUND]
+            stats['in_flight'] = len(self.in_flight)
+            stats['project_tokens'] = self.project_bucket.available(time.monotonic())
+        return stats
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = GoogleRequestScheduler()
+    return _scheduler
+
+def execute_request(request, user_key=None, priority=INTERACTIVE):
+    return get_scheduler().execute(request, user_key, priority)
@@ -1,15 +1,87 @@
+# Flask app factory and server entry point. Building the app only wires up routes
+# and settings; Mongo, Google and the token refresher are set up on first use.
+#
+#   python app.py                              (SERVER_MODE picks aiohttp or Flask)
+#   gunicorn 'app:create_app()'
+
+# Flask-related imports
 from flask import Flask
-import asyncio
+from flask_cors import CORS
+
+# Standard library imports
+import threading
+
+# Local imports
+from config import app_config
+from app_logging import configure_logging, get_logger
+from metrics import instrument_flask_app
+
+logger = get_logger(__name__)
+
+def create_app(config=None):
+    config = config or app_config
+    configure_logging()
+
+    # Create Flask app instance
+    app = Flask("__google_auth_session__")
+    app.config.from_object(config)
+    app.secret_key = config.COOKIE_KEY
+
+    # Session data is stored in Mongo, the cookie only carries a signed session id
+    from session_store import MongoSessionInterface
+    app.session_interface = MongoSessionInterface(
+        lifetime=config.SESSION_LIFETIME_SECONDS,
+        cache_size=config.SESSION_CACHE_SIZE,
+        cache_ttl=config.SESSION_CACHE_TTL_SECONDS
+    )
+
+    # Set up Cross-Origin Resource Sharing
+    CORS(app)
+
+    # Per-route timings and the Prometheus /metrics route
+    instrument_flask_app(app)
+
+    from google_auth_session import auth_blueprint
+    from calendars import calendars_blueprint
+    app.register_blueprint(auth_blueprint)
+    app.register_blueprint(calendars_blueprint)
+
+    start_background_services_on_first_request(app)
+
+    # Secrets and the database URI are never logged
+    logger.info("App created", extra={
+        'client_id': config.CLIENT_ID,
+        'project_id': config.PROJECT_ID,
+        'redirect_uri': config.REDIRECT_URIS,
+        'database_name': config.DATABASE_NAME,
+    })
+    return app
 
-# Import initialize_app function from google_auth_session module
-from google_auth_session import initialize_app
+def start_background_services_on_first_request(app):
+    started = threading.Event()
+    lock = threading.Lock()
 
-app = Flask("__google_auth_session__")
+    @app.before_request
+    def start_background_services():
+        if started.is_set():
+            return None
+        with lock:
+            if not started.is_set():
+                # The token refresher only runs in processes that actually serve requests
+                from credentials_manager import get_credential_manager
+                get_credential_manager().start()
+                started.set()
+        return None
 
 # Set up server
 if __name__ == '__main__':
-    loop = asyncio.new_event_loop()
-    app = loop.run_until_complete(initialize_app())
+    configure_logging()
+    logger.info("Starting the %s server on port 8000", app_config.SERVER_MODE)
+    if app_config.SERVER_MODE == 'async':
+        from aiohttp import web
+        from async_app import create_async_app
 
-    print("-------- Set Up Server -------------------------")
-    app.run(port=8000)
+        # Google and Mongo calls are awaited, so one process keeps many requests in flight
+        web.run_app(create_async_app(), port=8000)
+    else:
+        create_app().run(port=8000)
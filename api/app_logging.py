@@ -0,0 +1,173 @@
+# Logging for the API and the workers. Modules log through get_logger(__name__):
+#
+#   logger.info("Synced %d calendars", len(all_calendars), extra={'user_email': user_email})
+#
+# Entry points call configure_logging() once; importing a module never touches the
+# root logger. Messages are only built for records that pass the module's level: the
+# calling thread interpolates the message (and renders any traceback), since arguments
+# may change once the call returns, then queues the record on a bounded queue. A
+# listener thread lays out the text or JSON line and writes it, so request threads
+# never wait on stdout. Token and secret fields are redacted before queueing.
+
+# Standard library imports
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+
+# Local imports
+from config import app_config
+
+SECRET_KEYS = {
+    'token', 'access_token', 'refresh_token', 'id_token', 'client_secret', 'secret',
+    'secret_key', 'cookie_key', 'password', 'authorization', 'credentials',
+}
+REDACTED = '[REDACTED]'
+
+# Secrets that show up inside message text rather than as fields. Keys only match as
+# whole words, so 'next_page_token=' is kept; the OAuth authorization code is only
+# recognised as the code= query parameter, so 'status code: 410' is kept too.
+SECRET_PATTERNS = [
+    (re.compile(r'(Bearer\s+)[\w.~+/=-]+', re.IGNORECASE), r'\1' + REDACTED),
+    (re.compile(r'''(["']?\b(?:%s)\b["']?\s*[:=]\s*["']?)[^"',\s}]+''' % '|'.join(sorted(SECRET_KEYS)), re.IGNORECASE),
+     r'\1' + REDACTED),
+    (re.compile(r'([?&]code=)[^&#\s"\']+'), r'\1' + REDACTED),
+]
+
+# Attributes every LogRecord has; anything else came in through extra=
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in SECRET_KEYS and value[key] else redact(value[key])
+            for key in value
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    return value
+
+def redact_text(text):
+    for pattern, replacement in SECRET_PATTERNS:
+        text = pattern.sub(replacement, text)
+    return text
+
+def record_fields(record):
+    return {key: value for key, value in vars(record).items() if key not in RECORD_ATTRIBUTES}
+
+class RedactingFilter(logging.Filter):
+    # Runs on the logging thread before the record is queued, so nothing secret is kept
+    def filter(self, record):
+        if isinstance(record.args, (dict, tuple)):
+            record.args = redact(record.args)
+        for key, value in record_fields(record).items():
+            setattr(record, key, REDACTED if key.lower() in SECRET_KEYS and value else redact(value))
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    # Drops records instead of blocking when the writer thread falls behind
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only the message and traceback are rendered here; the listener's formatter
+        # builds the line, so JSON output keeps the traceback in its own field
+        record = copy.copy(record)
+        record.msg = redact_text(record.getMessage())
+        record.args = None
+        if record.exc_info:
+            record.exc_text = redact_text(logging.Formatter().formatException(record.exc_info))
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class StructuredFormatter(logging.Formatter):
+    def __init__(self, output_format='text'):
+        super().__init__()
+        self.output_format = output_format
+
+    def format(self, record):
+        timestamp = datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds')
+        fields = record_fields(record)
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+
+        if self.output_format == 'json':
+            entry = {'time': timestamp, 'level': record.levelname, 'logger': record.name, 'message': message}
+            entry.update(fields)
+            if record.exc_text:
+                entry['exception'] = record.exc_text
+            return json.dumps(entry, default=str)
+
+        line = f"{timestamp} {record.levelname:<7} {record.name}: {message}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += '\n' + record.exc_text
+        return line
+
+def parse_levels(level_overrides):
+    levels = {}
+    for override in level_overrides:
+        name, _, level = override.partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+_listener = None
+_queue_handler = None
+_configure_lock = threading.Lock()
+
+def configure_logging(stream=None):
+    # Called by entry points, safe to call more than once; only the first call adds the
+    # queue handler to the root logger, next to any handlers the host already installed
+    global _listener, _queue_handler
+
+    with _configure_lock:
+        if _listener is not None:
+            return _queue_handler
+
+        stream_handler = logging.StreamHandler(stream or sys.stdout)
+        stream_handler.setFormatter(StructuredFormatter(app_config.LOG_FORMAT))
+
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(app_config.LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(RedactingFilter())
+
+        root = logging.getLogger()
+        root.addHandler(_queue_handler)
+        root.setLevel(app_config.LOG_LEVEL.upper())
+        for name, level in parse_levels(app_config.LOG_LEVELS).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(_queue_handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        # Write out whatever is still queued when the process exits
+        atexit.register(stop_logging)
+        return _queue_handler
+
+def stop_logging():
+    global _listener
+
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def get_logger(name):
+    return logging.getLogger(name)
+
+def get_dropped_count():
+    return _queue_handler.dropped if _queue_handler is not None else 0
@@ -0,0 +1,220 @@
+# Standard library imports
+import asyncio
+from datetime import date, datetime, timedelta
+
+# aiohttp related imports
+from aiohttp import web
+
+# Security and Crypto imports
+from itsdangerous import BadSignature
+
+# Local imports
+from app_logging import configure_logging, get_logger
+from async_google import AsyncGoogleClient, GoogleApiError
+from async_mongodb import AsyncMongoDBClient, close_async_mongo_client
+from calendar_sync import (SYNC_TOKEN_GONE, calendars_etag, calendars_last_modified, merge_calendar_changes,
+                           normalize_calendar, synced_within)
+from config import app_config, CLIENT_CONFIG, SCOPES
+from credentials_manager import get_credential_manager
+from http_cache import conditional_json_response, not_modified_response
+from metrics import aiohttp_metrics, metrics_middleware
+from session_store import SESSION_COOKIE_NAME, new_session_id, session_signer
+from webhooks import get_notification_handler
+
+logger = get_logger(__name__)
+
+DASHBOARD_URL = 'http://localhost:3001/dashboard'
+
+routes = web.RouteTableDef()
+
+async def signed_in_user(request):
+    # The Google profile saved in the server-side session at login. Routes act only for
+    # this user, never for an email passed in the query string.
+    cookie = request.cookies.get(SESSION_COOKIE_NAME)
+    if not cookie:
+        return None
+    try:
+        sid = session_signer(app_config.COOKIE_KEY).unsign(cookie).decode()
+    except BadSignature:
+        return None
+    data = await request.app['mongo_client'].load_session(sid) or {}
+    google_user = data.get('google_user')
+    if not google_user or not google_user.get('email'):
+        return None
+    return google_user
+
+async def require_signed_in_user(request):
+    google_user = await signed_in_user(request)
+    if google_user is None:
+        raise web.HTTPUnauthorized(text="Log in first")
+    return google_user
+
+async def require_signed_in_email(request):
+    return (await require_signed_in_user(request))['email']
+
+# Auth endpoint
+@routes.get('/auth')
+async def auth(request):
+    google = request.app['google']
+    mongo_client = request.app['mongo_client']
+
+    # Get the authorization code from the request
+    code = request.query.get('code')
+    if not code:
+        raise web.HTTPBadRequest(text="Authorization code not found")
+
+    # Exchange the code and load the profile without blocking the event loop
+    credentials = await google.fetch_token(code, CLIENT_CONFIG['web'], app_config.REDIRECT_URIS, SCOPES)
+    google_user = await google.get_userinfo(credentials.token)
+
+    await mongo_client.save_or_update_user(google_user, credentials)
+    get_credential_manager().put(google_user['email'], credentials)
+
+    # Every login gets a new session id, so an id planted before login is never signed in
+    sid = new_session_id()
+    expires_at = datetime.utcnow() + timedelta(seconds=app_config.SESSION_LIFETIME_SECONDS)
+    await mongo_client.save_session(
+        sid, {'google_user': google_user, 'credentials': credentials.to_json()}, expires_at
+    )
+
+    response = web.json_response({'url': DASHBOARD_URL})
+    response.set_cookie(
+        SESSION_COOKIE_NAME, session_signer(app_config.COOKIE_KEY).sign(sid.encode()).decode(),
+        max_age=app_config.SESSION_LIFETIME_SECONDS, httponly=True, path='/'
+    )
+    return response
+
+@routes.get('/calendars')
+async def get_user_calendars(request):
+    google = request.app['google']
+    mongo_client = request.app['mongo_client']
+    user_email = await require_signed_in_email(request)
+
+    user = await mongo_client.find_user(
+        user_email, {
+            '_id': 1, 'calendars': 1, 'calendars_sync_token': 1, 'calendars_synced_at': 1,
+            'calendars_updated_at': 1, 'updated_at': 1,
+        }
+    )
+    if not user:
+        raise web.HTTPNotFound(text="User not found")
+
+    # Nothing watches the calendar list itself, so only a list synced recently enough
+    # lets a client that already has the stored version get its 304 before Google is called
+    if calendars_last_modified(user) and synced_within(user, app_config.CALENDARS_MAX_AGE_SECONDS):
+        not_modified = not_modified_response(request.headers, calendars_etag(user), calendars_last_modified(user))
+        if not_modified is not None:
+            status, headers, body = not_modified
+            return web.Response(status=status, headers=headers, body=body)
+
+    # Cached credentials come straight back; a due refresh runs off the event loop
+    credentials = await asyncio.to_thread(get_credential_manager().get_credentials, user_email)
+    if credentials is None:
+        raise web.HTTPUnauthorized(text="No stored credentials, log in again")
+
+    try:
+        all_calendars = await sync_user_calendars(google, mongo_client, user, credentials.token, user_email)
+    except GoogleApiError as error:
+        logger.warning("Could not load calendars from Google: %s", error, extra={'user_email': user_email})
+        raise web.HTTPBadGateway(text="Could not load calendars from Google")
+
+    # Attach the stored enabled flags, new calendars start disabled
+    stored_flags = await mongo_client.load_calendar_flags(user['_id'])
+    missing_flags = {}
+    for calendar in all_calendars:
+        calendar['enabled'] = stored_flags.get(calendar['id'], False)
+        if calendar['id'] not in stored_flags:
+            missing_flags[calendar['id']] = False
+    await mongo_client.save_calendar_flag_changes(user['_id'], missing_flags, only_if_missing=True)
+
+    last_modified = calendars_last_modified(user)
+    etag = calendars_etag(user) if last_modified else None
+    status, headers, body = conditional_json_response(request.headers, all_calendars, last_modified, etag)
+    return web.Response(status=status, headers=headers, body=body)
+
+@routes.put('/calendars/{calendar_id}')
+async def toggle_calendar_enabled(request):
+    mongo_client = request.app['mongo_client']
+    user_email = await require_signed_in_email(request)
+    user = await mongo_client.find_user(user_email, {'_id': 1})
+    if not user:
+        raise web.HTTPNotFound(text="User not found")
+
+    calendar = await mongo_client.toggle_calendar_flag(user['_id'], request.match_info['calendar_id'])
+    if calendar is None:
+        raise web.HTTPNotFound(text="Calendar not found")
+    return web.json_response(calendar)
+
+@routes.get('/reports/team')
+async def get_team_report(request):
+    from team_reports import build_team_report, team_scope
+
+    requester = await require_signed_in_user(request)
+    user_email = requester['email']
+    emails = request.query.getall('member', [])
+    domain = request.query.get('domain')
+    scope = team_scope(requester, emails, domain)
+    if scope is None:
+        raise web.HTTPForbidden(text="Only members of your own Workspace domain can be reported on")
+
+    credentials = await asyncio.to_thread(get_credential_manager().get_credentials, user_email)
+    if credentials is None:
+        raise web.HTTPUnauthorized(text="No stored credentials, log in again")
+    try:
+        start_date = date.fromisoformat(request.query['start'])
+        end_date = date.fromisoformat(request.query['end'])
+    except (KeyError, ValueError):
+        raise web.HTTPBadRequest(text="start and end must be ISO dates")
+
+    # freebusy calls fan out on their own thread pool, the loop only waits for the result
+    report = await asyncio.to_thread(
+        build_team_report, credentials, start_date, end_date, request.query.get('tz', 'UTC'),
+        emails=emails, domain=domain, user_key=user_email, scope=scope
+    )
+    return web.json_response(report)
+
+# Google Calendar push notifications
+@routes.post('/webhooks/calendar')
+async def calendar_webhook(request):
+    status = await asyncio.to_thread(get_notification_handler().handle, request.headers)
+    return web.Response(status=status)
+
+async def sync_user_calendars(google, mongo_client, user, token, user_email):
+    # Same incremental syncToken flow as calendar_sync, over aiohttp and motor
+    sync_token = user.get('calendars_sync_token')
+    stored_calendars = user.get('calendars') or []
+    cached_calendars = [normalize_calendar(calendar) for calendar in stored_calendars]
+
+    try:
+        changes, next_sync_token = await google.list_calendar_list(token, sync_token, user_email)
+        all_calendars = merge_calendar_changes(cached_calendars, changes, replace=not sync_token)
+    except GoogleApiError as error:
+        if not sync_token or error.status != SYNC_TOKEN_GONE:
+            raise
+        changes, next_sync_token = await google.list_calendar_list(token, user_key=user_email)
+        all_calendars = merge_calendar_changes(cached_calendars, changes, replace=True)
+
+    if next_sync_token != sync_token or all_calendars != stored_calendars:
+        saved_at = await mongo_client.save_calendar_sync_state(user['_id'], all_calendars, next_sync_token)
+        user.update(calendars_synced_at=saved_at, calendars_updated_at=saved_at, updated_at=saved_at)
+        user['calendars_sync_token'] = next_sync_token
+    return all_calendars
+
+async def on_startup(app):
+    app['google'] = await AsyncGoogleClient().start()
+    app['mongo_client'] = AsyncMongoDBClient(app)
+    await app['mongo_client'].ensure_indexes()
+    get_credential_manager().start()
+
+async def on_cleanup(app):
+    await app['google'].close()
+    close_async_mongo_client()
+
+def create_async_app():
+    configure_logging()
+    app = web.Application(middlewares=[metrics_middleware()])
+    app.add_routes(routes)
+    app.router.add_get('/metrics', aiohttp_metrics)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
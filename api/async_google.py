@@ -0,0 +1,123 @@
+# Standard library imports
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+# aiohttp related imports
+import aiohttp
+
+# Google API related imports
+from google.oauth2.credentials import Credentials
+
+# Local imports
+from api_scheduler import INTERACTIVE, get_scheduler
+from calendar_sync import calendar_list_fields, normalize_calendar
+from config import app_config
+from metrics import span
+
+GOOGLE_API_ROOT = 'https://www.googleapis.com'
+
+class GoogleApiError(Exception):
+    def __init__(self, status, body):
+        super().__init__(f"Google API returned {status}: {body}")
+        self.status = status
+        self.body = body
+
+class AsyncGoogleClient:
+    # Talks to Google over one shared aiohttp session, so connections are reused
+    # across requests instead of a new TLS handshake per call
+    def __init__(self, api_root=None):
+        self.api_root = (api_root or app_config.GOOGLE_API_ROOT or GOOGLE_API_ROOT).rstrip('/')
+        self.session = None
+
+    async def start(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(
+                limit=app_config.GOOGLE_HTTP_POOL_SIZE,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(total=app_config.GOOGLE_HTTP_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method, url, token=None, priority=INTERACTIVE, endpoint='other', user_key=None, **kwargs):
+        headers = kwargs.pop('headers', {})
+        if token:
+            headers['Authorization'] = f"Bearer {token}"
+
+        # Same quota buckets as the synchronous client, keyed by the user's email rather
+        # than the token, which changes on every refresh; waited on without blocking the loop
+        await get_scheduler().acquire_async(user_key, priority)
+
+        with span('google', method=endpoint):
+            async with self.session.request(method, url, headers=headers, **kwargs) as response:
+                if response.status >= 400:
+                    raise GoogleApiError(response.status, await response.text())
+                return await response.json()
+
+    async def fetch_token(self, code, client_config, redirect_uri, scopes):
+        # Exchange the authorization code for tokens, like Flow.fetch_token
+        token_uri = client_config['token_uri']
+        token_response = await self.request('POST', token_uri, endpoint='oauth2.token', data={
+            'code': code,
+            'client_id': client_config['client_id'],
+            'client_secret': client_config['client_secret'],
+            'redirect_uri': redirect_uri,
+            'grant_type': 'authorization_code',
+        })
+
+        credentials = Credentials(
+            token=token_response['access_token'],
+            refresh_token=token_response.get('refresh_token'),
+            id_token=token_response.get('id_token'),
+            token_uri=token_uri,
+            client_id=client_config['client_id'],
+            client_secret=client_config['client_secret'],
+            scopes=token_response.get('scope', ' '.join(scopes)).split(),
+        )
+        credentials.expiry = datetime.utcnow() + timedelta(seconds=token_response.get('expires_in', 3600))
+        return credentials
+
+    async def get_userinfo(self, token):
+        return await self.request(
+            'GET', f"{self.api_root}/oauth2/v2/userinfo", token=token, endpoint='oauth2.userinfo.get'
+        )
+
+    async def list_calendar_list(self, token, sync_token=None, user_key=None):
+        # Page through calendarList.list, returning the items and the final nextSyncToken
+        items = []
+        params = {'fields': calendar_list_fields()}
+        if sync_token:
+            params['syncToken'] = sync_token
+
+        while True:
+            calendars_result = await self.request(
+                'GET', f"{self.api_root}/calendar/v3/users/me/calendarList", token=token, params=params,
+                endpoint='calendar.calendarList.list', user_key=user_key
+            )
+            items.extend(normalize_calendar(calendar) for calendar in calendars_result.get('items', []))
+
+            page_token = calendars_result.get('nextPageToken')
+            if not page_token:
+                return items, calendars_result.get('nextSyncToken')
+            params['pageToken'] = page_token
+
+    async def list_events(self, token, calendar_id, user_key=None, **params):
+        items = []
+        url = f"{self.api_root}/calendar/v3/calendars/{quote(calendar_id, safe='')}/events"
+        params = {key: str(value).lower() if isinstance(value, bool) else value for key, value in params.items()}
+
+        while True:
+            events_result = await self.request(
+                'GET', url, token=token, params=params, endpoint='calendar.events.list', user_key=user_key
+            )
+            items.extend(events_result.get('items', []))
+
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                return items
+            params['pageToken'] = page_token
@@ -0,0 +1,141 @@
+# Standard library imports
+import asyncio
+import os
+from datetime import datetime
+
+# Third-party package imports
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+# Local imports
+from app_logging import get_logger
+from calendar_flags import flag_update
+from config import app_config
+from mongodb import INDEXES, build_user_upsert, format_credentials, mongo_client_options
+from session_store import SESSIONS_COLLECTION
+from user_repository import invalidate_cached_users
+
+logger = get_logger(__name__)
+
+# Motor clients are bound to the event loop they are first used on,
+# so there is one per (process, loop) with the same pool settings as pymongo
+_clients = {}
+
+def get_async_mongo_client():
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    client = _clients.get(key)
+    if client is None:
+        client = AsyncIOMotorClient(app_config.DATABASE_URI, **mongo_client_options())
+        _clients[key] = client
+    return client
+
+def close_async_mongo_client():
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    client = _clients.pop(key, None)
+    if client is not None:
+        client.close()
+
+class AsyncMongoDBClient:
+    # Async mirror of MongoDBClient for the aiohttp serving mode
+    def __init__(self, app=None):
+        self.client = get_async_mongo_client()
+        self.db = self.client[app_config.DATABASE_NAME]
+        self.collection = self.db['users']
+        self.user_calendars = self.db['user_calendars']
+        self.sessions = self.db[SESSIONS_COLLECTION]
+
+    async def ensure_indexes(self):
+        await asyncio.gather(*(
+            self.db[collection_name].create_index(keys, **options)
+            for collection_name, keys, options in INDEXES
+        ))
+
+    async def save_or_update_user(self, google_user, credentials):
+        try:
+            user_email = google_user['email']
+            now = datetime.now().isoformat()
+            user_filter, user_update = build_user_upsert(google_user, format_credentials(credentials), now)
+
+            # Insert or update the user in a single round-trip
+            saved_user = await self.collection.find_one_and_update(
+                user_filter,
+                user_update,
+                projection={'_id': 1, 'created_at': 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            invalidate_cached_users([saved_user['_id']], [user_email])
+
+            if saved_user.get('created_at') == now:
+                logger.info("Saved new user", extra={'user_email': user_email})
+            else:
+                logger.info("Updated user", extra={'user_email': user_email})
+            return saved_user
+
+        except Exception:
+            logger.exception("Could not save user")
+            return None
+
+    async def connect_to_mongodb(self):
+        return self.collection
+
+    async def find_user(self, user_email, projection=None):
+        return await self.collection.find_one({'email': user_email}, projection)
+
+    async def save_calendar_sync_state(self, user_id, all_calendars, sync_token):
+        now = datetime.now().isoformat()
+        await self.collection.update_one(
+            {'_id': user_id},
+            {'$set': {
+                'calendars': all_calendars,
+                'calendars_sync_token': sync_token,
+                'calendars_synced_at': now,
+                'calendars_updated_at': now,
+                'updated_at': now
+            }}
+        )
+        invalidate_cached_users([user_id])
+        return now
+
+    async def load_session(self, sid):
+        # Same documents as the Flask session store, so a login works in either mode
+        stored = await self.sessions.find_one({'_id': sid}, {'data': 1, 'expires_at': 1})
+        # The TTL monitor only runs once a minute, so check expiry here too
+        if not stored or stored['expires_at'] <= datetime.utcnow():
+            return None
+        return stored.get('data', {})
+
+    async def save_session(self, sid, data, expires_at):
+        await self.sessions.update_one(
+            {'_id': sid},
+            {'$set': {'data': data, 'expires_at': expires_at}},
+            upsert=True
+        )
+
+    async def load_calendar_flags(self, user_id):
+        cursor = self.user_calendars.find({'user_id': user_id}, {'_id': 0, 'calendar_id': 1, 'enabled': 1})
+        return {doc['calendar_id']: doc.get('enabled', False) async for doc in cursor}
+
+    async def save_calendar_flag_changes(self, user_id, changes, only_if_missing=False):
+        if not changes:
+            return None
+
+        requests = [
+            flag_update(user_id, calendar_id, enabled, only_if_missing)
+            for calendar_id, enabled in changes.items()
+        ]
+        return await self.user_calendars.bulk_write(requests, ordered=False)
+
+    async def toggle_calendar_flag(self, user_id, calendar_id):
+        calendar = await self.user_calendars.find_one_and_update(
+            {'user_id': user_id, 'calendar_id': calendar_id},
+            [{'$set': {'enabled': {'$not': [{'$ifNull': ['$enabled', False]}]}}}],
+            projection={'_id': 0, 'calendar_id': 1, 'enabled': 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if calendar is not None:
+            await self.collection.update_one(
+                {'_id': user_id}, {'$set': {'calendars_updated_at': datetime.now().isoformat()}}
+            )
+            invalidate_cached_users([user_id])
+        return calendar
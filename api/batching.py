@@ -0,0 +1,115 @@
+# Standard library imports
+import time
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest
+
+# Local imports
+from api_scheduler import INTERACTIVE, backoff_delay, get_scheduler, is_retriable
+from config import app_config
+from metrics import span
+
+# Google accepts at most 50 calls in one batch request
+MAX_BATCH_SIZE = 50
+
+def new_batch(service, callback, batch_uri=None):
+    # A batch URI override points the batch at a local stand-in instead of Google
+    batch_uri = batch_uri or app_config.GOOGLE_BATCH_URI
+    if batch_uri:
+        return BatchHttpRequest(callback=callback, batch_uri=batch_uri)
+    return service.new_batch_http_request(callback=callback)
+
+def execute_batched(service, requests, max_retries=3, batch_uri=None, user_key=None, priority=INTERACTIVE):
+    # Run {key: HttpRequest} in batches of up to 50, retrying only the failed items.
+    # Returns ({key: response}, {key: error}) once everything succeeded or gave up.
+    # Batches are also kept within the user's burst, which each batch reserves in full.
+    batch_size = max(1, min(MAX_BATCH_SIZE, get_scheduler().max_cost(user_key)))
+    results = {}
+    errors = {}
+    pending = dict(requests)
+
+    attempt = 0
+    while pending:
+        failed = {}
+        keys = list(pending)
+        for offset in range(0, len(keys), batch_size):
+            chunk = keys[offset:offset + batch_size]
+            run_batch(service, pending, chunk, results, failed, batch_uri, user_key, priority)
+
+        pending = {}
+        for key, error in failed.items():
+            if is_retriable(error) and attempt < max_retries:
+                pending[key] = requests[key]
+            else:
+                errors[key] = error
+
+        if pending:
+            attempt += 1
+            # Jittered exponential backoff before retrying the failed items
+            time.sleep(backoff_delay(attempt))
+
+    return results, errors
+
+def run_batch(service, pending, chunk, results, failed, batch_uri, user_key, priority):
+    request_keys = {str(index): key for index, key in enumerate(chunk)}
+
+    def callback(request_id, response, exception):
+        key = request_keys[request_id]
+        if exception is not None:
+            failed[key] = exception
+        else:
+            results[key] = response
+
+    batch = new_batch(service, callback, batch_uri)
+    for request_id, key in request_keys.items():
+        batch.add(pending[key], request_id=request_id)
+
+    # Each call in the batch counts against the quotas
+    get_scheduler().acquire(user_key, priority, cost=len(chunk))
+    try:
+        with span('google_batch'):
+            batch.execute()
+    except HttpError as error:
+        # The whole batch was rejected, so every item in it failed the same way
+        for key in chunk:
+            if key not in results:
+                failed[key] = error
+
+def list_events_batched(cal_service, calendar_ids, time_min, time_max, fields=None, batch_uri=None,
+                        user_key=None, priority=INTERACTIVE, single_events=True):
+    # First pages for every calendar go out together, then each round of next pages
+    events_by_calendar = {calendar_id: [] for calendar_id in calendar_ids}
+    errors = {}
+    page_tokens = {calendar_id: None for calendar_id in calendar_ids}
+
+    while page_tokens:
+        requests = {}
+        for calendar_id, page_token in page_tokens.items():
+            params = {
+                'calendarId': calendar_id,
+                'timeMin': time_min,
+                'timeMax': time_max,
+                'singleEvents': single_events,
+                'maxResults': 2500,
+            }
+            if fields:
+                params['fields'] = fields
+            if page_token:
+                params['pageToken'] = page_token
+            requests[calendar_id] = cal_service.events().list(**params)
+
+        results, round_errors = execute_batched(
+            cal_service, requests, batch_uri=batch_uri, user_key=user_key, priority=priority
+        )
+        errors.update(round_errors)
+
+        page_tokens = {}
+        for calendar_id, events_result in results.items():
+            events_by_calendar[calendar_id].extend(events_result.get('items', []))
+            if events_result.get('nextPageToken'):
+                page_tokens[calendar_id] = events_result['nextPageToken']
+
+    for calendar_id in errors:
+        events_by_calendar.pop(calendar_id, None)
+    return events_by_calendar, errors
@@ -0,0 +1,285 @@
+# Local stand-in for the Google OAuth, userinfo and Calendar endpoints the app calls,
+# batched Calendar calls included, used by benchmark.py so load tests run offline with
+# predictable data and latency.
+#
+#   python bench_google.py --port 8765 --calendars 20 --events 200 --latency-ms 20
+#
+# Users are numbered: the authorization code 'bench-7' logs in bench-user-7@bench.test,
+# whose access token names the user again, so every later call knows whose data to serve.
+
+# Standard library imports
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.parser import BytesParser, Parser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+BENCH_DOMAIN = 'bench.test'
+CODE_PREFIX = 'bench-'
+TOKEN_PREFIX = 'bench-token-'
+# Where googleapiclient sends batched Calendar calls, relative to the server root
+BATCH_PATH = '/batch/calendar/v3'
+
+def user_email(user_index):
+    return f"bench-user-{user_index}@{BENCH_DOMAIN}"
+
+def calendar_id(user_index, calendar_index):
+    # The first calendar is the user's primary one and is named after them
+    if calendar_index == 0:
+        return user_email(user_index)
+    return f"bench-{user_index}-{calendar_index}@group.{BENCH_DOMAIN}"
+
+class FakeGoogleData:
+    # Deterministic users, calendars and events; the same settings always give the same data
+    def __init__(self, calendars=10, events=100):
+        self.calendars = calendars
+        self.events = events
+        self.epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    def token_response(self, user_index):
+        # No 'scope' in the response, so clients keep the scopes they asked for
+        return {
+            'access_token': f"{TOKEN_PREFIX}{user_index}",
+            'refresh_token': f"bench-refresh-{user_index}",
+            'expires_in': 3600,
+            'token_type': 'Bearer',
+        }
+
+    def userinfo(self, user_index):
+        return {
+            'id': str(100000 + user_index),
+            'email': user_email(user_index),
+            'verified_email': True,
+            'name': f"Bench User {user_index}",
+            'given_name': 'Bench',
+            'family_name': f"User {user_index}",
+            'picture': f"https://{BENCH_DOMAIN}/avatars/{user_index}.png",
+            'locale': 'en',
+            'hd': BENCH_DOMAIN,
+        }
+
+    def calendar_list(self, user_index):
+        return [{
+            'id': calendar_id(user_index, index),
+            'summary': f"Calendar {index}",
+            'backgroundColor': '#9fc6e7',
+            'foregroundColor': '#000000',
+            'colorId': str(index % 24 + 1),
+            'accessRole': 'owner' if index == 0 else 'reader',
+            'timeZone': 'UTC',
+            'primary': index == 0,
+        } for index in range(self.calendars)]
+
+    def owns_calendar(self, user_index, calendar):
+        return calendar in {calendar_id(user_index, index) for index in range(self.calendars)}
+
+    def event_list(self, calendar):
+        # 30 to 90 minute meetings spread over working hours, seeded by the calendar id
+        rng = random.Random(calendar)
+        items = []
+        for index in range(self.events):
+            start = self.epoch + timedelta(days=rng.randrange(90), hours=rng.randrange(8, 18))
+            items.append({
+                'id': f"evt{index}",
+                'status': 'confirmed',
+                'start': {'dateTime': start.isoformat()},
+                'end': {'dateTime': (start + timedelta(minutes=rng.choice((30, 60, 90)))).isoformat()},
+            })
+        return items
+
+class FakeGoogleServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency_ms=0, jitter_ms=0):
+        super().__init__(address, FakeGoogleHandler)
+        self.data = data
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.calls = {}
+        self.calls_lock = threading.Lock()
+
+    def count(self, endpoint):
+        with self.calls_lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def stats(self):
+        with self.calls_lock:
+            return {'calls': sum(self.calls.values()), 'by_endpoint': dict(self.calls)}
+
+    def reset(self):
+        with self.calls_lock:
+            self.calls.clear()
+
+    def simulate_latency(self):
+        delay = self.latency_ms + (random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+class FakeGoogleHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        # Thousands of requests per run; the stats endpoint is the record
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        # Control endpoints for the benchmark, not counted as Google calls
+        if url.path == '/_bench/stats':
+            return self.send_json(200, self.server.stats())
+        if url.path == '/_bench/reset':
+            self.server.reset()
+            return self.send_json(200, {})
+
+        # One round-trip for the whole batch; each part counts as its own call
+        if method == 'POST' and url.path == BATCH_PATH:
+            self.server.simulate_latency()
+            content_type, payload = self.batch(body)
+            return self.send_body(200, content_type, payload)
+
+        status, payload = self.call(method, url.path, query, body, self.headers)
+        return self.send_json(status, payload)
+
+    def call(self, method, path, query, body, headers, simulate_latency=True):
+        route = self.route(method, path)
+        if route is None:
+            return 404, {'error': {'code': 404, 'message': f"No fake for {method} {path}"}}
+
+        endpoint, handler, args = route
+        self.server.count(endpoint)
+        if simulate_latency:
+            self.server.simulate_latency()
+        return handler(query, body, headers, *args)
+
+    def batch(self, body):
+        # multipart/mixed in and out: every part is an HTTP request, answered by a part
+        # holding its HTTP response under the request's Content-ID
+        envelope = f"Content-Type: {self.headers.get('Content-Type', '')}\r\n\r\n".encode()
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in BytesParser().parsebytes(envelope + body).get_payload():
+            request_line, _, rest = part.get_payload().lstrip().partition('\n')
+            method, target, _ = request_line.strip().split(' ', 2)
+            headers = Parser().parsestr(rest)
+            url = urlparse(target)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            part_body = (headers.get_payload() or '').encode()
+
+            status, payload = self.call(method, url.path, query, part_body, headers, simulate_latency=False)
+            response = json.dumps(payload)
+            content_id = (part.get('Content-ID') or '').strip('<>')
+            parts.append(
+                f"--{boundary}\r\n"
+                f"Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {self.responses[status][0]}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(response.encode())}\r\n\r\n"
+                f"{response}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", ''.join(parts).encode()
+
+    def route(self, method, path):
+        parts = [unquote(part) for part in path.strip('/').split('/')]
+        if method == 'POST' and parts == ['token']:
+            return 'oauth2.token', self.token, ()
+        if method == 'GET' and parts == ['oauth2', 'v2', 'userinfo']:
+            return 'oauth2.userinfo.get', self.userinfo, ()
+        if method == 'GET' and parts == ['calendar', 'v3', 'users', 'me', 'calendarList']:
+            return 'calendar.calendarList.list', self.calendar_list, ()
+        events_path = len(parts) == 5 and parts[:3] == ['calendar', 'v3', 'calendars'] and parts[4] == 'events'
+        if method == 'GET' and events_path:
+            return 'calendar.events.list', self.events, (parts[3],)
+        return None
+
+    def bearer_user(self, headers):
+        header = headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        if not token.startswith(TOKEN_PREFIX):
+            return None
+        return int(token[len(TOKEN_PREFIX):])
+
+    def token(self, query, body, headers):
+        form = {key: values[-1] for key, values in parse_qs(body.decode()).items()}
+        if form.get('grant_type') == 'refresh_token':
+            user_index = int(form.get('refresh_token', '').rsplit('-', 1)[-1])
+        else:
+            code = form.get('code', '')
+            if not code.startswith(CODE_PREFIX):
+                return 400, {'error': 'invalid_grant'}
+            user_index = int(code[len(CODE_PREFIX):])
+        return 200, self.server.data.token_response(user_index)
+
+    def userinfo(self, query, body, headers):
+        user_index = self.bearer_user(headers)
+        if user_index is None:
+            return 401, {'error': {'code': 401, 'message': 'Invalid Credentials'}}
+        return 200, self.server.data.userinfo(user_index)
+
+    def calendar_list(self, query, body, headers):
+        user_index = self.bearer_user(headers)
+        if user_index is None:
+            return 401, {'error': {'code': 401, 'message': 'Invalid Credentials'}}
+        # Nothing ever changes here, so an incremental sync comes back empty
+        sync_token = f"bench-calendars-{user_index}"
+        items = [] if query.get('syncToken') == sync_token else self.server.data.calendar_list(user_index)
+        return 200, {'kind': 'calendar#calendarList', 'items': items, 'nextSyncToken': sync_token}
+
+    def events(self, query, body, headers, calendar):
+        user_index = self.bearer_user(headers)
+        if user_index is None:
+            return 401, {'error': {'code': 401, 'message': 'Invalid Credentials'}}
+        if not self.server.data.owns_calendar(user_index, calendar):
+            return 404, {'error': {'code': 404, 'message': 'Not Found', 'errors': [{'reason': 'notFound'}]}}
+        sync_token = f"bench-events-{calendar}"
+        items = [] if query.get('syncToken') == sync_token else self.server.data.event_list(calendar)
+        return 200, {'kind': 'calendar#events', 'items': items, 'nextSyncToken': sync_token}
+
+    def send_json(self, status, payload):
+        return self.send_body(status, 'application/json; charset=UTF-8', json.dumps(payload).encode())
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_fake_google(port, calendars, events, latency_ms, jitter_ms=0, host='127.0.0.1'):
+    data = FakeGoogleData(calendars, events)
+    server = FakeGoogleServer((host, port), data, latency_ms, jitter_ms)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake Google OAuth and Calendar endpoints.")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--calendars', type=int, default=10)
+    parser.add_argument('--events', type=int, default=100)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    args = parser.parse_args()
+
+    print(f"Fake Google listening on http://127.0.0.1:{args.port}")
+    serve_fake_google(args.port, args.calendars, args.events, args.latency_ms, args.jitter_ms)
+
+if __name__ == '__main__':
+    main()
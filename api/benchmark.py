@@ -0,0 +1,402 @@
+# Offline benchmark and load test for the login and calendar routes.
+#
+#   python benchmark.py --mongod mongod                      (starts a throwaway mongod)
+#   python benchmark.py --mongo-uri mongodb://127.0.0.1:27017 --mode async --concurrency 32
+#   python benchmark.py --mongod mongod --update-baselines   (records the current numbers)
+#
+# The app runs in its own process against bench_google.py, a local stand-in for Google
+# with configurable latency, calendar counts and event volumes, and a local mongod.
+# A pool of client threads drives /auth, /calendars and PUT /calendars/<id>. Each
+# scenario reports throughput, p50/p95/p99 latency, and the Mongo commands and Google
+# calls per request. Results are compared with the baselines stored for the same
+# settings in benchmark_baselines.json; any regression or failed request exits with 1.
+# Settings without stored baselines exit with 2 before anything runs, unless they are
+# being recorded with --update-baselines.
+
+# Standard library imports
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+# Local imports
+from bench_google import calendar_id, serve_fake_google
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+SCENARIOS = ('auth', 'calendars', 'toggle')
+
+# Slower or chattier than the baseline by more than the tolerance counts as a regression
+LATENCY_METRICS = ('p50_ms', 'p95_ms', 'p99_ms')
+COUNT_METRICS = ('mongo_ops_per_request', 'google_calls_per_request')
+
+MONGO_OPS_SAMPLE = 'app_stage_duration_seconds_count'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, process=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            if process is not None and not is_running(process):
+                raise RuntimeError(f"Process for port {port} exited before it started listening")
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {timeout}s")
+
+def is_running(process):
+    if isinstance(process, subprocess.Popen):
+        return process.poll() is None
+    return process.is_alive()
+
+def app_environment(google_root, mongo_uri, database_name, mode):
+    # config.py reads these on import, so they are set before the app is imported
+    return {
+        'SERVER_MODE': mode,
+        'GOOGLE_API_ROOT': google_root,
+        'GOOGLE_BATCH_URI': f"{google_root}/batch/calendar/v3",
+        'DEVELOPMENT_DATABASE_URI': mongo_uri,
+        'DEVELOPMENT_DATABASE_NAME': database_name,
+        'DEVELOPMENT_CLIENT_ID': 'bench-client',
+        'DEVELOPMENT_CLIENT_SECRET': 'bench-secret',
+        'DEVELOPMENT_PROJECT_ID': 'bench',
+        'DEVELOPMENT_AUTH_URI': f"{google_root}/auth",
+        'DEVELOPMENT_TOKEN_URI': f"{google_root}/token",
+        'DEVELOPMENT_REDIRECT_URIS': 'http://127.0.0.1/oauth_callback',
+        'DEVELOPMENT_COOKIE_KEY': 'bench-cookie-key',
+        # oauthlib refuses plain http token endpoints otherwise
+        'OAUTHLIB_INSECURE_TRANSPORT': '1',
+        'LOG_LEVEL': 'WARNING',
+    }
+
+def serve_app(mode, port, environment):
+    # Runs in the app's own process, so the load generator doesn't share its GIL
+    os.environ.update(environment)
+    os.environ.pop('FLASK_ENV', None)
+
+    if mode == 'async':
+        from aiohttp import web
+        from async_app import create_async_app
+        web.run_app(create_async_app(), host='127.0.0.1', port=port, print=None)
+    else:
+        from werkzeug.serving import make_server
+        from app import create_app
+        make_server('127.0.0.1', port, create_app(), threaded=True).serve_forever()
+
+def start_mongod(binary, port):
+    dbpath = tempfile.mkdtemp(prefix='bench-mongod-')
+    process = subprocess.Popen(
+        [binary, '--dbpath', dbpath, '--port', str(port), '--bind_ip', '127.0.0.1', '--quiet'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return process, dbpath
+
+def stop_process(process, timeout=10):
+    if process is None or not is_running(process):
+        return
+    process.terminate()
+    if isinstance(process, subprocess.Popen):
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        return
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+
+class BenchClient:
+    # One keep-alive connection per client thread, and the session cookie of each
+    # user's last login, sent with every later request made as that user
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+        self.sessions = {}
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        return connection
+
+    def request(self, method, path, user_index=None):
+        # Returns (status or None when the connection failed, body, seconds)
+        headers = {}
+        if user_index in self.sessions:
+            headers['Cookie'] = self.sessions[user_index]
+        started = time.perf_counter()
+        connection = self.connection()
+        try:
+            connection.request(method, path, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+            status = response.status
+            cookie = response.getheader('Set-Cookie')
+            if user_index is not None and cookie:
+                self.sessions[user_index] = cookie.split(';', 1)[0]
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            status, body = None, b''
+        return status, body, time.perf_counter() - started
+
+    def get_json(self, path):
+        status, body, _ = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f"GET {path} returned {status}")
+        return json.loads(body)
+
+def count_mongo_ops(app_client):
+    # Mongo commands recorded by the app's command listener, read off its /metrics
+    status, body, _ = app_client.request('GET', '/metrics')
+    if status != 200:
+        raise RuntimeError(f"GET /metrics returned {status}")
+    total = 0
+    for line in body.decode().splitlines():
+        if line.startswith(MONGO_OPS_SAMPLE + '{') and 'stage="mongo"' in line:
+            total += float(line.rsplit(' ', 1)[1])
+    return total
+
+def count_google_calls(google_client):
+    return google_client.get_json('/_bench/stats')['calls']
+
+def scenario_request(scenario, user_index, round_index, calendars):
+    # Toggles walk through each user's calendars, one per round over all users
+    if scenario == 'auth':
+        return 'GET', f"/auth?code=bench-{user_index}"
+    if scenario == 'calendars':
+        return 'GET', "/calendars"
+    calendar = quote(calendar_id(user_index, round_index % calendars), safe='')
+    return 'PUT', f"/calendars/{calendar}"
+
+def run_requests(app_client, scenario, count, concurrency, users, calendars, offset=0):
+    # Returns (seconds per request, failed requests, wall-clock seconds)
+    def send(request_index):
+        user_index = request_index % users
+        method, path = scenario_request(scenario, user_index, request_index // users, calendars)
+        status, _, seconds = app_client.request(method, path, user_index)
+        return status, seconds
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(offset, offset + count)))
+    elapsed = time.perf_counter() - started
+
+    failed = sum(1 for status, _ in results if status is None or status >= 400)
+    return [seconds for _, seconds in results], failed, elapsed
+
+def percentile(sorted_values, percent):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def run_scenario(app_client, google_client, scenario, args):
+    run_requests(app_client, scenario, args.warmup, args.concurrency, args.users, args.calendars)
+
+    mongo_before = count_mongo_ops(app_client)
+    google_before = count_google_calls(google_client)
+    latencies, failed, elapsed = run_requests(
+        app_client, scenario, args.requests, args.concurrency, args.users, args.calendars, offset=args.warmup
+    )
+    mongo_ops = count_mongo_ops(app_client) - mongo_before
+    google_calls = count_google_calls(google_client) - google_before
+
+    latencies.sort()
+    return {
+        'requests': args.requests,
+        'errors': failed,
+        'throughput_rps': round(args.requests / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'mongo_ops_per_request': round(mongo_ops / args.requests, 3),
+        'google_calls_per_request': round(google_calls / args.requests, 3),
+    }
+
+def profile_key(args):
+    # Baselines are only comparable between runs with the same settings
+    return (f"{args.mode}-users{args.users}-concurrency{args.concurrency}-calendars{args.calendars}"
+            f"-events{args.events}-latency{args.google_latency_ms:g}ms")
+
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as baselines_file:
+        return json.load(baselines_file)
+
+def save_baselines(path, baselines):
+    with open(path, 'w') as baselines_file:
+        json.dump(baselines, baselines_file, indent=2, sort_keys=True)
+        baselines_file.write('\n')
+
+def find_regressions(results, baseline, latency_tolerance, count_tolerance):
+    regressions = []
+    for scenario, result in results.items():
+        if result['errors']:
+            regressions.append(f"{scenario}: {result['errors']} of {result['requests']} requests failed")
+
+        expected = baseline.get(scenario)
+        if not expected:
+            continue
+        for metric in LATENCY_METRICS:
+            if result[metric] > expected[metric] * (1 + latency_tolerance):
+                regressions.append(f"{scenario}: {metric} {result[metric]} > baseline {expected[metric]}")
+        if result['throughput_rps'] < expected['throughput_rps'] * (1 - latency_tolerance):
+            regressions.append(
+                f"{scenario}: throughput_rps {result['throughput_rps']} < baseline {expected['throughput_rps']}"
+            )
+        # Call counts barely vary between runs, so they get a much tighter bound
+        for metric in COUNT_METRICS:
+            if result[metric] > expected[metric] * (1 + count_tolerance) + 0.01:
+                regressions.append(f"{scenario}: {metric} {result[metric]} > baseline {expected[metric]}")
+    return regressions
+
+def format_report(profile, results, baseline):
+    columns = ('throughput_rps',) + LATENCY_METRICS + COUNT_METRICS
+    header = f"{'scenario':<10} {'errors':>6} " + ' '.join(f"{column:>24}" for column in columns)
+    lines = [f"Benchmark profile: {profile}", header]
+    for scenario, result in results.items():
+        expected = baseline.get(scenario, {})
+        cells = []
+        for column in columns:
+            cell = f"{result[column]:g}"
+            if column in expected and expected[column]:
+                cell += f" ({(result[column] / expected[column] - 1) * 100:+.1f}%)"
+            cells.append(f"{cell:>24}")
+        lines.append(f"{scenario:<10} {result['errors']:>6} " + ' '.join(cells))
+    return '\n'.join(lines)
+
+def drop_database(mongo_uri, database_name):
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.drop_database(database_name)
+    finally:
+        client.close()
+
+def run_benchmark(args):
+    context = multiprocessing.get_context('spawn')
+    google_port = args.google_port or free_port()
+    app_port = args.port or free_port()
+    google_root = f"http://127.0.0.1:{google_port}"
+    database_name = f"benchmark_{os.getpid()}_{int(time.time())}"
+
+    mongod = dbpath = google = app = None
+    mongo_uri = args.mongo_uri
+    try:
+        if args.mongod:
+            mongod_port = free_port()
+            mongod, dbpath = start_mongod(args.mongod, mongod_port)
+            wait_for_port(mongod_port, mongod)
+            mongo_uri = f"mongodb://127.0.0.1:{mongod_port}"
+
+        google = context.Process(
+            target=serve_fake_google,
+            args=(google_port, args.calendars, args.events, args.google_latency_ms, args.google_jitter_ms),
+            daemon=True
+        )
+        google.start()
+        wait_for_port(google_port, google)
+
+        environment = app_environment(google_root, mongo_uri, database_name, args.mode)
+        app = context.Process(target=serve_app, args=(args.mode, app_port, environment), daemon=True)
+        app.start()
+        wait_for_port(app_port, app, timeout=60)
+
+        app_client = BenchClient(app_port)
+        google_client = BenchClient(google_port)
+
+        # Every user logs in and syncs their calendar list once, so flags exist to toggle
+        for scenario in ('auth', 'calendars'):
+            _, failed, _ = run_requests(app_client, scenario, args.users, args.concurrency, args.users, args.calendars)
+            if failed:
+                raise RuntimeError(f"Setup failed: {failed} of {args.users} {scenario} requests failed")
+
+        return {scenario: run_scenario(app_client, google_client, scenario, args) for scenario in args.scenarios}
+    finally:
+        stop_process(app)
+        stop_process(google)
+        if mongod is not None:
+            stop_process(mongod)
+            shutil.rmtree(dbpath, ignore_errors=True)
+        elif mongo_uri and not args.keep_database:
+            drop_database(mongo_uri, database_name)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test of the login and calendar routes.")
+    parser.add_argument('--mode', choices=('async', 'flask'), default=os.environ.get('SERVER_MODE', 'flask'))
+    mongo = parser.add_mutually_exclusive_group(required=True)
+    mongo.add_argument('--mongod', metavar='BINARY', help="start a throwaway mongod from this binary")
+    mongo.add_argument('--mongo-uri', help="use a running local mongod; a scratch database is dropped afterwards")
+    parser.add_argument('--keep-database', action='store_true')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=2000, help="measured requests per scenario")
+    parser.add_argument('--warmup', type=int, default=200, help="unmeasured requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--calendars', type=int, default=20, help="calendars per fake user")
+    parser.add_argument('--events', type=int, default=200, help="events per fake calendar")
+    parser.add_argument('--google-latency-ms', type=float, default=20.0)
+    parser.add_argument('--google-jitter-ms', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--google-port', type=int, default=0)
+    parser.add_argument('--baselines', default=BASELINES_PATH)
+    parser.add_argument('--update-baselines', action='store_true')
+    parser.add_argument('--latency-tolerance', type=float, default=0.25)
+    parser.add_argument('--count-tolerance', type=float, default=0.05)
+    parser.add_argument('--output', help="also write the report and results as JSON to this file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = profile_key(args)
+    baselines = load_baselines(args.baselines)
+    baseline = baselines.get(profile, {})
+
+    # Nothing to compare against would make every run pass
+    if not baseline and not args.update_baselines:
+        print(f"No baselines for {profile} in {args.baselines}; run with --update-baselines to record them.",
+              file=sys.stderr)
+        return 2
+
+    results = run_benchmark(args)
+    report = format_report(profile, results, baseline)
+    print(report)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(report + '\n\n')
+            json.dump({'profile': profile, 'results': results}, output_file, indent=2)
+            output_file.write('\n')
+
+    if args.update_baselines:
+        baselines[profile] = dict(baseline, **results)
+        save_baselines(args.baselines, baselines)
+        print(f"Baselines for {profile} saved to {args.baselines}.")
+        return 0
+
+    regressions = find_regressions(results, baseline, args.latency_tolerance, args.count_tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
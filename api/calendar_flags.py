@@ -0,0 +1,186 @@
+# Standard library imports
+import atexit
+import threading
+from datetime import datetime
+
+# MongoDB-related imports
+from pymongo import ReturnDocument, UpdateOne
+
+# Local imports
+from app_logging import get_logger
+from config import app_config
+from mongodb import get_collection
+from user_repository import get_user_repository
+
+logger = get_logger(__name__)
+
+# Toggles of the same calendar are serialised on one of these locks, picked by key hash
+TOGGLE_LOCK_STRIPES = 64
+# Longest wait between retries of a flush that failed
+MAX_FLUSH_RETRY_SECONDS = 30
+
+# Enabled flags live in their own collection, one document per (user_id, calendar_id).
+# Calendar ids are email addresses, so they can't be used as keys of a map field.
+USER_CALENDARS_COLLECTION = 'user_calendars'
+
+def get_user_calendars_collection():
+    return get_collection(USER_CALENDARS_COLLECTION)
+
+def load_calendar_flags(collection, user_id):
+    # One indexed query returning only the ids and flags for the user
+    cursor = collection.find({'user_id': user_id}, {'_id': 0, 'calendar_id': 1, 'enabled': 1})
+    return {doc['calendar_id']: doc.get('enabled', False) for doc in cursor}
+
+def touch_users(user_ids):
+    # Flags are part of the /calendars response, so a change moves its Last-Modified
+    user_ids = list(user_ids)
+    get_collection('users').update_many(
+        {'_id': {'$in': user_ids}},
+        {'$set': {'calendars_updated_at': datetime.now().isoformat()}}
+    )
+    get_user_repository().invalidate_many(user_ids)
+
+def flag_update(user_id, calendar_id, enabled, only_if_missing=False):
+    operator = '$setOnInsert' if only_if_missing else '$set'
+    return UpdateOne(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        {operator: {'enabled': bool(enabled)}},
+        upsert=True
+    )
+
+def save_calendar_flag_changes(collection, user_id, changes, only_if_missing=False):
+    # Write every changed flag for the user in one bulk operation
+    if not changes:
+        return None
+
+    requests = [
+        flag_update(user_id, calendar_id, enabled, only_if_missing)
+        for calendar_id, enabled in changes.items()
+    ]
+    result = collection.bulk_write(requests, ordered=False)
+    # Missing flags are written as the default the response already showed
+    if not only_if_missing:
+        touch_users([user_id])
+    return result
+
+def toggle_calendar_flag(collection, user_id, calendar_id):
+    # Flip the flag server-side in one indexed update, a missing flag counts as disabled
+    calendar = collection.find_one_and_update(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        [{'$set': {'enabled': {'$not': [{'$ifNull': ['$enabled', False]}]}}}],
+        projection={'_id': 0, 'calendar_id': 1, 'enabled': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if calendar is not None:
+        touch_users([user_id])
+    return calendar
+
+class CalendarFlagWriter:
+    # Buffers flag toggles for a short window and flushes them in one bulk_write,
+    # so rapid clicks on the same calendar collapse into the last value
+    def __init__(self, collection, window_ms=None):
+        self.collection = collection
+        if window_ms is None:
+            window_ms = app_config.CALENDAR_FLAG_WRITE_BEHIND_MS
+        self.window = window_ms / 1000.0
+        self.pending = {}
+        # Values taken by a flush that may not have reached Mongo yet
+        self.flushing = {}
+        self.lock = threading.Lock()
+        self.toggle_locks = [threading.Lock() for _ in range(TOGGLE_LOCK_STRIPES)]
+        self.timer = None
+        self.failures = 0
+
+        # Don't lose buffered toggles when the process exits
+        atexit.register(self.flush)
+
+    def set_enabled(self, user_id, calendar_id, enabled):
+        # No window configured means write straight through
+        if self.window <= 0:
+            return save_calendar_flag_changes(self.collection, user_id, {calendar_id: enabled})
+
+        with self.lock:
+            self.pending[(user_id, calendar_id)] = enabled
+            self.schedule(self.window)
+        return None
+
+    def schedule(self, delay):
+        # Caller holds the lock
+        if self.timer is None:
+            self.timer = threading.Timer(delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def toggle(self, user_id, calendar_id):
+        if self.window <= 0:
+            return toggle_calendar_flag(self.collection, user_id, calendar_id)
+
+        # Held across the Mongo read, so two concurrent toggles can't both flip the stored value
+        key = (user_id, calendar_id)
+        with self.toggle_locks[hash(key) % len(self.toggle_locks)]:
+            # A buffered value is newer than one being flushed, which is newer than what is stored
+            with self.lock:
+                current = self.pending.get(key, self.flushing.get(key))
+
+            if current is None:
+                stored = self.collection.find_one(
+                    {'user_id': user_id, 'calendar_id': calendar_id},
+                    {'_id': 0, 'enabled': 1}
+                )
+                if stored is None:
+                    return None
+                current = stored.get('enabled', False)
+
+            enabled = not current
+            self.set_enabled(user_id, calendar_id, enabled)
+        return {'calendar_id': calendar_id, 'enabled': enabled}
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.flushing.update(pending)
+            self.timer = None
+
+        if not pending:
+            return None
+
+        requests = [
+            flag_update(user_id, calendar_id, enabled)
+            for (user_id, calendar_id), enabled in pending.items()
+        ]
+
+        try:
+            result = self.collection.bulk_write(requests, ordered=False)
+            touch_users({user_id for user_id, _ in pending})
+            self.failures = 0
+            return result
+        except Exception:
+            # The toggles were already answered, so they go back in the buffer and are
+            # retried with backoff; a newer toggle made meanwhile wins over the failed one
+            self.failures += 1
+            logger.exception("Error flushing %d calendar flags, will retry", len(pending))
+            with self.lock:
+                for key, enabled in pending.items():
+                    self.pending.setdefault(key, enabled)
+                self.schedule(min(self.window * 2 ** self.failures, MAX_FLUSH_RETRY_SECONDS))
+            return None
+        finally:
+            with self.lock:
+                for key, enabled in pending.items():
+                    if self.flushing.get(key) == enabled:
+                        del self.flushing[key]
+
+_flag_writers = {}
+_flag_writers_lock = threading.Lock()
+
+def get_flag_writer(collection=None):
+    # One write-behind buffer per collection, shared across requests
+    if collection is None:
+        collection = get_user_calendars_collection()
+
+    with _flag_writers_lock:
+        writer = _flag_writers.get(collection.full_name)
+        if writer is None:
+            writer = CalendarFlagWriter(collection)
+            _flag_writers[collection.full_name] = writer
+    return writer
@@ -0,0 +1,152 @@
+# Standard library imports
+from datetime import datetime, timedelta
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# Local imports
+from app_logging import get_logger
+from api_scheduler import INTERACTIVE, execute_request
+from config import app_config
+from http_cache import version_etag
+from user_repository import get_user_repository
+
+logger = get_logger(__name__)
+
+# Google returns 410 Gone when a sync token has expired or been invalidated
+SYNC_TOKEN_GONE = 410
+
+# Fields added by this app rather than Google, kept when slimming stored entries
+LOCAL_CALENDAR_FIELDS = ('enabled',)
+
+def calendar_list_fields():
+    # Partial-response mask so Google only sends the attributes we store
+    return f"nextPageToken,nextSyncToken,items({','.join(app_config.CALENDAR_LIST_FIELDS)})"
+
+def normalize_calendar(calendar):
+    # Compact stored schema: configured fields only, the user's own name wins over Google's
+    normalized = {
+        field: calendar[field]
+        for field in app_config.CALENDAR_LIST_FIELDS + LOCAL_CALENDAR_FIELDS
+        if field in calendar and field != 'summaryOverride'
+    }
+    if calendar.get('summaryOverride'):
+        normalized['summary'] = calendar['summaryOverride']
+    return normalized
+
+def sync_user_calendars(cal_service, user_email, collection, priority=INTERACTIVE, max_age_seconds=0):
+    # Load the cached calendar list and sync token for the user
+    cached_user = get_user_repository(collection).find_by_email(
+        user_email, ('calendars', 'calendars_sync_token', 'calendars_synced_at')
+    )
+
+    # A list the background worker synced recently enough is served without calling Google
+    if cached_user and synced_within(cached_user, max_age_seconds):
+        return cached_user.get('calendars') or []
+
+    # Without a stored user there is nowhere to cache, so just list everything
+    if not cached_user:
+        all_calendars, _ = list_all_calendars(cal_service, user_key=user_email, priority=priority)
+        return all_calendars
+
+    sync_token = cached_user.get('calendars_sync_token')
+    stored_calendars = cached_user.get('calendars') or []
+    # Entries stored before the compact schema are slimmed on their next write
+    cached_calendars = [normalize_calendar(calendar) for calendar in stored_calendars]
+
+    if sync_token:
+        try:
+            # Only ask Google for what changed since the last sync
+            changes, next_sync_token = list_all_calendars(
+                cal_service, sync_token=sync_token, user_key=user_email, priority=priority
+            )
+            all_calendars = merge_calendar_changes(cached_calendars, changes)
+        except HttpError as error:
+            if error.resp.status != SYNC_TOKEN_GONE:
+                raise
+            logger.info("Sync token expired, running a full resync", extra={'user_email': user_email})
+            all_calendars, next_sync_token = full_resync(cal_service, cached_calendars, user_email, priority)
+    else:
+        all_calendars, next_sync_token = full_resync(cal_service, cached_calendars, user_email, priority)
+
+    # Nothing changed, skip the write entirely
+    if sync_token and next_sync_token == sync_token and all_calendars == stored_calendars:
+        return all_calendars
+
+    save_calendar_sync_state(collection, cached_user['_id'], all_calendars, next_sync_token)
+    return all_calendars
+
+def list_all_calendars(cal_service, sync_token=None, user_key=None, priority=INTERACTIVE):
+    # Page through calendarList.list, returning the items and the final nextSyncToken
+    items = []
+    page_token = None
+    while True:
+        params = {'fields': calendar_list_fields()}
+        if sync_token:
+            params['syncToken'] = sync_token
+        if page_token:
+            params['pageToken'] = page_token
+
+        calendars_result = execute_request(cal_service.calendarList().list(**params), user_key, priority)
+        items.extend(normalize_calendar(calendar) for calendar in calendars_result.get('items', []))
+
+        page_token = calendars_result.get('nextPageToken')
+        if not page_token:
+            return items, calendars_result.get('nextSyncToken')
+
+def full_resync(cal_service, cached_calendars, user_key=None, priority=INTERACTIVE):
+    # A full listing replaces the cache, but local flags like 'enabled' are kept
+    all_calendars, next_sync_token = list_all_calendars(cal_service, user_key=user_key, priority=priority)
+    return merge_calendar_changes(cached_calendars, all_calendars, replace=True), next_sync_token
+
+def merge_calendar_changes(cached_calendars, changes, replace=False):
+    cached_by_id = {calendar['id']: calendar for calendar in cached_calendars}
+    merged = {} if replace else dict(cached_by_id)
+
+    for calendar in changes:
+        calendar_id = calendar['id']
+
+        # Deleted entries come back with 'deleted': True on incremental syncs
+        if calendar.get('deleted'):
+            merged.pop(calendar_id, None)
+            continue
+
+        # Keep the locally managed 'enabled' flag across updates from Google
+        previous = cached_by_id.get(calendar_id)
+        if previous is not None and 'enabled' in previous:
+            calendar = dict(calendar, enabled=previous['enabled'])
+        merged[calendar_id] = calendar
+
+    return list(merged.values())
+
+def synced_within(user, max_age_seconds):
+    # Whether the stored list was synced with Google less than max_age_seconds ago
+    if not max_age_seconds or not user.get('calendars_synced_at'):
+        return False
+    synced_at = datetime.fromisoformat(user['calendars_synced_at'])
+    return datetime.now() - synced_at < timedelta(seconds=max_age_seconds)
+
+def calendars_last_modified(user):
+    # calendars_updated_at only moves with the list or its flags, unlike updated_at,
+    # which logins and token refreshes bump too; users stored before it fall back
+    return user.get('calendars_updated_at') or user.get('updated_at')
+
+def calendars_etag(user):
+    # The stored list, flags included, only changes with its version or the sync token
+    return version_etag(calendars_last_modified(user), user.get('calendars_sync_token'))
+
+def save_calendar_sync_state(collection, user_id, all_calendars, sync_token):
+    # calendars_updated_at doubles as the Last-Modified of the /calendars response
+    now = datetime.now().isoformat()
+    collection.update_one(
+        {'_id': user_id},
+        {'$set': {
+            'calendars': all_calendars,
+            'calendars_sync_token': sync_token,
+            'calendars_synced_at': now,
+            'calendars_updated_at': now,
+            'updated_at': now
+        }}
+    )
+    get_user_repository(collection).invalidate(user_id)
+    return now
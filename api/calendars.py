@@ -1,106 +1,294 @@
 # Flask-related imports
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+from flask import Blueprint, Response, jsonify, request, session, stream_with_context
 
 # Standard library imports
-from datetime import datetime
+import logging
+from datetime import date, datetime
 from typing import List
 
 # Google-related imports
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 # MongoDB-related imports
 from bson.objectid import ObjectId
 
 # Local imports
-from mongodb import get_mongo_client
+from app_logging import get_logger
+from api_scheduler import is_rate_limited
+from config import app_config
+from calendar_sync import (calendars_etag, calendars_last_modified, normalize_calendar, sync_user_calendars,
+                           synced_within)
+from services import get_service
+from http_cache import conditional_json_response, not_modified_response
+from credentials_manager import get_credential_manager
+from mongodb import get_collection
+from user_repository import get_user_repository
+from calendar_flags import (get_flag_writer, get_user_calendars_collection,
+                            load_calendar_flags, save_calendar_flag_changes)
 
-# Create Flask app instance
-app = Flask("calendar_functions")
-CORS(app)
+logger = get_logger(__name__)
 
-# Initialize MongoDB client
-mongo_client = get_mongo_client()
+# Routes are registered on an app built by create_app() in app.py
+calendars_blueprint = Blueprint('calendar_functions', __name__)
 
-@app.route('/calendars', methods=['GET'])
+# Retry-After sent when Google rate limits a user without saying for how long
+RATE_LIMIT_RETRY_AFTER_SECONDS = 30
+
+def signed_in_user():
+    # The Google profile saved in the session at login. Routes act only for this user,
+    # never for an email passed in the query string.
+    google_user = session.get('google_user')
+    if not google_user or not google_user.get('email'):
+        return None
+    return google_user
+
+def signed_in_email():
+    google_user = signed_in_user()
+    return google_user['email'] if google_user else None
+
+@calendars_blueprint.route('/calendars', methods=['GET'])
 def get_user_calendars():
-    user_email = request.args.get('user_email')
-    credentials = request.args.get('credentials')
-    collection = request.args.get('collection')
-    print("user_email:", user_email)
+    user_email = signed_in_email()
+    if user_email is None:
+        return {'error': "Log in first"}, 401
+    collection = get_users_collection()
+
+    # Nothing watches the calendar list itself, so Google-side changes only reach the
+    # stored list through a sync. While that sync is recent enough to be served as is,
+    # a client that already has this version gets its 304 before Google is touched.
+    etag, last_modified, synced_recently = load_calendars_version(collection, user_email)
+    if etag is not None and synced_recently:
+        not_modified = not_modified_response(request.headers, etag, last_modified)
+        if not_modified is not None:
+            status, headers, body = not_modified
+            return Response(body, status=status, headers=headers)
 
+    credentials = get_credential_manager().get_credentials(user_email)
+    if credentials is None:
+        return {'error': "No stored credentials, log in again"}, 401
     try:
-        print("Building the Google Cal API client...")
         # Build the Google Calendar API client
-        cal_service = build('calendar', 'v3', credentials=credentials)
-        print("cal_service:", cal_service)
+        cal_service = get_service('calendar', 'v3', credentials=credentials)
 
-        # Get the list of all calendars for the user
-        calendars_result = cal_service.calendarList().list().execute()
-        all_calendars = calendars_result.get('items', [])
-        print("all_calendars: ")
-        print(json.dumps(all_calendars, indent=4))
+        # Get the list of all calendars for the user, syncing only what changed
+        all_calendars = sync_user_calendars(
+            cal_service, user_email, collection, max_age_seconds=app_config.CALENDARS_MAX_AGE_SECONDS
+        )
+        logger.debug("Loaded %d calendars", len(all_calendars), extra={'user_email': user_email})
 
         # Add an initialized "disabled" flag to each calendar
         initialize_calendar_enabled_flags(user_email, all_calendars, collection)
 
-        return all_calendars
+        # Read after the sync, which moves the version when the list changed
+        etag, last_modified, _ = load_calendars_version(collection, user_email)
+        status, headers, body = conditional_json_response(request.headers, all_calendars, last_modified, etag)
+        return Response(body, status=status, headers=headers)
 
     except HttpError as error:
-        print('An error occurred: %s' % error)
+        logger.warning("Could not load calendars from Google: %s", error, extra={'user_email': user_email})
+        if is_rate_limited(error):
+            retry_after = error.resp.get('retry-after') or str(RATE_LIMIT_RETRY_AFTER_SECONDS)
+            return {'error': "Google rate limit reached, try again later"}, 429, {'Retry-After': retry_after}
+        return {'error': "Could not load calendars from Google"}, 502
+
+def get_users_collection():
+    # Routes share the users collection of the pooled client
+    return get_collection('users')
+
+def load_calendars_version(collection, user_email):
+    # (ETag, Last-Modified, synced within the max age) of the stored calendar list, read
+    # from Mongo rather than the user cache so another process's write is seen
+    user = collection.find_one({'email': user_email}, {
+        '_id': 0, 'calendars_updated_at': 1, 'updated_at': 1, 'calendars_sync_token': 1, 'calendars_synced_at': 1
+    })
+    if not user or not calendars_last_modified(user):
+        return None, None, False
+    synced_recently = synced_within(user, app_config.CALENDARS_MAX_AGE_SECONDS)
+    return calendars_etag(user), calendars_last_modified(user), synced_recently
+
+def find_user_id(user_email, collection):
+    # Usually answered from the user cache without a Mongo round-trip
+    return get_user_repository(collection).get_user_id(user_email)
+
+def request_date_range():
+    # (start, end) from the ?start= and ?end= ISO dates, None if either is missing or invalid
+    try:
+        return date.fromisoformat(request.args['start']), date.fromisoformat(request.args['end'])
+    except (KeyError, ValueError):
         return None
 
+@calendars_blueprint.route('/hours', methods=['GET'])
+def get_user_hours():
+    user_email = signed_in_email()
+    if user_email is None:
+        return {'error': "Log in first"}, 401
+    credentials = get_credential_manager().get_credentials(user_email)
+    if credentials is None:
+        return {'error': "No stored credentials, log in again"}, 401
+    date_range = request_date_range()
+    if date_range is None:
+        return {'error': "start and end must be ISO dates"}, 400
+    start_date, end_date = date_range
+    tz_name = request.args.get('tz', 'UTC')
+
+    # Only enabled calendars count towards the user's hours
+    user_id = find_user_id(user_email, get_users_collection())
+    if not user_id:
+        return {'error': "User not found"}, 404
+    calendar_flags = load_calendar_flags(get_user_calendars_collection(), user_id)
+    enabled_calendar_ids = [calendar_id for calendar_id, enabled in calendar_flags.items() if enabled]
+
+    # The hours engine pulls in numpy, so it is imported on first use
+    from hours import compute_user_hours
+
+    cal_service = get_service('calendar', 'v3', credentials=credentials)
+    return compute_user_hours(cal_service, enabled_calendar_ids, start_date, end_date, tz_name, user_email)
+
+@calendars_blueprint.route('/hours/summary', methods=['GET'])
+def get_user_hours_summary():
+    user_email = signed_in_email()
+    if user_email is None:
+        return {'error': "Log in first"}, 401
+    date_range = request_date_range()
+    if date_range is None:
+        return {'error': "start and end must be ISO dates"}, 400
+    group_by = request.args.get('group_by', 'calendar')
+    calendar_ids = request.args.getlist('calendar_id') or None
+
+    # Answered from the pre-aggregated day buckets, Google isn't called at all
+    from rollups import query_hours
+
+    user_id = find_user_id(user_email, get_users_collection())
+    if not user_id:
+        return {'error': "User not found"}, 404
+    return query_hours(user_id, date_range[0], date_range[1], calendar_ids, group_by)
+
+@calendars_blueprint.route('/reports/team', methods=['GET'])
+def get_team_report():
+    # Busy hours for a team, listed by member emails or by Google Workspace domain
+    from team_reports import build_team_report, team_scope
+
+    requester = signed_in_user()
+    if requester is None:
+        return {'error': "Log in first"}, 401
+    user_email = requester['email']
+    emails = request.args.getlist('member')
+    domain = request.args.get('domain')
+    scope = team_scope(requester, emails, domain)
+    if scope is None:
+        return {'error': "Only members of your own Workspace domain can be reported on"}, 403
+
+    credentials = get_credential_manager().get_credentials(user_email)
+    if credentials is None:
+        return {'error': "No stored credentials, log in again"}, 401
+    date_range = request_date_range()
+    if date_range is None:
+        return {'error': "start and end must be ISO dates"}, 400
+    start_date, end_date = date_range
+
+    return build_team_report(
+        credentials, start_date, end_date, request.args.get('tz', 'UTC'),
+        emails=emails, domain=domain, user_key=user_email, scope=scope
+    )
+
+@calendars_blueprint.route('/exports/hours', methods=['GET'])
+def export_hours():
+    # Day rollups for any range, streamed as CSV or NDJSON. The signed-in user exports
+    # their own hours, and those of users in their own Workspace domain.
+    from exports import stream_hours_export
+
+    requester = signed_in_user()
+    if requester is None:
+        return {'error': "Log in to export hours"}, 401
+    own_email = requester['email']
+    own_domain = requester.get('hd')
+
+    domain = request.args.get('domain')
+    if domain and domain != own_domain:
+        return {'error': "Only your own Workspace domain can be exported"}, 403
+    emails = request.args.getlist('user_email') or ([] if domain else [own_email])
+    scope = {'$or': [{'email': own_email}, {'google_hd': own_domain}]} if own_domain else {'email': own_email}
+
+    date_range = request_date_range()
+    if date_range is None:
+        return {'error': "start and end must be ISO dates"}, 400
+    start_day, end_day = (day.isoformat() for day in date_range)
+    export_format = request.args.get('format', 'csv')
+
+    try:
+        chunks, content_type = stream_hours_export(
+            export_format, start_day, end_day, emails=emails, domain=domain,
+            calendar_ids=request.args.getlist('calendar_id') or None, scope=scope
+        )
+    except ValueError as error:
+        return {'error': str(error)}, 400
+
+    headers = {'Content-Disposition': f'attachment; filename="hours-{start_day}-{end_day}.{export_format}"'}
+    return Response(stream_with_context(chunks), content_type=content_type, headers=headers)
+
 def initialize_calendar_enabled_flags(user_email, all_calendars, collection):
+    user_id = find_user_id(user_email, collection)
+    user_calendars = get_user_calendars_collection()
+    stored_flags = load_calendar_flags(user_calendars, user_id) if user_id else {}
+
+    missing_flags = {}
     for calendar in all_calendars:
-        if 'enabled' not in calendar or calendar['enabled'] is None:
-            calendar['enabled'] = False
-            print(f"Calendar '{calendar['summary']}' does not have a valid value for 'enabled' key, setting it to False.")
-            save_user_calendars_to_db(user_email, all_calendars, collection)
+        if calendar['id'] in stored_flags:
+            calendar['enabled'] = stored_flags[calendar['id']]
         else:
-            print(f"Calendar '{calendar['summary']}' has value {calendar['enabled']} for 'enabled' key.")
+            calendar['enabled'] = False
+            missing_flags[calendar['id']] = False
+
+    if missing_flags:
+        logger.debug("Initialising %d calendars as disabled", len(missing_flags), extra={'user_email': user_email})
+
+    # Persist every missing flag in one write instead of once per calendar
+    if user_id:
+        save_calendar_flag_changes(user_calendars, user_id, missing_flags, only_if_missing=True)
     return None
 
 def print_calendar_enabled_state(all_calendars):
+    if not logger.isEnabledFor(logging.DEBUG):
+        return None
     for calendar in all_calendars:
-        calendar_name = calendar['summary']
-        is_enabled = calendar['enabled']
-        print(f"- {'Enabled' if is_enabled else 'Disabled'} - {calendar_name}")
+        logger.debug("- %s - %s", 'Enabled' if calendar['enabled'] else 'Disabled', calendar['summary'])
     return None
 
 def save_user_calendars_to_db(user_email, all_calendars, collection):
-    print("user_email:", user_email)
-
     try:
-        # Try to find the user in the database by their email
-        existing_user = collection.find_one({'email': user_email})
+        # Try to find the user by their email, usually from the user cache
+        users = get_user_repository(collection)
+        user_id = users.get_user_id(user_email)
 
-        # If the user exists, update their calendars
-        if existing_user:
+        # If the user exists, update their calendars in the compact stored schema
+        if user_id:
             collection.update_one(
-                {'_id': existing_user['_id']},
-                {'$set': {'calendars': all_calendars}}
+                {'_id': user_id},
+                {'$set': {'calendars': [normalize_calendar(calendar) for calendar in all_calendars]}}
             )
-            print(f"Updated Existing User: {existing_user['name']}, Email: {existing_user['email']}")
-            print("User ID:", existing_user['_id'])
+            users.invalidate(user_id)
+            logger.info("Updated calendars of existing user", extra={'user_email': user_email, 'user_id': user_id})
 
         else:
-            print(f"No user found with email: {user_email}")
+            logger.warning("No user found with email %s", user_email)
 
         return None
 
-    except Exception as e:
-        print("Error:", e)
+    except Exception:
+        logger.exception("Could not save calendars")
         return None
 
-@app.route('/calendars/<calendar_id>', methods=['PUT'])
-def toggle_calendar_enabled(calendar_id, user_info, all_calendars, collection):
-    # Find the calendar with the matching ID
-    for calendar in all_calendars:
-        if calendar['id'] == calendar_id:
-            # Toggle the enabled flag for the calendar
-            calendar['enabled'] = not calendar['enabled']
-            save_user_calendars_to_db(user_info, all_calendars, collection)
-            return calendar
-    # If the calendar ID was not found, return None
-    return None
+@calendars_blueprint.route('/calendars/<calendar_id>', methods=['PUT'])
+def toggle_calendar_enabled(calendar_id):
+    user_email = signed_in_email()
+    if user_email is None:
+        return {'error': "Log in first"}, 401
+    user_id = find_user_id(user_email, get_users_collection())
+    if not user_id:
+        return {'error': "User not found"}, 404
+
+    # Flip the one indexed flag document, the calendar list is never loaded
+    calendar = get_flag_writer().toggle(user_id, calendar_id)
+    if calendar is None:
+        return {'error': "Calendar not found"}, 404
+    return calendar
@@ -4,9 +4,120 @@ from dotenv import load_dotenv
 # Load environment variables from .env file
 load_dotenv()
 
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+def env_list(name, default):
+    value = os.environ.get(name)
+    return tuple(item.strip() for item in value.split(',') if item.strip()) if value else default
+
+def env_list_with(name, default, required):
+    # env_list that always keeps the required items, whatever the environment says
+    items = env_list(name, default)
+    return tuple(required) + tuple(item for item in items if item not in required)
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
+    # MongoDB connection pool, timeouts, and read/write concerns
+    MONGO_MAX_POOL_SIZE = env_int('MONGO_MAX_POOL_SIZE', 100)
+    MONGO_MIN_POOL_SIZE = env_int('MONGO_MIN_POOL_SIZE', 0)
+    MONGO_MAX_IDLE_TIME_MS = env_int('MONGO_MAX_IDLE_TIME_MS', 60000)
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = env_int('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)
+    MONGO_CONNECT_TIMEOUT_MS = env_int('MONGO_CONNECT_TIMEOUT_MS', 5000)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = env_int('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)
+    MONGO_SOCKET_TIMEOUT_MS = env_int('MONGO_SOCKET_TIMEOUT_MS', 10000)
+    MONGO_WRITE_CONCERN = os.environ.get('MONGO_WRITE_CONCERN', 'majority')
+    MONGO_READ_CONCERN = os.environ.get('MONGO_READ_CONCERN', 'local')
+
+    # Batch calendar toggles for this many milliseconds before writing, 0 writes immediately
+    CALENDAR_FLAG_WRITE_BEHIND_MS = env_int('CALENDAR_FLAG_WRITE_BEHIND_MS', 0)
+
+    # Send Google batch requests somewhere other than the service's default batch URI
+    GOOGLE_BATCH_URI = os.environ.get('GOOGLE_BATCH_URI')
+
+    # Serving mode: 'flask' runs the full Flask app, 'async' the aiohttp app, which
+    # only serves login and the calendar and team report routes
+    SERVER_MODE = os.environ.get('SERVER_MODE', 'flask')
+    # Send Google API calls from either serving mode somewhere other than googleapis.com
+    GOOGLE_API_ROOT = os.environ.get('GOOGLE_API_ROOT')
+    GOOGLE_HTTP_POOL_SIZE = env_int('GOOGLE_HTTP_POOL_SIZE', 100)
+    GOOGLE_HTTP_TIMEOUT = env_int('GOOGLE_HTTP_TIMEOUT', 30)
+
+    # Google API quotas: sustained requests per second and burst size, per project and per user
+    GOOGLE_PROJECT_QPS = env_int('GOOGLE_PROJECT_QPS', 50)
+    GOOGLE_PROJECT_BURST = env_int('GOOGLE_PROJECT_BURST', 100)
+    GOOGLE_USER_QPS = env_int('GOOGLE_USER_QPS', 10)
+    GOOGLE_USER_BURST = env_int('GOOGLE_USER_BURST', 20)
+    GOOGLE_MAX_RETRIES = env_int('GOOGLE_MAX_RETRIES', 5)
+
+    # Background sync workers (worker.py): shards leased across nodes, users synced per cycle
+    SYNC_SHARDS = env_int('SYNC_SHARDS', 64)
+    SYNC_SHARDS_PER_WORKER = env_int('SYNC_SHARDS_PER_WORKER', 8)
+    SYNC_LEASE_SECONDS = env_int('SYNC_LEASE_SECONDS', 60)
+    SYNC_INTERVAL_SECONDS = env_int('SYNC_INTERVAL_SECONDS', 300)
+    SYNC_BATCH_SIZE = env_int('SYNC_BATCH_SIZE', 100)
+    SYNC_CONCURRENCY = env_int('SYNC_CONCURRENCY', 16)
+    SYNC_PROCESSES = env_int('SYNC_PROCESSES', 4)
+
+    # calendarList attributes requested from Google and stored per calendar. Syncs can't
+    # merge changes without id and deleted, and rollups need primary and timeZone.
+    CALENDAR_LIST_FIELDS = env_list_with('CALENDAR_LIST_FIELDS', (
+        'summary', 'summaryOverride', 'backgroundColor', 'foregroundColor', 'colorId', 'accessRole',
+    ), required=('id', 'deleted', 'primary', 'timeZone'))
+    # Serve calendar lists synced within this many seconds straight from Mongo, 0 always syncs
+    CALENDARS_MAX_AGE_SECONDS = env_int('CALENDARS_MAX_AGE_SECONDS', 0)
+
+    # Team reports: concurrent freebusy.query calls, and the largest team one report covers
+    TEAM_REPORT_WORKERS = env_int('TEAM_REPORT_WORKERS', 8)
+    TEAM_REPORT_MAX_MEMBERS = env_int('TEAM_REPORT_MAX_MEMBERS', 1000)
+
+    # Hours exports: documents fetched per Mongo round-trip and rows per streamed chunk
+    EXPORT_BATCH_SIZE = env_int('EXPORT_BATCH_SIZE', 1000)
+    EXPORT_CHUNK_ROWS = env_int('EXPORT_CHUNK_ROWS', 500)
+
+    # Recurring series: memoized expansions, and how far ahead open-ended series are rolled up
+    RECURRENCE_CACHE_SIZE = env_int('RECURRENCE_CACHE_SIZE', 4096)
+    RECURRENCE_HORIZON_DAYS = env_int('RECURRENCE_HORIZON_DAYS', 365)
+
+    # Push notifications: public https address of /webhooks/calendar, unset disables watches
+    WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+    WATCH_TTL_SECONDS = env_int('WATCH_TTL_SECONDS', 7 * 24 * 3600)
+    WATCH_RENEW_MARGIN_SECONDS = env_int('WATCH_RENEW_MARGIN_SECONDS', 24 * 3600)
+    WEBHOOK_SYNC_THREADS = env_int('WEBHOOK_SYNC_THREADS', 4)
+
+    # Logging: default level, per-module overrides such as 'mongodb=DEBUG,webhooks=WARNING',
+    # 'text' or 'json' output, and how many records may wait for the writer thread
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_LEVELS = env_list('LOG_LEVELS', ())
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_QUEUE_SIZE = env_int('LOG_QUEUE_SIZE', 10000)
+
+    # Sampling profiler for single requests, started by sending the PROFILE_HEADER header
+    PROFILING_ENABLED = env_int('PROFILING_ENABLED', 0)
+    PROFILE_HEADER = os.environ.get('PROFILE_HEADER', 'X-Profile')
+    PROFILE_INTERVAL_MS = env_int('PROFILE_INTERVAL_MS', 5)
+
+    # Responses smaller than this are sent uncompressed
+    COMPRESS_MIN_BYTES = env_int('COMPRESS_MIN_BYTES', 1024)
+    COMPRESS_LEVEL = env_int('COMPRESS_LEVEL', 6)
+
+    # Live credentials kept in memory, and how early tokens are refreshed before expiry
+    CREDENTIAL_CACHE_SIZE = env_int('CREDENTIAL_CACHE_SIZE', 1000)
+    TOKEN_REFRESH_MARGIN_SECONDS = env_int('TOKEN_REFRESH_MARGIN_SECONDS', 300)
+    TOKEN_REFRESH_INTERVAL_SECONDS = env_int('TOKEN_REFRESH_INTERVAL_SECONDS', 60)
+
+    # Server-side sessions and the in-process cache in front of them
+    SESSION_LIFETIME_SECONDS = env_int('SESSION_LIFETIME_SECONDS', 7 * 24 * 3600)
+    SESSION_CACHE_SIZE = env_int('SESSION_CACHE_SIZE', 10000)
+    SESSION_CACHE_TTL_SECONDS = env_int('SESSION_CACHE_TTL_SECONDS', 30)
+
+    # User documents cached in memory for repeated lookups by email or _id. Other
+    # processes' writes are seen once an entry expires, so the TTL is kept short.
+    USER_CACHE_SIZE = env_int('USER_CACHE_SIZE', 10000)
+    USER_CACHE_TTL_SECONDS = env_int('USER_CACHE_TTL_SECONDS', 5)
+
 class ProductionConfig(Config):
     DEBUG = False
     DATABASE_URI = os.environ.get('PRODUCTION_DATABASE_URI')
@@ -32,3 +143,20 @@ if os.environ.get('FLASK_ENV') == 'production':
     app_config = ProductionConfig
 else:
     app_config = DevelopmentConfig
+
+CLIENT_CONFIG = {'web': {
+    'client_id': app_config.CLIENT_ID,
+    'project_id': app_config.PROJECT_ID,
+    'auth_uri': app_config.AUTH_URI,
+    'token_uri': app_config.TOKEN_URI,
+    'auth_provider_x509_cert_url': app_config.AUTH_PROVIDER_X509_CERT_URL,
+    'client_secret': app_config.CLIENT_SECRET,
+    'redirect_uris': app_config.REDIRECT_URIS,
+}}
+
+# This scope will allow the application to manage your calendars
+SCOPES = ['openid',
+          'https://www.googleapis.com/auth/userinfo.email',
+          'https://www.googleapis.com/auth/userinfo.profile',
+          'https://www.googleapis.com/auth/calendar.readonly',
+          'https://www.googleapis.com/auth/calendar']
@@ -0,0 +1,171 @@
+# Standard library imports
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Google API related imports
+from google.oauth2.credentials import Credentials
+
+# Local imports
+from app_logging import get_logger
+from config import app_config
+from metrics import count_cache, span
+from mongodb import get_collection
+from user_repository import get_user_repository
+
+logger = get_logger(__name__)
+
+USER_TOKEN_FIELDS = {'token': 1, 'refresh_token': 1, 'token_uri': 1, 'client_id': 1, 'scopes': 1, 'expiry': 1}
+
+class CredentialManager:
+    # Keeps live Credentials per user in an LRU, refreshes each user's token at most
+    # once at a time, and refreshes tokens in the background shortly before they expire
+    def __init__(self, collection=None, max_size=None, refresh_margin=None, refresh_interval=None):
+        self.collection = collection if collection is not None else get_collection('users')
+        self.max_size = max_size or app_config.CREDENTIAL_CACHE_SIZE
+        self.refresh_margin = timedelta(seconds=refresh_margin or app_config.TOKEN_REFRESH_MARGIN_SECONDS)
+        self.refresh_interval = refresh_interval or app_config.TOKEN_REFRESH_INTERVAL_SECONDS
+
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.refresh_locks = {}
+        self.transport = None
+
+        self.stop_event = threading.Event()
+        self.scheduler = None
+
+    def put(self, user_email, credentials):
+        with self.lock:
+            self.cache[user_email] = credentials
+            self.cache.move_to_end(user_email)
+            while len(self.cache) > self.max_size:
+                evicted_email, _ = self.cache.popitem(last=False)
+                self.refresh_locks.pop(evicted_email, None)
+
+    def invalidate(self, user_email):
+        with self.lock:
+            self.cache.pop(user_email, None)
+
+    def get_credentials(self, user_email):
+        with self.lock:
+            credentials = self.cache.get(user_email)
+            if credentials is not None:
+                self.cache.move_to_end(user_email)
+        count_cache('credentials', credentials is not None)
+
+        if credentials is None:
+            credentials = self.load_credentials(user_email)
+            if credentials is None:
+                return None
+            self.put(user_email, credentials)
+
+        if self.needs_refresh(credentials):
+            credentials = self.refresh(user_email, credentials)
+        return credentials
+
+    def load_credentials(self, user_email):
+        user = self.collection.find_one({'email': user_email}, USER_TOKEN_FIELDS)
+        if not user or not user.get('token'):
+            return None
+
+        credentials = Credentials(
+            token=user['token'],
+            refresh_token=user.get('refresh_token'),
+            token_uri=user.get('token_uri'),
+            client_id=user.get('client_id'),
+            client_secret=app_config.CLIENT_SECRET,
+            scopes=user.get('scopes'),
+        )
+        if user.get('expiry'):
+            credentials.expiry = datetime.fromisoformat(user['expiry'])
+        return credentials
+
+    def needs_refresh(self, credentials):
+        # Credentials.expiry is a naive UTC datetime
+        if not credentials.expiry:
+            return False
+        return credentials.expiry - self.refresh_margin <= datetime.utcnow()
+
+    def refresh_lock(self, user_email):
+        with self.lock:
+            return self.refresh_locks.setdefault(user_email, threading.Lock())
+
+    def refresh(self, user_email, credentials):
+        # Single-flight: the first caller refreshes, everyone waiting reuses its result
+        with self.refresh_lock(user_email):
+            with self.lock:
+                current = self.cache.get(user_email, credentials)
+            if not self.needs_refresh(current):
+                return current
+
+            if not current.refresh_token:
+                logger.warning("No refresh token stored, the user must log in again", extra={'user_email': user_email})
+                return current
+
+            with span('token_refresh'):
+                current.refresh(self.get_transport())
+            self.put(user_email, current)
+            self.save_refreshed_token(user_email, current)
+            return current
+
+    def get_transport(self):
+        # google.auth's requests transport is only imported once a token needs refreshing
+        if self.transport is None:
+            from google.auth.transport.requests import Request
+            self.transport = Request()
+        return self.transport
+
+    def save_refreshed_token(self, user_email, credentials):
+        token_fields = {
+            'token': credentials.token,
+            'expiry': credentials.expiry.isoformat() if credentials.expiry else None,
+            'updated_at': datetime.now().isoformat()
+        }
+        # Google may rotate the refresh token
+        if credentials.refresh_token:
+            token_fields['refresh_token'] = credentials.refresh_token
+        self.collection.update_one({'email': user_email}, {'$set': token_fields})
+        get_user_repository(self.collection).invalidate(email=user_email)
+
+    def refresh_expiring(self):
+        with self.lock:
+            expiring = [
+                (user_email, credentials)
+                for user_email, credentials in self.cache.items()
+                if self.needs_refresh(credentials)
+            ]
+
+        for user_email, credentials in expiring:
+            try:
+                self.refresh(user_email, credentials)
+            except Exception as e:
+                logger.warning("Background token refresh failed: %s", e, extra={'user_email': user_email})
+        return len(expiring)
+
+    def run_scheduler(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            self.refresh_expiring()
+
+    def start(self):
+        if self.scheduler is None:
+            self.stop_event.clear()
+            self.scheduler = threading.Thread(target=self.run_scheduler, name='token-refresh', daemon=True)
+            self.scheduler.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.scheduler is not None:
+            self.scheduler.join()
+            self.scheduler = None
+
+_credential_manager = None
+_credential_manager_lock = threading.Lock()
+
+def get_credential_manager():
+    global _credential_manager
+
+    with _credential_manager_lock:
+        if _credential_manager is None:
+            _credential_manager = CredentialManager()
+    return _credential_manager
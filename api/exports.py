@@ -0,0 +1,91 @@
+# Streaming exports of the day rollups as CSV or NDJSON. Rows flow from a Mongo
+# cursor fetched batch_size documents at a time, through a formatter that emits a
+# chunk every few hundred rows, straight into the HTTP response; nothing holds more
+# than one batch, so memory doesn't grow with the date range or the number of users.
+
+# Standard library imports
+import csv
+import io
+import json
+from itertools import islice
+
+# Local imports
+from config import app_config
+from mongodb import get_collection
+from rollups import ALL_CALENDARS, get_rollups_collection
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_COLUMNS = ('user_email', 'calendar_id', 'day', 'hours')
+
+def load_export_users(emails=None, domain=None, users=None, scope=None):
+    # {user_id: email} for the users the export covers, within the scope query if given
+    users = users if users is not None else get_collection('users')
+    if emails:
+        query = {'email': {'$in': list(emails)}}
+    elif domain:
+        query = {'google_hd': domain}
+    else:
+        return {}
+    if scope:
+        query = {'$and': [query, scope]}
+    return {user['_id']: user['email'] for user in users.find(query, {'_id': 1, 'email': 1})}
+
+def iter_rollup_rows(user_emails, start_day, end_day, calendar_ids=None, rollups=None, batch_size=None):
+    rollups = rollups if rollups is not None else get_rollups_collection()
+    query = {'user_id': {'$in': list(user_emails)}, 'day': {'$gte': start_day, '$lte': end_day}}
+    if calendar_ids:
+        query['calendar_id'] = {'$in': list(calendar_ids)}
+
+    # Sorted along the (user_id, calendar_id, day) index, so Mongo never sorts in memory
+    cursor = rollups.find(
+        query, {'_id': 0, 'user_id': 1, 'calendar_id': 1, 'day': 1, 'hours': 1}
+    ).sort([('user_id', 1), ('calendar_id', 1), ('day', 1)]).batch_size(batch_size or app_config.EXPORT_BATCH_SIZE)
+
+    try:
+        for doc in cursor:
+            yield (
+                user_emails[doc['user_id']],
+                'all' if doc['calendar_id'] == ALL_CALENDARS else doc['calendar_id'],
+                doc['day'],
+                round(doc.get('hours', 0.0), 4),
+            )
+    finally:
+        # A client that disconnects mid-export closes the generator; free the server cursor
+        cursor.close()
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+def csv_chunks(rows, chunk_rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    yield buffer.getvalue()
+
+    for chunk in chunked(rows, chunk_rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+def ndjson_chunks(rows, chunk_rows):
+    for chunk in chunked(rows, chunk_rows):
+        yield ''.join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(',', ':')) + '\n' for row in chunk)
+
+def stream_hours_export(export_format, start_day, end_day, emails=None, domain=None, calendar_ids=None, scope=None):
+    # Returns (generator of text chunks, content type); raises ValueError on a bad format
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+
+    rows = iter_rollup_rows(load_export_users(emails, domain, scope=scope), start_day, end_day, calendar_ids)
+    chunk_rows = app_config.EXPORT_CHUNK_ROWS
+    chunks = csv_chunks(rows, chunk_rows) if export_format == 'csv' else ndjson_chunks(rows, chunk_rows)
+    return chunks, EXPORT_FORMATS[export_format]
@@ -1,183 +1,90 @@
 # Flask-related imports
-from flask import Flask, current_app, session, request, jsonify, redirect
-from flask_session import Session
-from flask_session.__init__ import Session
-from flask.sessions import SecureCookieSessionInterface
-from flask_cors import CORS, cross_origin
+from flask import Blueprint, current_app, session, request, jsonify, redirect
 
 # Standard library imports
-import json
-from utils import read_json
+import threading
 
-# Security and Crypto imports
-import secrets
-from cryptography.fernet import Fernet
-from itsdangerous import URLSafeTimedSerializer
+# Local imports
+from config import CLIENT_CONFIG, SCOPES
+from credentials_manager import get_credential_manager
+from app_logging import get_logger
+from metrics import span
 
-# aiohttp related imports
-import asyncio
-import aiohttp
-from aiohttp import web
+logger = get_logger(__name__)
 
-# Google API related imports
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import Flow
-from google_auth_oauthlib.flow import InstalledAppFlow
+# Routes are registered on an app built by create_app() in app.py
+auth_blueprint = Blueprint('google_auth_session', __name__)
 
-# Local imports
-from config import app_config
-from mongodb import MongoDBClient
-
-print(f"app with secrets_file:  'secrets/client_secrets.json'")
-print(f"app with client_id:     {app_config.CLIENT_ID}")
-print(f"app with project_id:    {app_config.PROJECT_ID}")
-print(f"app with auth_uri:      {app_config.AUTH_URI}")
-print(f"app with token_uri:     {app_config.TOKEN_URI}")
-print(f"app with auth_cert_url: {app_config.AUTH_PROVIDER_X509_CERT_URL}")
-print(f"app with client_secret: {app_config.CLIENT_SECRET}")
-print(f"app with redirect_uri:  {app_config.REDIRECT_URIS}")
-
-print(f"app with DATABASE_URI:  {app_config.DATABASE_URI}")
-print(f"app with DATABASE_NAME:  {app_config.DATABASE_NAME}")
-
-CLIENT_CONFIG = {'web': {
-    'client_id': app_config.CLIENT_ID,
-    'project_id': app_config.PROJECT_ID,
-    'auth_uri': app_config.AUTH_URI,
-    'token_uri': app_config.TOKEN_URI,
-    'auth_provider_x509_cert_url': app_config.AUTH_PROVIDER_X509_CERT_URL,
-    'client_secret': app_config.CLIENT_SECRET,
-    'redirect_uris': app_config.REDIRECT_URIS,
-}}
-
-# This scope will allow the application to manage your calendars
-SCOPES = ['openid',
-          'https://www.googleapis.com/auth/userinfo.email',
-          'https://www.googleapis.com/auth/userinfo.profile',
-          'https://www.googleapis.com/auth/calendar.readonly',
-          'https://www.googleapis.com/auth/calendar']
-
-print("-------- Global Set Up App and Session ---------")
-# Create Flask app instance
-app = Flask("__google_auth_session__")
-print(f"app with Flask:     {app}")
-
-print("-------- Encrypt Session Cookie ----------------")
-
-cookie_key = read_json("secrets/cookie_secrets.json", "cookie_key")
-print(f"cookie_key:         {app_config.COOKIE_KEY}")
-
-app.secret_key = app_config.COOKIE_KEY
-print(f"app.secret_key:     {app.secret_key}")
-
-# Set up a timed serializer for encryption and signing
-serializer = URLSafeTimedSerializer(app.secret_key)
-
-class EncryptedCookieSessionInterface(SecureCookieSessionInterface):
-    def get_signing_serializer(self, app):
-        return serializer
-
-app.session_interface = EncryptedCookieSessionInterface()
-print(f"app with cookie:    {app}")
-
-# Initialize the Flask session interface
-Session(app)
-
-print("-------- Set Up Cross-Origin Resource Sharing --")
-CORS(app)
-print(f"app with CORS:      {app}")
-
-# Initialize endpoint
-@app.route('/initialize_app', methods=['GET'])
-async def initialize_app():
-    # from google_auth_session import login, auth, logout
-    # from calendars import initialize_calendar_enabled_flags, get_user_calendars, save_user_calendars_to_db, toggle_calendar_enabled
-
-    print("-------- Init DB -------------------------------")
-    # Initialize MongoDB client
-    mongo_client = MongoDBClient(app)
-    app.config['mongo_client'] = mongo_client
-
-    print("-------- Return App ----------------------------")
-
-    return app
+DASHBOARD_URL = 'http://localhost:3001/dashboard'
 
-# Auth endpoint
-@app.route('/auth', methods=['GET'])
-async def auth():
+_mongo_client_lock = threading.Lock()
 
-    app = current_app
-    print(f"app /auth: {app}")
+def get_app_mongo_client():
+    # Created on first use, so building the app never waits on Mongo
+    app = current_app._get_current_object()
+    with _mongo_client_lock:
+        mongo_client = app.extensions.get('mongo_client')
+        if mongo_client is None:
+            from mongodb import MongoDBClient
+            mongo_client = app.extensions['mongo_client'] = MongoDBClient(app)
+    return mongo_client
+
+def new_flow(redirect_uri):
+    # google_auth_oauthlib pulls in oauthlib and requests, so it is only imported when a flow is needed
+    from google_auth_oauthlib.flow import Flow
+    return Flow.from_client_config(client_config=CLIENT_CONFIG, scopes=SCOPES, redirect_uri=redirect_uri)
+
+# Auth endpoint
+@auth_blueprint.route('/auth', methods=['GET'])
+def auth():
+    from api_scheduler import execute_request
+    from services import get_service
 
-    mongo_client = current_app.config['mongo_client']
-    collection = mongo_client.connect_to_mongodb()
+    mongo_client = get_app_mongo_client()
 
-    print("-------- OAuth Values Returned in /auth --------")
     # Create a flow instance using the client config and scopes
-    flow = Flow.from_client_secrets_file(
-        client_secrets_file=client_secrets_file,
-        scopes=SCOPES,
-        redirect_uri=app_config.REDIRECT_URIS
-    )
-    print(f"Flow: {flow}")
+    flow = new_flow(current_app.config['REDIRECT_URIS'])
 
     # Get the authorization code from the request
     code = request.args.get('code', None)
-    print(f"Code: {code}")
 
     # If there is no authorization code, return an error
     if not code:
-        return web.HTTPBadRequest(text="Authorization code not found")
+        return {'error': "Authorization code not found"}, 400
 
     # Otherwise, exchange the authorization code for credentials
-    flow.fetch_token(code=code)
+    with span('oauth_fetch_token'):
+        flow.fetch_token(code=code)
     credentials = flow.credentials
-    print(f"Credentials obtained: {credentials}")
 
     # Get the user's information from the Google API
-    service = build('oauth2', 'v2', credentials=credentials)
-    google_user = service.userinfo().get().execute()
-    print("-------- Get Google User -----------------------")
-    print("Google User Obtained:", json.dumps(google_user, indent=2))
-
-    print("-------- Connect to MongoDB --------------------")
-    collection = mongo_client.connect_to_mongodb()
+    service = get_service('oauth2', 'v2', credentials=credentials)
+    google_user = execute_request(service.userinfo().get())
+    logger.debug("Google user obtained", extra={'google_user': google_user})
 
-    print("-------- Save/Upate User in MongoDB ------------")
     mongo_client.save_or_update_user(google_user, credentials)
 
-    print("-------- Persist the Session Data in /auth -----")
+    # Keep the fresh credentials in memory so later requests skip Mongo and refreshes
+    get_credential_manager().put(google_user['email'], credentials)
+
+    # Persist the session data under a new session id
+    session.regenerate()
     session['google_user'] = google_user
     session['credentials'] = credentials.to_json()
 
-    # Redirect the user to the dashboard
-    url = 'http://localhost:3001/dashboard'
-
-    # Return the response with headers and auth url
+    # Return the response with headers and the dashboard url
     headers = {'Content-Type': 'application/json'}
-    response_data = {'url': url}
+    response_data = {'url': DASHBOARD_URL}
     return response_data, 200, headers
 
-@app.route("/sign-up", methods=['GET'])
+@auth_blueprint.route("/sign-up", methods=['GET'])
 async def sign_up():
-
-    print("-------- Connecting to OAuth at /sign_up -------")
-
-    app = current_app
-    print(f"app /sign-up: {app}")
-
     # Create a flow instance using the client config and scopes
-    flow = Flow.from_client_config(
-        client_config=CLIENT_CONFIG,
-        scopes=SCOPES,
-        redirect_uri=app_config.REDIRECT_URIS
-    )
-    print(f"Flow: {flow}")
+    flow = new_flow(current_app.config['REDIRECT_URIS'])
 
     # Generate the authorization URL and store the flow in the session
     auth_url, _ = flow.authorization_url()
-    print(f"Auth URL: {auth_url}")
+    logger.debug("Redirecting to Google sign-up")
 
     # Return the response with headers and auth url
     # headers = {'Content-Type': 'application/json'}
@@ -201,53 +108,25 @@ async def sign_up():
 #     # User is authenticated, load dashboard
 #     return web.Response(text='Welcome to the dashboard!')
 
-@app.route("/login", methods=['GET'])
-async def login(request):
-    app = current_app
-    print(f"app /login: {app}")
-
-    collection = mongo_client.connect_to_mongodb()
-
-    # Get the session from the request
-    # session = await get_session(request)
-
-    # Check if the required keys are present in the session
+@auth_blueprint.route("/login", methods=['GET'])
+def login():
+    # A signed-in user goes straight to the dashboard
     if 'google_user' in session and 'credentials' in session:
-        print("-------- User is Already Logged In -------------")
-        # Get the user's information from the session
-        google_user = session['google_user']
-        credentials = Credentials.from_authorized_user_info(info=json.loads(session['credentials']))
-
-        # Redirect the user to the dashboard
-        return web.HTTPFound('/dashboard')
-    else:
-        print("-------- Connecting to OAuth at /login ---------")
-        # Create a flow instance using the client config and scopes
-        # flow = Flow.from_client_secrets_file(
-        #     client_secrets_file=client_secrets_file,
-        flow = Flow.from_client_config(
-            client_config=CLIENT_CONFIG,
-            scopes=SCOPES,
-            redirect_uri=REDIRECT_URI
-        )
-        print(f"Flow: {flow}")
-
-        # Generate the authorization URL and store the flow in the session
-        auth_url, _ = flow.authorization_url()
-        print(f"Auth URL: {auth_url}")
-
-        # Redirect to the authorization URL
-        return web.HTTPFound(auth_url)
+        logger.debug("User is already logged in")
+        return redirect(DASHBOARD_URL, code=302)
 
-# Logout endpoint
-@app.route('/logout', methods=['GET'])
-async def logout(request):
+    # Otherwise start the Google consent flow
+    flow = new_flow(current_app.config['REDIRECT_URIS'])
+    auth_url, _ = flow.authorization_url()
+    logger.debug("Redirecting to Google login")
+    return redirect(auth_url, code=302)
 
-    print("-------- Logging Out, Goodbye! -----------------")
-    # Remove the user and credentials from the session
-    session = await get_session(request)
+# Logout endpoint
+@auth_blueprint.route('/logout', methods=['GET'])
+def logout():
+    # An emptied session is deleted from the store along with its cookie
     session.clear()
-    return web.HTTPFound('/')
+    return redirect('/', code=302)
 
 # Helper function to convert the credentials object to a dictionary
 def credentials_to_dict(credentials):
@@ -260,18 +139,20 @@ def credentials_to_dict(credentials):
         'scopes': credentials.scopes
     }
 
-@app.route('/oauth_callback')
+# Google Calendar push notifications
+@auth_blueprint.route('/webhooks/calendar', methods=['POST'])
+def calendar_webhook():
+    from webhooks import get_notification_handler
+    status = get_notification_handler().handle(request.headers)
+    return '', status
+
+@auth_blueprint.route('/oauth_callback')
 def oauth_callback():
     code = request.args.get('code')
     state = request.args.get('state')
     if state != session.pop('state', None):
         return 'Invalid state parameter', 400
-    flow = Flow.from_client_config(
-        client_config=CLIENT_CONFIG,
-        scopes=SCOPES,
-        redirect_uri=REDIRECT_URI
-    )
-    print(f"Flow: {flow}")
+    flow = new_flow(current_app.config['REDIRECT_URIS'])
 
     flow.fetch_token(code=code)
     # store the credentials in the session or database
@@ -0,0 +1,213 @@
+# Standard library imports
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+# Third-party package imports
+import numpy as np
+
+# Local imports
+from app_logging import get_logger
+from batching import list_events_batched
+from recurrence import compact_series, get_occurrence_cache, original_start
+
+logger = get_logger(__name__)
+
+SECONDS_PER_HOUR = 3600.0
+
+# Only the fields the hours engine reads are requested from Google; recurring
+# events come back as one master plus its exceptions and are expanded locally
+EVENT_FIELDS = 'nextPageToken,items(id,status,transparency,start,end,recurrence,recurringEventId,originalStartTime)'
+
+class EventTable:
+    # Events stored column-wise: epoch-second start/end arrays plus an index into
+    # an interned list of calendar ids, so the hours math never touches dicts
+    def __init__(self, starts, ends, calendar_index, calendar_ids):
+        self.starts = starts
+        self.ends = ends
+        self.calendar_index = calendar_index
+        self.calendar_ids = calendar_ids
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def from_events(cls, events_by_calendar, window_start, window_end):
+        calendar_ids = []
+        starts = []
+        ends = []
+        calendar_index = []
+
+        for calendar_id, events in events_by_calendar.items():
+            index = len(calendar_ids)
+            calendar_ids.append(calendar_id)
+            for interval in event_intervals(events, window_start, window_end, calendar_id):
+                starts.append(interval[0])
+                ends.append(interval[1])
+                calendar_index.append(index)
+
+        return cls(
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            np.array(calendar_index, dtype=np.int32),
+            calendar_ids,
+        )
+
+    def for_calendar(self, calendar_id):
+        mask = self.calendar_index == self.calendar_ids.index(calendar_id)
+        return self.starts[mask], self.ends[mask]
+
+def event_interval(event):
+    # Cancelled, free ("transparent") and all-day events don't count as busy time
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return None
+
+    start = event.get('start', {}).get('dateTime')
+    end = event.get('end', {}).get('dateTime')
+    if not start or not end:
+        return None
+
+    start_ts = parse_timestamp(start)
+    end_ts = parse_timestamp(end)
+    if end_ts <= start_ts:
+        return None
+    return start_ts, end_ts
+
+def event_intervals(events, window_start, window_end, series_scope=None):
+    # Busy intervals from a singleEvents=False listing: one-off events and exceptions
+    # as they are, recurring masters expanded in the window minus their exceptions
+    masters = {}
+    overridden = {}
+    intervals = []
+    for event in events:
+        if event.get('recurrence'):
+            masters[event['id']] = event
+            continue
+        if event.get('recurringEventId'):
+            replaced = original_start(event)
+            if replaced is not None:
+                overridden.setdefault(event['recurringEventId'], []).append(replaced)
+        interval = event_interval(event)
+        if interval is not None:
+            intervals.append(interval)
+
+    cache = get_occurrence_cache()
+    for event_id, event in masters.items():
+        series = compact_series(event)
+        if series is None:
+            continue
+        occurrence_starts = cache.occurrences((series_scope, event_id), series, window_start, window_end)
+        if event_id in overridden:
+            occurrence_starts = occurrence_starts[~np.isin(occurrence_starts, overridden[event_id])]
+        intervals.extend(zip(occurrence_starts.tolist(), (occurrence_starts + series['duration']).tolist()))
+    return intervals
+
+def parse_timestamp(value):
+    # RFC 3339 from Google, e.g. '2023-05-01T10:00:00-07:00' or '...Z'
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return int(datetime.fromisoformat(value).timestamp())
+
+def merge_intervals(starts, ends):
+    # Union of possibly overlapping intervals, so overlaps are only counted once
+    if len(starts) == 0:
+        return starts, ends
+
+    order = np.argsort(starts, kind='stable')
+    starts = starts[order]
+    ends = ends[order]
+
+    # A new block starts wherever an interval begins after every earlier one has ended
+    running_end = np.maximum.accumulate(ends)
+    new_block = np.empty(len(starts), dtype=bool)
+    new_block[0] = True
+    new_block[1:] = starts[1:] > running_end[:-1]
+
+    block_starts = np.flatnonzero(new_block)
+    return starts[block_starts], np.maximum.reduceat(ends, block_starts)
+
+def busy_seconds_in_bins(starts, ends, bin_edges):
+    # Busy seconds between consecutive bin edges
+    return np.diff(cumulative_busy_seconds(starts, ends, bin_edges))
+
+def cumulative_busy_seconds(starts, ends, points):
+    # Busy seconds before each point, read off the cumulative busy-time curve
+    points = np.asarray(points, dtype=np.int64)
+    merged_starts, merged_ends = merge_intervals(starts, ends)
+    if len(merged_starts) == 0:
+        return np.zeros(len(points), dtype=np.float64)
+
+    durations = (merged_ends - merged_starts).astype(np.float64)
+    busy_after = np.cumsum(durations)
+    busy_before = busy_after - durations
+
+    # Merged blocks are disjoint and sorted, so the curve points are increasing
+    xs = np.empty(2 * len(merged_starts), dtype=np.float64)
+    ys = np.empty(2 * len(merged_starts), dtype=np.float64)
+    xs[0::2] = merged_starts
+    xs[1::2] = merged_ends
+    ys[0::2] = busy_before
+    ys[1::2] = busy_after
+
+    return np.interp(points.astype(np.float64), xs, ys)
+
+def day_edges(start_date, end_date, tz_name='UTC'):
+    # Local midnights from start_date through end_date inclusive, as epoch seconds
+    tz = ZoneInfo(tz_name)
+    days = (end_date - start_date).days + 1
+    dates = [start_date + timedelta(days=offset) for offset in range(days + 1)]
+    edges = [int(datetime.combine(day, time.min, tzinfo=tz).timestamp()) for day in dates]
+    return dates[:-1], np.array(edges, dtype=np.int64)
+
+def busy_hours_by_day(table, start_date, end_date, tz_name='UTC'):
+    dates, edges = day_edges(start_date, end_date, tz_name)
+    hours = busy_seconds_in_bins(table.starts, table.ends, edges) / SECONDS_PER_HOUR
+    return {day.isoformat(): float(value) for day, value in zip(dates, hours)}
+
+def busy_hours_by_week(table, start_date, end_date, tz_name='UTC'):
+    # Weeks start on Monday and are keyed by the Monday's date
+    first_monday = start_date - timedelta(days=start_date.weekday())
+    last_sunday = end_date + timedelta(days=6 - end_date.weekday())
+    dates, edges = day_edges(first_monday, last_sunday, tz_name)
+    week_edges = edges[::7]
+    hours = busy_seconds_in_bins(table.starts, table.ends, week_edges) / SECONDS_PER_HOUR
+    return {week.isoformat(): float(value) for week, value in zip(dates[::7], hours)}
+
+def busy_hours_by_calendar(table, time_min=None, time_max=None):
+    # Each calendar is unioned on its own; the total unions across all of them
+    if time_min is None:
+        time_min = int(table.starts.min()) if len(table) else 0
+    if time_max is None:
+        time_max = int(table.ends.max()) if len(table) else 0
+    edges = np.array([time_min, time_max], dtype=np.int64)
+
+    hours = {}
+    for calendar_id in table.calendar_ids:
+        starts, ends = table.for_calendar(calendar_id)
+        hours[calendar_id] = float(busy_seconds_in_bins(starts, ends, edges)[0] / SECONDS_PER_HOUR)
+    hours['total'] = float(busy_seconds_in_bins(table.starts, table.ends, edges)[0] / SECONDS_PER_HOUR)
+    return hours
+
+def load_event_table(cal_service, calendar_ids, time_min, time_max, user_key=None):
+    # Every calendar's events come back in one batched round-trip per page
+    events_by_calendar, errors = list_events_batched(
+        cal_service, calendar_ids, time_min, time_max, fields=EVENT_FIELDS, user_key=user_key, single_events=False
+    )
+    for calendar_id, error in errors.items():
+        logger.warning("Could not load events: %s", error, extra={'calendar_id': calendar_id})
+    return EventTable.from_events(events_by_calendar, parse_timestamp(time_min), parse_timestamp(time_max))
+
+def to_rfc3339(day, tz_name='UTC'):
+    return datetime.combine(day, time.min, tzinfo=ZoneInfo(tz_name)).astimezone(timezone.utc).isoformat()
+
+def compute_user_hours(cal_service, calendar_ids, start_date, end_date, tz_name='UTC', user_key=None):
+    # Busy hours per day, week, and calendar for the enabled calendars
+    time_min = to_rfc3339(start_date, tz_name)
+    time_max = to_rfc3339(end_date + timedelta(days=1), tz_name)
+    table = load_event_table(cal_service, calendar_ids, time_min, time_max, user_key)
+
+    window = (parse_timestamp(time_min), parse_timestamp(time_max))
+    return {
+        'by_day': busy_hours_by_day(table, start_date, end_date, tz_name),
+        'by_week': busy_hours_by_week(table, start_date, end_date, tz_name),
+        'by_calendar': busy_hours_by_calendar(table, *window),
+    }
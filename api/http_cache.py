@@ -0,0 +1,125 @@
+# Conditional GET and compression for JSON responses, shared by the Flask and aiohttp
+# routes. Each route builds the payload, then hands it here with the request headers
+# and gets back the status, headers and body to send. Routes whose data carries a
+# stored version tag it with version_etag() and call not_modified_response() first,
+# so a revalidation is answered before the payload is loaded at all.
+
+# Standard library imports
+import gzip
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+# Brotli is optional, gzip is used when it isn't installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Local imports
+from config import app_config
+
+def encode_json(payload):
+    # Sorted keys keep the bytes, and so the ETag, stable for the same data
+    return json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+
+def etag_for(body):
+    # Weak, because the gzip and brotli bodies share the tag of the JSON they encode
+    return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+def version_etag(*version):
+    # Tag for data identified by its stored version, known before the data is loaded
+    return etag_for(json.dumps([str(part) for part in version]).encode())
+
+def strip_weak(etag):
+    return etag[2:] if etag.startswith('W/') else etag
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match always uses weak comparison
+    return strip_weak(etag) in (strip_weak(candidate.strip()) for candidate in if_none_match.split(','))
+
+def http_date(timestamp):
+    # Stored timestamps are naive local-time ISO strings
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    return format_datetime(timestamp.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+def not_modified_since(if_modified_since, last_modified):
+    if not if_modified_since or not last_modified:
+        return False
+    try:
+        return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+
+    if brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(app_config.COMPRESS_LEVEL, 11))
+    return gzip.compress(body, compresslevel=min(app_config.COMPRESS_LEVEL, 9))
+
+def cache_headers(etag, last_modified=None):
+    headers = {
+        'ETag': etag,
+        # Browsers keep the response but check back with the ETag every time
+        'Cache-Control': 'private, no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    return headers
+
+def is_not_modified(request_headers, headers):
+    # If-None-Match wins when both are sent
+    if_none_match = request_headers.get('If-None-Match')
+    if if_none_match:
+        return etag_matches(if_none_match, headers['ETag'])
+    return not_modified_since(request_headers.get('If-Modified-Since'), headers.get('Last-Modified'))
+
+def not_modified_response(request_headers, etag, last_modified=None):
+    # (304, headers, body) when the client already has this version, otherwise None
+    headers = cache_headers(etag, last_modified)
+    if is_not_modified(request_headers, headers):
+        return 304, headers, b''
+    return None
+
+def conditional_json_response(request_headers, payload, last_modified=None, etag=None):
+    # Returns (status, headers, body); unchanged data costs a 304 with no body.
+    # Without a version etag the payload is encoded to hash it.
+    body = encode_json(payload) if etag is None else None
+    headers = cache_headers(etag or etag_for(body), last_modified)
+    if is_not_modified(request_headers, headers):
+        return 304, headers, b''
+
+    if body is None:
+        body = encode_json(payload)
+
+    headers['Content-Type'] = 'application/json'
+    encoding = choose_encoding(request_headers.get('Accept-Encoding'))
+    if encoding and len(body) >= app_config.COMPRESS_MIN_BYTES:
+        body = compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return 200, headers, body
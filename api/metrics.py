@@ -0,0 +1,309 @@
+# In-process metrics and timing, exposed in Prometheus text format on /metrics.
+#
+#   with span('google', method='calendar.events.list'):
+#       ...
+#
+# Spans feed a per-stage latency histogram and are also collected per request, so a
+# slow request can be broken down into its Google, Mongo and OAuth stages. Routes get
+# their own histogram through the Flask hooks or the aiohttp middleware below.
+
+# Standard library imports
+import contextvars
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+# MongoDB-related imports
+from pymongo import monitoring
+
+# Local imports
+from app_logging import get_logger
+from config import app_config
+
+logger = get_logger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # label key -> [bucket counts..., sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{format_labels(key, [('le', bound)])} {count}")
+                lines.append(f"{self.name}_bucket{format_labels(key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{format_labels(key)} {series[-1]}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text):
+        return self.register(Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, buckets))
+
+    def add_collector(self, collector):
+        # collector() returns {metric name: value}, read as gauges at scrape time
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                logger.exception("Metrics collector failed")
+                continue
+            for name, value in gauges.items():
+                lines.extend([f"# TYPE {name} gauge", f"{name} {value}"])
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram('app_stage_duration_seconds', 'Time spent in one stage of a request.')
+stage_errors = registry.counter('app_stage_errors_total', 'Stages that raised an exception.')
+request_seconds = registry.histogram('app_request_duration_seconds', 'Time to serve a request, by route.')
+request_errors = registry.counter('app_request_errors_total', 'Requests answered with a 5xx status.')
+cache_requests = registry.counter('app_cache_requests_total', 'In-process cache lookups by cache and result.')
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stages timed while serving the current request: list of (stage, seconds)
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+def record_stage(stage, seconds, failed=False, **labels):
+    stage_seconds.observe(seconds, stage=stage, **labels)
+    if failed:
+        stage_errors.inc(stage=stage, **labels)
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((stage, seconds))
+
+@contextmanager
+def span(stage, **labels):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started, failed, **labels)
+
+def count_cache(cache, hit):
+    cache_requests.inc(cache=cache, result='hit' if hit else 'miss')
+
+def render_metrics():
+    return registry.render()
+
+class MongoCommandTimer(monitoring.CommandListener):
+    # Times every command any Mongo client in the process sends, sync or motor
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        record_stage('mongo', event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        record_stage('mongo', event.duration_micros / 1e6, True, command=event.command_name)
+
+class SamplingProfiler:
+    # Samples one thread's stack every few milliseconds; the result is in the
+    # collapsed format flame graph tools read: 'outer;inner;leaf count'
+    def __init__(self, thread_id, interval=None):
+        self.thread_id = thread_id
+        self.interval = (interval or app_config.PROFILE_INTERVAL_MS) / 1000.0
+        self.samples = StackCounter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='sampling-profiler', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = ';'.join(f"{entry.name} ({entry.filename}:{entry.lineno})"
+                             for entry in traceback.extract_stack(frame))
+            self.samples[stack] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        return self
+
+    def collapsed(self):
+        return '\n'.join(f"{stack} {count}" for stack, count in self.samples.most_common())
+
+def wants_profile(headers):
+    return bool(app_config.PROFILING_ENABLED) and bool(headers.get(app_config.PROFILE_HEADER))
+
+def begin_request(headers):
+    # Returns the state end_request needs; the profiler only runs when asked for
+    spans = []
+    token = _request_spans.set(spans)
+    profiler = SamplingProfiler(threading.get_ident()).start() if wants_profile(headers) else None
+    return time.perf_counter(), spans, token, profiler
+
+def end_request(state, route, method, status):
+    started, spans, token, profiler = state
+    elapsed = time.perf_counter() - started
+    _request_spans.reset(token)
+
+    request_seconds.observe(elapsed, route=route, method=method)
+    if status >= 500:
+        request_errors.inc(route=route, method=method, status=status)
+
+    stages = {}
+    for stage, seconds in spans:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    logger.debug("Request timing", extra={
+        'route': route, 'method': method, 'status': status,
+        'seconds': round(elapsed, 4), 'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+    })
+
+    if profiler is not None:
+        profiler.stop()
+        logger.info("Request profile\n%s", profiler.collapsed(), extra={'route': route, 'samples': sum(profiler.samples.values())})
+
+def instrument_flask_app(app):
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_state = begin_request(request.headers)
+
+    @app.after_request
+    def record_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def stop_request_timer(error=None):
+        # Teardown runs even when the view raised, so the profiler always stops
+        state = g.pop('metrics_state', None)
+        if state is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            end_request(state, route, request.method, g.pop('metrics_status', 500))
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render_metrics(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+    return app
+
+def metrics_middleware():
+    from aiohttp import web
+
+    @web.middleware
+    async def middleware(request, handler):
+        # Profiling samples the event loop thread, so it sees every task, not just this one
+        state = begin_request(request.headers)
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as error:
+            status = error.status
+            raise
+        finally:
+            resource = request.match_info.route.resource
+            end_request(state, resource.canonical if resource is not None else 'unmatched', request.method, status)
+
+    return middleware
+
+async def aiohttp_metrics(request):
+    from aiohttp import web
+    return web.Response(body=render_metrics().encode(), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+def default_gauges():
+    # Imported here because these modules record their own timings through this one
+    from api_scheduler import get_scheduler
+    from app_logging import get_dropped_count
+    from recurrence import get_occurrence_cache
+    from services import get_service_cache_stats
+    from user_repository import get_user_cache_stats
+
+    gauges = {f"app_google_scheduler_{name}": value for name, value in get_scheduler().get_stats().items()}
+    gauges.update({f"app_discovery_cache_{name}": value for name, value in get_service_cache_stats().items()})
+    gauges.update({f"app_occurrence_cache_{name}": value for name, value in get_occurrence_cache().get_stats().items()})
+    gauges.update({f"app_user_cache_{name}": value for name, value in get_user_cache_stats().items()})
+    gauges['app_log_records_dropped'] = get_dropped_count()
+    return gauges
+
+registry.add_collector(default_gauges)
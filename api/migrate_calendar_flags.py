@@ -0,0 +1,71 @@
+# Copies the 'enabled' flags stored inside each user's 'calendars' array into
+# the user_calendars collection. Safe to re-run: existing flags are never overwritten.
+#
+#   python migrate_calendar_flags.py [--dry-run] [--batch-size 500] [--unset-array-flags]
+
+# Standard library imports
+import argparse
+
+# Local imports
+from app_logging import configure_logging
+from calendar_flags import flag_update, get_user_calendars_collection
+from mongodb import MongoDBClient
+
+def migrate_calendar_flags(users, user_calendars, batch_size=500, dry_run=False):
+    migrated = 0
+    requests = []
+
+    cursor = users.find(
+        {'calendars': {'$exists': True}},
+        {'calendars.id': 1, 'calendars.enabled': 1}
+    ).batch_size(batch_size)
+
+    for user in cursor:
+        for calendar in user.get('calendars') or []:
+            requests.append(flag_update(
+                user['_id'], calendar['id'], calendar.get('enabled') or False, only_if_missing=True
+            ))
+
+        if len(requests) >= batch_size:
+            migrated += write_batch(user_calendars, requests, dry_run)
+            requests = []
+
+    if requests:
+        migrated += write_batch(user_calendars, requests, dry_run)
+
+    return migrated
+
+def write_batch(user_calendars, requests, dry_run):
+    if not dry_run:
+        user_calendars.bulk_write(requests, ordered=False)
+    return len(requests)
+
+def unset_array_flags(users):
+    # Drop the old copies once user_calendars is the source of truth
+    return users.update_many(
+        {'calendars.enabled': {'$exists': True}},
+        {'$unset': {'calendars.$[].enabled': ''}}
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate calendar enabled flags to user_calendars.")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--unset-array-flags', action='store_true')
+    args = parser.parse_args()
+    configure_logging()
+
+    # Creating the client also makes sure the (user_id, calendar_id) index exists
+    mongo_client = MongoDBClient(None)
+    users = mongo_client.connect_to_mongodb()
+    user_calendars = get_user_calendars_collection()
+
+    migrated = migrate_calendar_flags(users, user_calendars, args.batch_size, args.dry_run)
+    print(f"{'Would migrate' if args.dry_run else 'Migrated'} {migrated} calendar flags.")
+
+    if args.unset_array_flags and not args.dry_run:
+        result = unset_array_flags(users)
+        print(f"Removed array flags from {result.modified_count} users.")
+
+if __name__ == '__main__':
+    main()
@@ -1,142 +1,221 @@
 # mongo.py
 #Standard library imports
-import json
+import os
+import threading
+import zlib
 from datetime import datetime
 
 #Third-party package imports
 from google.oauth2.credentials import Credentials
-from pymongo import MongoClient
+from pymongo import ASCENDING, MongoClient, ReturnDocument
 from bson.objectid import ObjectId
 
 #Local imports
+from app_logging import get_logger
+from metrics import MongoCommandTimer
 from secrets.db_secrets import db_connection_string, db_name
 from config import app_config
 
+logger = get_logger(__name__)
+
+# Times every command sent by the clients created from mongo_client_options()
+_command_timer = MongoCommandTimer()
+
+# One MongoClient per process, shared by every collection handle
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+def mongo_client_options():
+    write_concern = app_config.MONGO_WRITE_CONCERN
+    if write_concern.isdigit():
+        write_concern = int(write_concern)
+
+    return {
+        'maxPoolSize': app_config.MONGO_MAX_POOL_SIZE,
+        'minPoolSize': app_config.MONGO_MIN_POOL_SIZE,
+        'maxIdleTimeMS': app_config.MONGO_MAX_IDLE_TIME_MS,
+        'waitQueueTimeoutMS': app_config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        'connectTimeoutMS': app_config.MONGO_CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': app_config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        'socketTimeoutMS': app_config.MONGO_SOCKET_TIMEOUT_MS,
+        'w': write_concern,
+        'readConcernLevel': app_config.MONGO_READ_CONCERN,
+        # Don't open sockets until the first operation, so a client created
+        # before a fork never carries live connections into the child
+        'connect': False,
+        'event_listeners': [_command_timer],
+    }
+
 def get_mongo_client():
-    client = MongoClient(app_config.DATABASE_URI)
-    return client
+    global _client, _client_pid
+
+    # A forked worker must not reuse the parent's pools, so key the client on the pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(app_config.DATABASE_URI, **mongo_client_options())
+                _client_pid = pid
+    return _client
+
+def get_database():
+    return get_mongo_client()[app_config.DATABASE_NAME]
+
+def get_collection(name):
+    return get_database()[name]
+
+def close_mongo_client():
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+def _reset_client_after_fork():
+    # The child gets a fresh lock and creates its own client on first use
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+INDEXES = [
+    # Unique lookups for login
+    ('users', [('email', ASCENDING)], {'unique': True, 'name': 'email_unique'}),
+    ('users', [('google_id', ASCENDING)], {'unique': True, 'sparse': True, 'name': 'google_id_unique'}),
+
+    # Per-user calendar flags are looked up and toggled by (user_id, calendar_id)
+    ('user_calendars', [('user_id', ASCENDING), ('calendar_id', ASCENDING)],
+     {'unique': True, 'name': 'user_calendar_unique'}),
+
+    # Hour rollups are summed by day range, events are found by the days they overlap
+    ('hours_rollups', [('user_id', ASCENDING), ('calendar_id', ASCENDING), ('day', ASCENDING)],
+     {'unique': True, 'name': 'user_calendar_day_unique'}),
+    ('calendar_events', [('user_id', ASCENDING), ('calendar_id', ASCENDING), ('event_id', ASCENDING)],
+     {'unique': True, 'name': 'user_calendar_event_unique'}),
+    ('calendar_events', [('user_id', ASCENDING), ('end', ASCENDING)], {'name': 'user_event_end'}),
+    # Exceptions are looked up by the recurring series they belong to
+    ('calendar_events', [('user_id', ASCENDING), ('recurring_event_id', ASCENDING)],
+     {'name': 'user_recurring_event'}),
+
+    # Background sync workers pick due users shard by shard
+    ('users', [('sync_shard', ASCENDING), ('next_sync_at', ASCENDING)], {'name': 'sync_shard_due'}),
+
+    # Push channels are found by channel id on every notification
+    ('watch_channels', [('channel_id', ASCENDING)], {'unique': True, 'name': 'channel_id_unique'}),
+    ('watch_channels', [('user_id', ASCENDING), ('calendar_id', ASCENDING)],
+     {'unique': True, 'name': 'user_calendar_channel_unique'}),
+
+    # Server-side sessions are removed by Mongo once expires_at has passed
+    ('sessions', [('expires_at', ASCENDING)], {'expireAfterSeconds': 0, 'name': 'session_expiry_ttl'}),
+]
+
+# Fields returned by the login upsert, and cached for the requests that follow it
+LOGIN_USER_FIELDS = ('_id', 'email', 'created_at', 'updated_at')
 
 class MongoDBClient:
     def __init__(self, app):
-        self.client = MongoClient(app_config.DATABASE_URI)
-        self.db = self.client[app_config.DATABASE_NAME]
+        self.client = get_mongo_client()
+        self.db = get_database()
         self.collection = self.db['users']
+        self.ensure_indexes()
+
+    def ensure_indexes(self):
+        # Creating an index that already exists is a no-op
+        for collection_name, keys, options in INDEXES:
+            self.db[collection_name].create_index(keys, **options)
 
     def save_or_update_user(self, google_user, credentials):
         try:
             # Extract the user's email from the google user object
             user_email = google_user['email']
-            print("User Email:", user_email)
 
-            # Format the credentials object and print it for debugging purposes
+            # Format the credentials object; the token fields are redacted if it is logged
             auth_token = format_credentials(credentials)
-            print("Auth Token Obtained:", json.dumps(auth_token, indent=2))
-
-            # Try to find the user in the database by their email
-            existing_user = self.collection.find_one({'email': user_email})
-
-            # If the user exists, update their credentials
-            if existing_user:
-
-                # mongo_id = str(existing_user['_id'])
-
-                # Update the existing user's credentials in the database
-                self.collection.update_one(
-                    {'_id': existing_user['_id']},  # filter parameter added to update only the matched document
-                    {'$set': {
-
-                        # Update the google user credentials (not email)
-                        'google_id': google_user['id'],
-                        'verified_email': google_user['verified_email'],
-                        'full_name': google_user['name'],
-                        'first_name': google_user['given_name'],
-                        'last_name': google_user['family_name'],
-                        'picture': google_user['picture'],
-                        'locale': google_user['locale'],
-                        'google_hd': google_user['hd'],
-
-                        # Update the new user's google oauth credentials
-                        'token': auth_token['token'],
-                        'refresh_token': auth_token['refresh_token'],
-                        'token_uri': auth_token['token_uri'],
-                        'client_id': auth_token['client_id'],
-                        'scopes': auth_token['scopes'],
-                        'expiry': auth_token['expiry'],
-
-                        # Update the timestamp for when the user was last updated
-                        'updated_at': datetime.now().isoformat()
-                    }}
-                )
-
-                mongo_id = str(existing_user['_id'])
-                print(f"The MongoDB ObjectId for {user_email} is: {mongo_id}")
-                print(f"Updated User:", existing_user['email'], existing_user['full_name'])
-
+            logger.debug("Auth token obtained", extra={'user_email': user_email, 'auth_token': auth_token})
+
+            now = datetime.now().isoformat()
+            user_filter, user_update = build_user_upsert(google_user, auth_token, now)
+
+            # Insert or update the user in a single round-trip
+            saved_user = self.collection.find_one_and_update(
+                user_filter,
+                user_update,
+                projection=dict.fromkeys(LOGIN_USER_FIELDS, 1),
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+
+            # Imported here because the repository reads through this module's client.
+            # The saved fields go straight into its cache for the requests after login.
+            from user_repository import get_user_repository
+            users = get_user_repository(self.collection)
+            users.invalidate(saved_user['_id'], user_email)
+            users.put(saved_user, set(LOGIN_USER_FIELDS))
+
+            if saved_user.get('created_at') == now:
+                logger.info("Saved new user", extra={'user_email': user_email, 'user_id': saved_user['_id']})
             else:
-                print(f"No user found with email: {user_email}")
-
-                # Insert a new user into the database
-                new_user = self.collection.insert_one({
-
-                    # Update the new user's google user credentials
-                    'google_id': google_user['id'],
-                    'email': google_user['email'],
-                    'verified_email': google_user['verified_email'],
-                    'full_name': google_user['name'],
-                    'first_name': google_user['given_name'],
-                    'last_name': google_user['family_name'],
-                    'picture': google_user['picture'],
-                    'locale': google_user['locale'],
-                    'google_hd': google_user['hd'],
-
-                    # Update the new user's google oauth credentials
-                    'token': auth_token['token'],
-                    'refresh_token': auth_token['refresh_token'],
-                    'token_uri': auth_token['token_uri'],
-                    'client_id': auth_token['client_id'],
-                    'scopes': auth_token['scopes'],
-                    'expiry': auth_token['expiry'],
-
-                    # Update the timestamp for when the user was last updated and created
-                    'updated_at': datetime.now().isoformat(),
-                    'created_at': datetime.now().isoformat()
-                })
-
-                if new_user.acknowledged:
-                    saved_user = self.collection.find_one({'_id': new_user.inserted_id})
-
-                    mongo_id = str(existing_user['_id'])
-                    print(f"The MongoDB ObjectId for {saved_user['email']} is: {mongo_id}")
-                    print(f"Saved New User: {saved_user['email']}, {saved_user['name']}")
-                else:
-                    print("Failed to Save User to the DB.")
-                    return None
-
-            total_users = self.collection.count_documents({})
-            print(f"Total Count of Users: {total_users}")
+                logger.info("Updated user", extra={'user_email': user_email, 'user_id': saved_user['_id']})
 
             return None
 
         except ConnectionError as ce:
-            print(f"Error: {ce}. Could not connect to the MongoDB server.")
+            logger.error("Could not connect to the MongoDB server: %s", ce)
             return None
 
-        except Exception as e:
-            print("Error:", e)
+        except Exception:
+            logger.exception("Could not save user")
             return None
 
     def connect_to_mongodb(self):
-        # Connect to the MongoDB database
-        client = MongoClient(app_config.DATABASE_URI)
-        print(f"Client: {client}")
-
-        db = client[app_config.DATABASE_NAME]
-        print(f"Database: {db}")
-
-        collection = db['users']
-        print(f"Collection: {collection}")
+        # Hand out the users collection from the shared, pooled client
+        return self.collection
+
+def build_user_upsert(google_user, auth_token, now):
+    user_fields = {
+        # Update the google user credentials
+        'google_id': google_user['id'],
+        'email': google_user['email'],
+        'verified_email': google_user['verified_email'],
+        'full_name': google_user['name'],
+        'first_name': google_user['given_name'],
+        'last_name': google_user['family_name'],
+        'picture': google_user['picture'],
+        'locale': google_user['locale'],
+        'google_hd': google_user['hd'],
+
+        # Update the user's google oauth credentials
+        'token': auth_token['token'],
+        'token_uri': auth_token['token_uri'],
+        'client_id': auth_token['client_id'],
+        'scopes': auth_token['scopes'],
+        'expiry': auth_token['expiry'],
+
+        # Update the timestamp for when the user was last updated
+        'updated_at': now
+    }
 
-        return collection
+    # Google only sends a refresh token on first consent, so keep the stored one
+    if auth_token['refresh_token']:
+        user_fields['refresh_token'] = auth_token['refresh_token']
+
+    return (
+        {'email': google_user['email']},
+        {'$set': user_fields, '$setOnInsert': {
+            'created_at': now,
+            'sync_shard': sync_shard_for(google_user['email'])
+        }}
+    )
+
+def sync_shard_for(user_email):
+    # Stable shard for the background sync workers, see worker.py
+    return zlib.crc32(user_email.encode()) % app_config.SYNC_SHARDS
 
 def format_credentials(credentials):
     return {
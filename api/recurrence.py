@@ -0,0 +1,174 @@
+# Local expansion of recurring events. Google is asked for series masters and their
+# exceptions (singleEvents=False) instead of every instance, and each master is kept
+# as a compact series: its local start, time zone, duration and RRULE/EXDATE/RDATE
+# lines. Occurrences are expanded here on demand and memoized per (series, window).
+
+# Standard library imports
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+# Third-party package imports
+import numpy as np
+from dateutil.rrule import rrulestr
+
+# Local imports
+from config import app_config
+
+# Stored end of a series that never ends, later than any real timestamp
+NO_END = 2 ** 62
+
+def parse_datetime(value):
+    # RFC 3339 from Google, e.g. '2023-05-01T10:00:00-07:00' or '...Z'
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+def original_start(event):
+    # Epoch second of the occurrence an exception replaces
+    original = event.get('originalStartTime') or {}
+    if 'dateTime' not in original:
+        return None
+    return int(parse_datetime(original['dateTime']).timestamp())
+
+def compact_series(event):
+    # Cancelled, free and all-day series never count as busy time
+    if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+        return None
+    start = event.get('start', {})
+    end = event.get('end', {})
+    if 'dateTime' not in start or 'dateTime' not in end:
+        return None
+
+    start_at = parse_datetime(start['dateTime'])
+    duration = int((parse_datetime(end['dateTime']) - start_at).total_seconds())
+    if duration <= 0:
+        return None
+
+    # Rules repeat in the event's own zone, so a 10:00 meeting stays at 10:00 across DST
+    tz_name = start.get('timeZone') or 'UTC'
+    series = {
+        'dtstart': start_at.astimezone(ZoneInfo(tz_name)).replace(tzinfo=None).isoformat(),
+        'tz': tz_name,
+        'duration': duration,
+        'recurrence': list(event.get('recurrence') or []),
+    }
+    series['version'] = hashlib.sha1(json.dumps(series, sort_keys=True).encode()).hexdigest()[:16]
+    return series
+
+def rule_set(series):
+    # Returns (rule set, local time zone or None when the rules had to be read as wall-clock times)
+    tz = ZoneInfo(series['tz'])
+    dtstart = datetime.fromisoformat(series['dtstart'])
+    rules = '\n'.join(series['recurrence'])
+    try:
+        return rrulestr(rules, dtstart=dtstart.replace(tzinfo=tz), forceset=True, unfold=True), tz
+    except ValueError:
+        # A date-only UNTIL can't be compared with an aware start
+        return rrulestr(rules, dtstart=dtstart, forceset=True, unfold=True, ignoretz=True), None
+
+def to_epoch(occurrence, local_tz):
+    # Occurrences of wall-clock rules are naive local times
+    if occurrence.tzinfo is None:
+        occurrence = occurrence.replace(tzinfo=local_tz)
+    return int(occurrence.timestamp())
+
+def from_epoch(timestamp, tz, local_tz):
+    moment = datetime.fromtimestamp(timestamp, timezone.utc).astimezone(local_tz)
+    return moment if tz is not None else moment.replace(tzinfo=None)
+
+def expand_series(series, window_start, window_end):
+    # Start times of the occurrences overlapping [window_start, window_end), as epoch seconds
+    rules, tz = rule_set(series)
+    local_tz = ZoneInfo(series['tz'])
+    occurrences = rules.between(
+        from_epoch(window_start - series['duration'], tz, local_tz),
+        from_epoch(window_end, tz, local_tz),
+        inc=True
+    )
+    starts = np.fromiter(
+        (to_epoch(occurrence, local_tz) for occurrence in occurrences), dtype=np.int64, count=len(occurrences)
+    )
+    return starts[(starts < window_end) & (starts + series['duration'] > window_start)]
+
+def series_bounds(series):
+    # (first start, last end) for the stored document; open-ended series end at NO_END
+    rules, _ = rule_set(series)
+    local_tz = ZoneInfo(series['tz'])
+    first = next(iter(rules), None)
+    if first is None:
+        return None
+
+    bounded = all(
+        'COUNT=' in line.upper() or 'UNTIL=' in line.upper()
+        for line in series['recurrence'] if line.upper().startswith('RRULE')
+    )
+    if not bounded:
+        return to_epoch(first, local_tz), NO_END
+
+    for last in rules:
+        pass
+    return to_epoch(first, local_tz), to_epoch(last, local_tz) + series['duration']
+
+class OccurrenceCache:
+    # Bounded LRU of expansions keyed by (series id, series version, window). A changed
+    # series has a new version so it can't be served stale; invalidate() frees its entries.
+    def __init__(self, max_size=None):
+        self.max_size = max_size or app_config.RECURRENCE_CACHE_SIZE
+        self.entries = OrderedDict()
+        self.keys_by_series = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def occurrences(self, series_id, series, window_start, window_end):
+        key = (series_id, series['version'], int(window_start), int(window_end))
+        with self.lock:
+            starts = self.entries.get(key)
+            if starts is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return starts
+            self.misses += 1
+
+        starts = expand_series(series, window_start, window_end)
+        # Cached arrays are shared between callers
+        starts.setflags(write=False)
+
+        with self.lock:
+            self.entries[key] = starts
+            self.keys_by_series.setdefault(series_id, set()).add(key)
+            while len(self.entries) > self.max_size:
+                evicted, _ = self.entries.popitem(last=False)
+                self.discard_key(evicted)
+        return starts
+
+    def discard_key(self, key):
+        keys = self.keys_by_series.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_series[key[0]]
+
+    def invalidate(self, series_id):
+        with self.lock:
+            for key in self.keys_by_series.pop(series_id, ()):
+                self.entries.pop(key, None)
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+_occurrence_cache = None
+_occurrence_cache_lock = threading.Lock()
+
+def get_occurrence_cache():
+    global _occurrence_cache
+
+    with _occurrence_cache_lock:
+        if _occurrence_cache is None:
+            _occurrence_cache = OccurrenceCache()
+    return _occurrence_cache
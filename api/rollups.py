@@ -0,0 +1,352 @@
+# Standard library imports
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# Third-party package imports
+import numpy as np
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# MongoDB-related imports
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+# Local imports
+from app_logging import get_logger
+from api_scheduler import BACKGROUND, execute_request
+from calendar_flags import get_user_calendars_collection
+from config import app_config
+from hours import SECONDS_PER_HOUR, busy_seconds_in_bins, day_edges, event_interval
+from mongodb import get_collection
+from recurrence import compact_series, expand_series, get_occurrence_cache, original_start, series_bounds
+from user_repository import get_user_repository
+
+logger = get_logger(__name__)
+
+# Pre-aggregated busy hours, one document per (user_id, calendar_id, day)
+HOURS_ROLLUPS_COLLECTION = 'hours_rollups'
+# Compact copy of each synced event, used to recompute the days it touches
+CALENDAR_EVENTS_COLLECTION = 'calendar_events'
+# Rollup rows for the union of all of a user's synced calendars use this id,
+# so overlapping meetings on different calendars are only counted once
+ALL_CALENDARS = '*'
+
+SYNC_TOKEN_GONE = 410
+SYNC_EVENT_FIELDS = (
+    'nextPageToken,nextSyncToken,'
+    'items(id,status,transparency,start,end,recurrence,recurringEventId,originalStartTime)'
+)
+# Fields only some stored events have; cleared when an event stops needing them
+OPTIONAL_EVENT_FIELDS = ('series', 'recurring_event_id', 'original_start', 'cancelled')
+
+def get_rollups_collection():
+    return get_collection(HOURS_ROLLUPS_COLLECTION)
+
+def get_events_collection():
+    return get_collection(CALENDAR_EVENTS_COLLECTION)
+
+def list_event_changes(cal_service, calendar_id, sync_token=None, time_min=None, user_key=None):
+    # Full sync when there is no token, otherwise only what changed since it was issued
+    items = []
+    page_token = None
+    while True:
+        params = {
+            'calendarId': calendar_id,
+            # Recurring events come back as a master plus exceptions, not every instance
+            'singleEvents': False,
+            'maxResults': 2500,
+            'fields': SYNC_EVENT_FIELDS,
+        }
+        if sync_token:
+            params['syncToken'] = sync_token
+        elif time_min:
+            params['timeMin'] = time_min
+        if page_token:
+            params['pageToken'] = page_token
+
+        # Rollup syncs are background work and yield to interactive requests
+        events_result = execute_request(cal_service.events().list(**params), user_key, BACKGROUND)
+        items.extend(events_result.get('items', []))
+
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return items, events_result.get('nextSyncToken')
+
+def days_touched(start, end, tz):
+    # Local dates covered by [start, end), inclusive of the day holding the last second
+    first_day = datetime.fromtimestamp(start, tz).date()
+    last_day = datetime.fromtimestamp(end - 1, tz).date()
+    return {first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)}
+
+def compact_event(event):
+    # What is stored for an event: a busy interval, a recurring series with its
+    # bounds, or an exception to a series. None when there is nothing to keep.
+    if event.get('recurrence'):
+        series = compact_series(event)
+        bounds = series_bounds(series) if series is not None else None
+        if bounds is None:
+            return None
+        return {'start': bounds[0], 'end': bounds[1], 'series': series}
+
+    interval = event_interval(event)
+    replaced = original_start(event) if event.get('recurringEventId') else None
+    if replaced is None:
+        if interval is None:
+            return None
+        return {'start': interval[0], 'end': interval[1]}
+
+    # Exceptions are kept even when cancelled or free, since they still remove
+    # the occurrence they replace from the series
+    doc = {'recurring_event_id': event['recurringEventId'], 'original_start': replaced}
+    if interval is None:
+        doc.update(start=replaced, end=replaced, cancelled=True)
+    else:
+        doc.update(start=interval[0], end=interval[1], cancelled=False)
+    return doc
+
+def stored_event_days(doc, tz, horizon_end):
+    # Local dates a stored event affects; series only up to the rollup horizon
+    days = set()
+    if 'series' in doc:
+        series = doc['series']
+        for start in expand_series(series, doc['start'], min(doc['end'], horizon_end)).tolist():
+            days |= days_touched(start, start + series['duration'], tz)
+        return days
+
+    if doc['end'] > doc['start']:
+        days |= days_touched(doc['start'], doc['end'], tz)
+    if doc.get('original_start') is not None:
+        days |= days_touched(doc['original_start'], doc['original_start'] + 1, tz)
+    return days
+
+def apply_event_changes(events, user_id, calendar_id, changes, tz, horizon_end):
+    # Upsert/delete the stored events and return the days whose hours may have changed
+    event_ids = [event['id'] for event in changes]
+    stored = {
+        doc['event_id']: doc
+        for doc in events.find(
+            {'user_id': user_id, 'calendar_id': calendar_id, 'event_id': {'$in': event_ids}},
+            {'_id': 0, 'event_id': 1, 'start': 1, 'end': 1, 'series': 1, 'original_start': 1}
+        )
+    }
+
+    cache = get_occurrence_cache()
+    dirty_days = set()
+    requests = []
+    for event in changes:
+        key = {'user_id': user_id, 'calendar_id': calendar_id, 'event_id': event['id']}
+
+        # The days the event used to cover need recomputing as well as the new ones
+        previous = stored.get(event['id'])
+        if previous is not None:
+            dirty_days |= stored_event_days(previous, tz, horizon_end)
+            if 'series' in previous:
+                cache.invalidate((user_id, calendar_id, event['id']))
+
+        doc = compact_event(event)
+        if doc is None:
+            if previous is not None:
+                requests.append(DeleteOne(key))
+                # A series that is gone takes its exceptions, and the days they moved to, with it
+                if 'series' in previous:
+                    exceptions = {'user_id': user_id, 'calendar_id': calendar_id, 'recurring_event_id': event['id']}
+                    for exception in events.find(exceptions, {'_id': 0, 'start': 1, 'end': 1, 'original_start': 1}):
+                        dirty_days |= stored_event_days(exception, tz, horizon_end)
+                    requests.append(DeleteMany(exceptions))
+            continue
+
+        dirty_days |= stored_event_days(doc, tz, horizon_end)
+        update = {'$set': doc}
+        unset = {field: '' for field in OPTIONAL_EVENT_FIELDS if field not in doc}
+        if unset:
+            update['$unset'] = unset
+        requests.append(UpdateOne(key, update, upsert=True))
+
+    if requests:
+        events.bulk_write(requests, ordered=False)
+    return dirty_days
+
+def series_intervals(events, query, series_docs, window_start, window_end):
+    # Occurrences of the stored series in the window, minus the ones replaced by exceptions
+    overridden = {}
+    cursor = events.find(
+        dict(query, recurring_event_id={'$in': [doc['event_id'] for doc in series_docs]}),
+        {'_id': 0, 'calendar_id': 1, 'recurring_event_id': 1, 'original_start': 1}
+    )
+    for doc in cursor:
+        overridden.setdefault((doc['calendar_id'], doc['recurring_event_id']), []).append(doc['original_start'])
+
+    cache = get_occurrence_cache()
+    starts = []
+    ends = []
+    for doc in series_docs:
+        series = doc['series']
+        series_key = (doc['calendar_id'], doc['event_id'])
+        occurrence_starts = cache.occurrences((query['user_id'],) + series_key, series, window_start, window_end)
+        if series_key in overridden:
+            occurrence_starts = occurrence_starts[~np.isin(occurrence_starts, overridden[series_key])]
+        starts.append(occurrence_starts)
+        ends.append(occurrence_starts + series['duration'])
+    return np.concatenate(starts), np.concatenate(ends)
+
+def busy_hours_for_days(events, query, days, tz_name):
+    # Recompute busy hours for a set of days from the stored events in one query
+    first_day, last_day = min(days), max(days)
+    dates, edges = day_edges(first_day, last_day, tz_name)
+    window_start, window_end = int(edges[0]), int(edges[-1])
+
+    cursor = events.find(
+        dict(query, start={'$lt': window_end}, end={'$gt': window_start}),
+        {'_id': 0, 'calendar_id': 1, 'event_id': 1, 'start': 1, 'end': 1, 'series': 1, 'cancelled': 1}
+    )
+    intervals = []
+    series_docs = []
+    for doc in cursor:
+        if 'series' in doc:
+            series_docs.append(doc)
+        elif not doc.get('cancelled'):
+            intervals.append((doc['start'], doc['end']))
+    starts = np.array([interval[0] for interval in intervals], dtype=np.int64)
+    ends = np.array([interval[1] for interval in intervals], dtype=np.int64)
+
+    if series_docs:
+        series_starts, series_ends = series_intervals(events, query, series_docs, window_start, window_end)
+        starts = np.concatenate([starts, series_starts])
+        ends = np.concatenate([ends, series_ends])
+
+    hours = busy_seconds_in_bins(starts, ends, edges) / SECONDS_PER_HOUR
+    return {day: float(value) for day, value in zip(dates, hours) if day in days}
+
+def refresh_rollups(rollups, events, user_id, calendar_id, dirty_days, tz_name):
+    if not dirty_days:
+        return 0
+
+    requests = []
+    for rollup_calendar_id, query in (
+        (calendar_id, {'user_id': user_id, 'calendar_id': calendar_id}),
+        (ALL_CALENDARS, {'user_id': user_id}),
+    ):
+        for day, hours in busy_hours_for_days(events, query, dirty_days, tz_name).items():
+            requests.append(UpdateOne(
+                {'user_id': user_id, 'calendar_id': rollup_calendar_id, 'day': day.isoformat()},
+                {'$set': {'hours': hours, 'updated_at': datetime.now().isoformat()}},
+                upsert=True
+            ))
+
+    rollups.bulk_write(requests, ordered=False)
+    return len(dirty_days)
+
+def reset_calendar(rollups, events, user_id, calendar_id, tz, horizon_end):
+    # Forget everything stored for the calendar before a full resync
+    cache = get_occurrence_cache()
+    dirty_days = set()
+    cursor = events.find(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        {'_id': 0, 'event_id': 1, 'start': 1, 'end': 1, 'series': 1, 'original_start': 1}
+    )
+    for doc in cursor:
+        dirty_days |= stored_event_days(doc, tz, horizon_end)
+        if 'series' in doc:
+            cache.invalidate((user_id, calendar_id, doc['event_id']))
+    events.delete_many({'user_id': user_id, 'calendar_id': calendar_id})
+    rollups.delete_many({'user_id': user_id, 'calendar_id': calendar_id})
+    return dirty_days
+
+def rollup_horizon(tz):
+    # Open-ended series are only rolled up this far ahead, to a local midnight
+    last_day = datetime.now(tz).date() + timedelta(days=app_config.RECURRENCE_HORIZON_DAYS)
+    return int(datetime.combine(last_day, time.min, tzinfo=tz).timestamp())
+
+def extend_horizon(events, user_id, calendar_id, old_horizon, new_horizon, tz):
+    # Days of series occurrences that moved inside the horizon since the last sync
+    dirty_days = set()
+    cursor = events.find(
+        {'user_id': user_id, 'calendar_id': calendar_id, 'series': {'$exists': True}, 'end': {'$gt': old_horizon}},
+        {'_id': 0, 'series': 1}
+    )
+    for doc in cursor:
+        series = doc['series']
+        for start in expand_series(series, old_horizon, new_horizon).tolist():
+            dirty_days |= days_touched(max(start, old_horizon), start + series['duration'], tz)
+    return dirty_days
+
+def primary_time_zone(user):
+    # Every rollup row of a user, the '*' union rows included, is bucketed in the
+    # time zone of their primary calendar, whichever calendar is being synced
+    calendars = user.get('calendars') or []
+    return next((calendar.get('timeZone') for calendar in calendars if calendar.get('primary')), None) or 'UTC'
+
+def sync_calendar_rollups(cal_service, user_id, calendar_id, time_min=None,
+                          rollups=None, events=None, user_calendars=None, users=None):
+    # Pull changed events for one calendar and refresh only the days they touch
+    rollups = rollups if rollups is not None else get_rollups_collection()
+    events = events if events is not None else get_events_collection()
+    user_calendars = user_calendars if user_calendars is not None else get_user_calendars_collection()
+    # Google quota is keyed by the user's email, like every other call made for them
+    user = get_user_repository(users).find_by_id(user_id, ('email', 'calendars')) or {}
+    user_key = user.get('email')
+    tz_name = primary_time_zone(user)
+    tz = ZoneInfo(tz_name)
+    horizon_end = rollup_horizon(tz)
+
+    # The event sync token lives on the calendar's flag document
+    state = user_calendars.find_one(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        {'_id': 0, 'events_sync_token': 1, 'rollups_horizon': 1}
+    ) or {}
+    sync_token = state.get('events_sync_token')
+
+    dirty_days = set()
+    if sync_token and 'rollups_horizon' not in state:
+        # Tokens from before series were stored list every instance; start over once
+        logger.info("Resyncing calendar to store recurring series", extra={'calendar_id': calendar_id})
+        dirty_days |= reset_calendar(rollups, events, user_id, calendar_id, tz, horizon_end)
+        sync_token = None
+    elif state.get('rollups_horizon', horizon_end) < horizon_end:
+        dirty_days |= extend_horizon(events, user_id, calendar_id, state['rollups_horizon'], horizon_end, tz)
+
+    try:
+        changes, next_sync_token = list_event_changes(cal_service, calendar_id, sync_token, time_min, user_key)
+    except HttpError as error:
+        if error.resp.status != SYNC_TOKEN_GONE:
+            raise
+        logger.info("Event sync token expired, running a full resync", extra={'calendar_id': calendar_id})
+        dirty_days |= reset_calendar(rollups, events, user_id, calendar_id, tz, horizon_end)
+        changes, next_sync_token = list_event_changes(cal_service, calendar_id, None, time_min, user_key)
+
+    if changes:
+        dirty_days |= apply_event_changes(events, user_id, calendar_id, changes, tz, horizon_end)
+    refreshed = refresh_rollups(rollups, events, user_id, calendar_id, dirty_days, tz_name)
+
+    user_calendars.update_one(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        {'$set': {
+            'events_sync_token': next_sync_token,
+            'events_synced_at': datetime.now().isoformat(),
+            'rollups_horizon': horizon_end,
+        }},
+        upsert=True
+    )
+    return refreshed
+
+def query_hours(user_id, start_day, end_day, calendar_ids=None, group_by='calendar', rollups=None):
+    # Sum the pre-aggregated day buckets; group_by is 'calendar' or 'day'
+    rollups = rollups if rollups is not None else get_rollups_collection()
+    if isinstance(start_day, date):
+        start_day = start_day.isoformat()
+    if isinstance(end_day, date):
+        end_day = end_day.isoformat()
+
+    match = {'user_id': user_id, 'day': {'$gte': start_day, '$lte': end_day}}
+    if calendar_ids is not None:
+        match['calendar_id'] = {'$in': list(calendar_ids)}
+    else:
+        match['calendar_id'] = ALL_CALENDARS
+
+    group_key = '$calendar_id' if group_by == 'calendar' else '$day'
+    pipeline = [
+        {'$match': match},
+        {'$group': {'_id': group_key, 'hours': {'$sum': '$hours'}}},
+        {'$sort': {'_id': 1}},
+    ]
+    return {row['_id']: row['hours'] for row in rollups.aggregate(pipeline)}
@@ -0,0 +1,75 @@
+# Standard library imports
+import json
+import os
+import threading
+from urllib.parse import urljoin
+
+# Local imports
+from config import app_config
+from metrics import count_cache, span
+
+# Discovery documents checked into the repo take priority over the copies
+# bundled with googleapiclient, e.g. 'discovery/calendar.v3.json'
+DISCOVERY_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discovery')
+
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0}
+
+def get_service(service_name, version, credentials=None):
+    # Build a service object from the cached discovery document, no HTTP fetch.
+    # googleapiclient.discovery is slow to import, so it waits for the first build.
+    from googleapiclient.discovery import build_from_document
+
+    discovery_doc = get_discovery_doc(service_name, version)
+    client_options = None
+    if app_config.GOOGLE_API_ROOT:
+        # Same override as the async client, e.g. a local stand-in for benchmarks
+        api_root = app_config.GOOGLE_API_ROOT.rstrip('/') + '/'
+        client_options = {'api_endpoint': urljoin(api_root, discovery_doc['servicePath'])}
+    with span('google_build', service=service_name):
+        return build_from_document(discovery_doc, credentials=credentials, client_options=client_options)
+
+def get_discovery_doc(service_name, version):
+    key = (service_name, version)
+
+    discovery_doc = _discovery_docs.get(key)
+    if discovery_doc is not None:
+        _cache_stats['hits'] += 1
+        count_cache('discovery', True)
+        return discovery_doc
+
+    with _discovery_lock:
+        # Another thread may have loaded it while we were waiting
+        discovery_doc = _discovery_docs.get(key)
+        hit = discovery_doc is not None
+        if hit:
+            _cache_stats['hits'] += 1
+        else:
+            _cache_stats['misses'] += 1
+            discovery_doc = json.loads(load_discovery_json(service_name, version))
+            _discovery_docs[key] = discovery_doc
+
+    count_cache('discovery', hit)
+
+    return discovery_doc
+
+def load_discovery_json(service_name, version):
+    local_path = os.path.join(DISCOVERY_DIR, f"{service_name}.{version}.json")
+    if os.path.exists(local_path):
+        with open(local_path, 'r') as json_file:
+            return json_file.read()
+
+    from googleapiclient.discovery_cache import get_static_doc
+
+    content = get_static_doc(service_name, version)
+    if content is None:
+        raise ValueError(f"No static discovery document for {service_name} {version}")
+    return content
+
+def get_service_cache_stats():
+    return {
+        'hits': _cache_stats['hits'],
+        'misses': _cache_stats['misses'],
+        'cached_documents': len(_discovery_docs),
+    }
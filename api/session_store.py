@@ -0,0 +1,163 @@
+# Standard library imports
+import base64
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Flask-related imports
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+# Security and Crypto imports
+from itsdangerous import BadSignature, Signer
+
+# Local imports
+from config import app_config
+from metrics import count_cache
+from mongodb import get_collection
+
+SESSIONS_COLLECTION = 'sessions'
+# Flask's default cookie name; the aiohttp app reads and writes the same cookie
+SESSION_COOKIE_NAME = 'session'
+
+def new_session_id():
+    # os.urandom rather than the secrets module, which the local secrets/ package shadows
+    return base64.urlsafe_b64encode(os.urandom(32)).rstrip(b'=').decode()
+
+def session_signer(secret_key):
+    return Signer(secret_key, salt='session-id')
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        # A new id for the same data, e.g. on login, so an id planted in the browser
+        # beforehand is never signed in; the old row is deleted when the session is saved
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = new_session_id()
+        self.new = True
+        self.modified = True
+
+class SessionCache:
+    # Small LRU of recently read sessions, each entry valid for a few seconds
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            entry = self.entries.get(sid)
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self.entries[sid]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(sid)
+        count_cache('session', entry is not None)
+        return entry[0] if entry is not None else None
+
+    def put(self, sid, data):
+        with self.lock:
+            self.entries[sid] = (data, time.monotonic())
+            self.entries.move_to_end(sid)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, sid):
+        with self.lock:
+            self.entries.pop(sid, None)
+
+class MongoSessionInterface(SessionInterface):
+    # Session data lives in Mongo (expired by a TTL index); the cookie only
+    # carries a signed session id
+    def __init__(self, collection=None, lifetime=None, cache_size=None, cache_ttl=None):
+        self.collection = collection
+        self.lifetime = timedelta(seconds=lifetime or app_config.SESSION_LIFETIME_SECONDS)
+        self.cache = SessionCache(
+            cache_size or app_config.SESSION_CACHE_SIZE,
+            cache_ttl or app_config.SESSION_CACHE_TTL_SECONDS
+        )
+
+    def get_collection(self):
+        if self.collection is None:
+            self.collection = get_collection(SESSIONS_COLLECTION)
+        return self.collection
+
+    def get_signer(self, app):
+        return session_signer(app.secret_key)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return ServerSideSession(sid=self.new_sid(), new=True)
+
+        try:
+            sid = self.get_signer(app).unsign(cookie).decode()
+        except BadSignature:
+            return ServerSideSession(sid=self.new_sid(), new=True)
+
+        data = self.cache.get(sid)
+        if data is None:
+            stored = self.get_collection().find_one({'_id': sid}, {'data': 1, 'expires_at': 1})
+            # The TTL monitor only runs once a minute, so check expiry here too
+            if not stored or stored['expires_at'] <= datetime.utcnow():
+                return ServerSideSession(sid=self.new_sid(), new=True)
+            data = stored.get('data', {})
+            self.cache.put(sid, data)
+
+        return ServerSideSession(dict(data), sid=sid)
+
+    def save_session(self, app, session, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        cookie_name = self.get_cookie_name(app)
+
+        if session.replaced_sid is not None:
+            self.get_collection().delete_one({'_id': session.replaced_sid})
+            self.cache.delete(session.replaced_sid)
+
+        # An emptied session is deleted along with its cookie
+        if not session:
+            if session.modified:
+                self.get_collection().delete_one({'_id': session.sid})
+                self.cache.delete(session.sid)
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        data = dict(session)
+        expires_at = datetime.utcnow() + self.lifetime
+        self.get_collection().update_one(
+            {'_id': session.sid},
+            {'$set': {'data': data, 'expires_at': expires_at}},
+            upsert=True
+        )
+        self.cache.put(session.sid, data)
+
+        response.set_cookie(
+            cookie_name,
+            self.get_signer(app).sign(session.sid.encode()).decode(),
+            expires=expires_at,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+    def new_sid(self):
+        return new_session_id()
@@ -9,12 +9,14 @@ setup(
         'cryptography==39.0.1',
         'Flask==2.2.2',
         'Flask-Cors==3.0.10',
-        'Flask-Session==0.4.0',
         'google-api-python-client==2.86.0',
         'google-auth-oauthlib==0.4.6',
         'itsdangerous==2.0.1',
+        'motor==3.1.2',
+        'numpy==1.24.3',
         'protobuf==3.18.1',
         'pymongo==4.3.3',
+        'python-dateutil==2.8.2',
         'python-dotenv==1.0.0',
     ],
     entry_points={
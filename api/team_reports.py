@@ -0,0 +1,183 @@
+# Busy-hour reports for whole teams. Instead of listing every member's events, the
+# enabled calendars of all members go out in freebusy.query calls of up to 50
+# calendars each, run concurrently with the requesting manager's credentials, and
+# the busy blocks that come back are merged for every member in one numpy pass.
+
+# Standard library imports
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+# Third-party package imports
+import numpy as np
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# Local imports
+from app_logging import get_logger
+from api_scheduler import INTERACTIVE, execute_request
+from calendar_flags import get_user_calendars_collection
+from config import app_config
+from hours import SECONDS_PER_HOUR, cumulative_busy_seconds, day_edges, parse_timestamp, to_rfc3339
+from mongodb import get_collection
+from services import get_service
+
+logger = get_logger(__name__)
+
+# Google answers for at most 50 calendars per freebusy.query call
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_FIELDS = 'calendars(busy,errors)'
+
+def team_scope(requester, emails=(), domain=None):
+    # The users query a signed-in requester may report on: themselves, and the users of
+    # their own Workspace domain. None when the request reaches outside that.
+    own_email = requester['email']
+    own_domain = requester.get('hd')
+    if domain and domain != own_domain:
+        return None
+    for email in emails:
+        if email != own_email and (not own_domain or email.rpartition('@')[2] != own_domain):
+            return None
+    return {'$or': [{'email': own_email}, {'google_hd': own_domain}]} if own_domain else {'email': own_email}
+
+def load_team_members(emails=None, domain=None, users=None, limit=None, scope=None):
+    users = users if users is not None else get_collection('users')
+    if emails:
+        query = {'email': {'$in': list(emails)}}
+    elif domain:
+        query = {'google_hd': domain}
+    else:
+        return []
+    if scope:
+        query = {'$and': [query, scope]}
+    return list(users.find(query, {'_id': 1, 'email': 1}).limit(limit or app_config.TEAM_REPORT_MAX_MEMBERS))
+
+def load_member_calendars(members, user_calendars=None):
+    # {calendar_id: [member index, ...]}; a shared calendar can count for several members.
+    # Members who haven't enabled any calendar are reported on their primary one.
+    user_calendars = user_calendars if user_calendars is not None else get_user_calendars_collection()
+    member_index = {member['_id']: index for index, member in enumerate(members)}
+
+    calendars = {}
+    cursor = user_calendars.find(
+        {'user_id': {'$in': list(member_index)}, 'enabled': True},
+        {'_id': 0, 'user_id': 1, 'calendar_id': 1}
+    )
+    for flag in cursor:
+        calendars.setdefault(flag['calendar_id'], []).append(member_index[flag['user_id']])
+
+    covered = {index for indexes in calendars.values() for index in indexes}
+    for index, member in enumerate(members):
+        if index not in covered:
+            calendars.setdefault(member['email'], []).append(index)
+    return calendars
+
+def query_freebusy(credentials, calendar_ids, time_min, time_max, user_key=None):
+    # Each call builds its own service: the underlying httplib2 client isn't thread-safe
+    cal_service = get_service('calendar', 'v3', credentials=credentials)
+    response = execute_request(cal_service.freebusy().query(body={
+        'timeMin': time_min,
+        'timeMax': time_max,
+        'items': [{'id': calendar_id} for calendar_id in calendar_ids],
+    }, fields=FREEBUSY_FIELDS), user_key, INTERACTIVE)
+
+    busy = {}
+    errors = {}
+    for calendar_id, result in response.get('calendars', {}).items():
+        if result.get('errors'):
+            errors[calendar_id] = result['errors'][0].get('reason', 'unknown')
+        else:
+            busy[calendar_id] = result.get('busy', [])
+    return busy, errors
+
+def fetch_team_busy(credentials, calendar_ids, time_min, time_max, user_key=None, max_workers=None):
+    chunks = [
+        calendar_ids[offset:offset + FREEBUSY_MAX_CALENDARS]
+        for offset in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS)
+    ]
+    busy = {}
+    errors = {}
+    if not chunks:
+        return busy, errors
+
+    max_workers = min(max_workers or app_config.TEAM_REPORT_WORKERS, len(chunks))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            (chunk, executor.submit(query_freebusy, credentials, chunk, time_min, time_max, user_key))
+            for chunk in chunks
+        ]
+        for chunk, future in futures:
+            try:
+                chunk_busy, chunk_errors = future.result()
+            except HttpError as error:
+                logger.warning("freebusy.query failed for %d calendars: %s", len(chunk), error)
+                chunk_busy, chunk_errors = {}, {calendar_id: f"http_{error.resp.status}" for calendar_id in chunk}
+            busy.update(chunk_busy)
+            errors.update(chunk_errors)
+    return busy, errors
+
+def busy_table(busy_by_calendar, member_calendars):
+    # Flatten to parallel arrays of (member, start, end); a block on a shared
+    # calendar is repeated for every member it belongs to
+    members = []
+    starts = []
+    ends = []
+    for calendar_id, blocks in busy_by_calendar.items():
+        for block in blocks:
+            start = parse_timestamp(block['start'])
+            end = parse_timestamp(block['end'])
+            for index in member_calendars.get(calendar_id, ()):
+                members.append(index)
+                starts.append(start)
+                ends.append(end)
+    return (
+        np.array(members, dtype=np.int64),
+        np.array(starts, dtype=np.int64),
+        np.array(ends, dtype=np.int64),
+    )
+
+def member_busy_seconds(members, starts, ends, member_count, edges):
+    # Busy seconds per (member, bin), with every member's calendars unioned.
+    # Each member's timeline is shifted into its own disjoint segment of one axis, so
+    # a single merge and interpolation covers the whole team without mixing members.
+    window_start = int(edges[0])
+    stride = int(edges[-1]) - window_start + 1
+
+    starts = np.clip(starts, edges[0], edges[-1]) - window_start + members * stride
+    ends = np.clip(ends, edges[0], edges[-1]) - window_start + members * stride
+    keep = ends > starts
+
+    offsets = np.arange(member_count, dtype=np.int64)[:, None] * stride
+    points = (edges[None, :] - window_start) + offsets
+    cumulative = cumulative_busy_seconds(starts[keep], ends[keep], points.ravel())
+    return np.diff(cumulative.reshape(member_count, len(edges)), axis=1)
+
+def build_team_report(credentials, start_date, end_date, tz_name='UTC', emails=None, domain=None, user_key=None,
+                      scope=None):
+    members = load_team_members(emails, domain, scope=scope)
+    if not members:
+        return {'members': {}, 'by_day': {}, 'total': 0.0, 'errors': {}}
+
+    member_calendars = load_member_calendars(members)
+    time_min = to_rfc3339(start_date, tz_name)
+    time_max = to_rfc3339(end_date + timedelta(days=1), tz_name)
+    busy, errors = fetch_team_busy(credentials, list(member_calendars), time_min, time_max, user_key)
+
+    dates, edges = day_edges(start_date, end_date, tz_name)
+    hours = member_busy_seconds(*busy_table(busy, member_calendars), len(members), edges) / SECONDS_PER_HOUR
+    day_keys = [day.isoformat() for day in dates]
+
+    team_by_day = hours.sum(axis=0)
+    member_totals = hours.sum(axis=1)
+    return {
+        'members': {
+            member['email']: {
+                'total': float(member_totals[index]),
+                'by_day': dict(zip(day_keys, hours[index].tolist())),
+            }
+            for index, member in enumerate(members)
+        },
+        'by_day': dict(zip(day_keys, team_by_day.tolist())),
+        'total': float(member_totals.sum()),
+        'errors': errors,
+    }
@@ -0,0 +1,14 @@
+# Standard library imports
+import os
+import sys
+import types
+
+# Tests import the app modules by bare name, the way they import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Database secrets are deployment config that isn't checked in; the tests never connect
+if 'secrets.db_secrets' not in sys.modules:
+    db_secrets = types.ModuleType('secrets.db_secrets')
+    db_secrets.db_connection_string = 'mongodb://localhost:27017'
+    db_secrets.db_name = 'test'
+    sys.modules['secrets.db_secrets'] = db_secrets
@@ -0,0 +1,153 @@
+# In-memory stand-ins for the few pymongo collection methods the app calls, so the
+# sync and rollup logic can be tested without a Mongo server
+
+# Standard library imports
+import itertools
+from copy import deepcopy
+
+# MongoDB-related imports
+from pymongo import DeleteMany, DeleteOne, UpdateOne
+
+_collection_ids = itertools.count()
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == '$or':
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict) and any(operator.startswith('$') for operator in condition):
+            if not all(matches_operator(doc, key, operator, value) for operator, value in condition.items()):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+def matches_operator(doc, key, operator, value):
+    present = key in doc
+    field = doc.get(key)
+    if operator == '$exists':
+        return present == bool(value)
+    if operator == '$in':
+        return field in value
+    if operator == '$ne':
+        return field != value
+    if not present:
+        return False
+    return {
+        '$lt': lambda: field < value,
+        '$lte': lambda: field <= value,
+        '$gt': lambda: field > value,
+        '$gte': lambda: field >= value,
+    }[operator]()
+
+class FakeCursor(list):
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            for field, field_direction in reversed(key):
+                super().sort(key=lambda doc: doc.get(field), reverse=field_direction < 0)
+        else:
+            super().sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return self
+
+    def limit(self, count):
+        return FakeCursor(self[:count]) if count else self
+
+    def batch_size(self, size):
+        return self
+
+class FakeResult:
+    def __init__(self, matched_count=0, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+        self.upserted_id = upserted_id
+
+class FakeCollection:
+    def __init__(self, docs=(), name='fake'):
+        # A unique name, so repositories keyed by collection never share a cache
+        self.full_name = f"test.{name}{next(_collection_ids)}"
+        self.docs = []
+        self.ids = itertools.count(1)
+        for doc in docs:
+            self.insert_one(doc)
+
+    def insert_one(self, doc):
+        doc = deepcopy(doc)
+        doc.setdefault('_id', next(self.ids))
+        self.docs.append(doc)
+        return FakeResult(upserted_id=doc['_id'])
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(project(doc, projection) for doc in self.docs if matches(doc, query or {}))
+
+    def find_one(self, query=None, projection=None):
+        found = self.find(query, projection)
+        return found[0] if found else None
+
+    def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                apply_update(doc, update, inserted=False)
+                return FakeResult(1)
+        if not upsert:
+            return FakeResult(0)
+        doc = {key: value for key, value in query.items() if not key.startswith('$') and not isinstance(value, dict)}
+        doc.setdefault('_id', next(self.ids))
+        apply_update(doc, update, inserted=True)
+        self.docs.append(doc)
+        return FakeResult(0, doc['_id'])
+
+    def update_many(self, query, update):
+        matched = [doc for doc in self.docs if matches(doc, query)]
+        for doc in matched:
+            apply_update(doc, update, inserted=False)
+        return FakeResult(len(matched))
+
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=False):
+        self.update_one(query, update, upsert)
+        return self.find_one(query, projection)
+
+    def delete_one(self, query):
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return FakeResult(1)
+        return FakeResult(0)
+
+    def delete_many(self, query):
+        before = len(self.docs)
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+        return FakeResult(before - len(self.docs))
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            if isinstance(request, UpdateOne):
+                self.update_one(request._filter, request._doc, request._upsert)
+            elif isinstance(request, DeleteOne):
+                self.delete_one(request._filter)
+            elif isinstance(request, DeleteMany):
+                self.delete_many(request._filter)
+            else:
+                raise TypeError(f"Unsupported bulk request {request!r}")
+        return FakeResult(len(requests))
+
+def apply_update(doc, update, inserted):
+    doc.update(deepcopy(update.get('$set', {})))
+    if inserted:
+        doc.update(deepcopy(update.get('$setOnInsert', {})))
+    for field in update.get('$unset', {}):
+        doc.pop(field, None)
+
+def project(doc, projection):
+    doc = deepcopy(doc)
+    if not projection:
+        return doc
+    included = {field for field, value in projection.items() if value}
+    if not included:
+        return {key: value for key, value in doc.items() if key not in projection}
+    kept = {key: value for key, value in doc.items() if key in included}
+    if projection.get('_id', 1) and '_id' in doc:
+        kept['_id'] = doc['_id']
+    return kept
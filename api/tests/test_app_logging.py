@@ -0,0 +1,43 @@
+# Standard library imports
+import logging
+import queue
+
+# Local imports
+from app_logging import REDACTED, NonBlockingQueueHandler, RedactingFilter, StructuredFormatter, redact_text
+
+def test_secret_keys_are_redacted_as_whole_words():
+    assert redact_text("refresh_token=abc123 client_secret: 's3cret'") == (
+        f"refresh_token={REDACTED} client_secret: '{REDACTED}'"
+    )
+    assert 'ya29' not in redact_text("Authorization: Bearer ya29.token")
+
+def test_ordinary_text_is_kept():
+    text = "Google returned status code: 410, next_page_token=CgkI"
+    assert redact_text(text) == text
+
+def test_oauth_code_is_redacted_only_as_a_query_parameter():
+    assert redact_text("GET /auth?code=4/0AbCd&scope=email") == f"GET /auth?code={REDACTED}&scope=email"
+    assert redact_text("error code=403") == "error code=403"
+
+def test_queued_records_are_laid_out_by_the_listener_formatter():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    handler.addFilter(RedactingFilter())
+    logger = logging.getLogger('tests.app_logging')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            logger.exception("Sync failed for %s", 'user@example.com', extra={'access_token': 'secret'})
+    finally:
+        logger.removeHandler(handler)
+
+    record = handler.queue.get_nowait()
+    assert record.getMessage() == "Sync failed for user@example.com"
+    assert record.access_token == REDACTED
+    assert 'ValueError: boom' in record.exc_text
+
+    line = StructuredFormatter('json').format(record)
+    assert '"message": "Sync failed for user@example.com"' in line
+    assert '"exception": "Traceback' in line
@@ -0,0 +1,59 @@
+# Standard library imports
+import threading
+
+# Third-party package imports
+import pytest
+
+# Local imports
+import batching
+from api_scheduler import BACKGROUND, INTERACTIVE, GoogleRequestScheduler
+
+class FakeBatch:
+    # Answers every added request at once, recording how big each batch was
+    sizes = []
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.requests = {}
+
+    def add(self, request, request_id):
+        self.requests[request_id] = request
+
+    def execute(self):
+        FakeBatch.sizes.append(len(self.requests))
+        for request_id, request in self.requests.items():
+            self.callback(request_id, {'request': request}, None)
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = GoogleRequestScheduler(project_qps=1000, project_burst=100, user_qps=1000, user_burst=20)
+    monkeypatch.setattr(batching, 'get_scheduler', lambda: scheduler)
+    monkeypatch.setattr(batching, 'new_batch', lambda service, callback, batch_uri=None: FakeBatch(callback))
+    FakeBatch.sizes = []
+    return scheduler
+
+def run_with_timeout(target, timeout=5):
+    outcome = {}
+    thread = threading.Thread(target=lambda: outcome.update(result=target()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "batched requests never got their quota"
+    return outcome['result']
+
+@pytest.mark.parametrize('priority', [INTERACTIVE, BACKGROUND])
+def test_batches_stay_within_user_burst(scheduler, priority):
+    requests = {f"calendar-{index}": index for index in range(120)}
+
+    results, errors = run_with_timeout(
+        lambda: batching.execute_batched(None, requests, user_key='user@example.com', priority=priority)
+    )
+
+    assert errors == {}
+    assert {key: response['request'] for key, response in results.items()} == requests
+    assert max(FakeBatch.sizes) == 20
+    assert sum(FakeBatch.sizes) == 120
+
+def test_batches_without_user_use_full_batch_size(scheduler):
+    batching.execute_batched(None, {index: index for index in range(120)})
+
+    assert FakeBatch.sizes == [50, 50, 20]
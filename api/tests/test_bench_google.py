@@ -0,0 +1,58 @@
+# Standard library imports
+import threading
+
+# Third-party package imports
+import pytest
+
+# Google-related imports
+from google.oauth2.credentials import Credentials
+
+# Local imports
+from batching import execute_batched, list_events_batched
+from bench_google import BATCH_PATH, FakeGoogleData, FakeGoogleServer, calendar_id
+from config import app_config
+from services import get_service
+
+@pytest.fixture
+def fake_google(monkeypatch):
+    server = FakeGoogleServer(('127.0.0.1', 0), FakeGoogleData(calendars=3, events=5))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    root = f"http://127.0.0.1:{server.server_address[1]}"
+    monkeypatch.setattr(app_config, 'GOOGLE_API_ROOT', root)
+    yield server, root
+    server.shutdown()
+    server.server_close()
+
+def calendar_service(user_index):
+    return get_service('calendar', 'v3', Credentials(token=f"bench-token-{user_index}"))
+
+def test_batched_event_lists_come_back_per_calendar(fake_google):
+    server, root = fake_google
+    calendars = [calendar_id(1, index) for index in range(3)]
+
+    events, errors = list_events_batched(
+        calendar_service(1), calendars, '2024-01-01T00:00:00Z', '2024-04-01T00:00:00Z', batch_uri=root + BATCH_PATH
+    )
+
+    assert errors == {}
+    assert sorted(events) == sorted(calendars)
+    assert all(len(items) == 5 for items in events.values())
+    # One round-trip, three calls against the quota
+    assert server.stats() == {'calls': 3, 'by_endpoint': {'calendar.events.list': 3}}
+
+def test_failed_parts_are_reported_without_failing_the_batch(fake_google):
+    server, root = fake_google
+    service = calendar_service(1)
+    requests = {
+        'own': service.events().list(calendarId=calendar_id(1, 0)),
+        'foreign': service.events().list(calendarId=calendar_id(2, 0)),
+        'calendars': service.calendarList().list(),
+    }
+
+    results, errors = execute_batched(service, requests, batch_uri=root + BATCH_PATH)
+
+    assert sorted(results) == ['calendars', 'own']
+    assert len(results['calendars']['items']) == 3
+    assert list(errors) == ['foreign']
+    assert errors['foreign'].resp.status == 404
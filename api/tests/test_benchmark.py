@@ -0,0 +1,38 @@
+# Standard library imports
+import json
+
+# Local imports
+import benchmark
+
+def fail_if_run(args):
+    raise AssertionError("the benchmark must not run without baselines")
+
+def test_missing_baselines_fail_before_running(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(benchmark, 'run_benchmark', fail_if_run)
+
+    assert benchmark.main(['--mongo-uri', 'mongodb://127.0.0.1:1', '--baselines', str(tmp_path / 'none.json')]) == 2
+    assert '--update-baselines' in capsys.readouterr().err
+
+def test_baselines_for_other_settings_do_not_count(monkeypatch, tmp_path):
+    monkeypatch.setattr(benchmark, 'run_benchmark', fail_if_run)
+    baselines = tmp_path / 'baselines.json'
+    baselines.write_text(json.dumps({'flask-users1-other-profile': {}}))
+
+    assert benchmark.main(['--mongo-uri', 'mongodb://127.0.0.1:1', '--baselines', str(baselines)]) == 2
+
+def test_regressions_against_the_baseline_fail_the_run(monkeypatch, tmp_path):
+    result = {
+        'requests': 10, 'errors': 0, 'throughput_rps': 100.0, 'p50_ms': 10.0, 'p95_ms': 20.0, 'p99_ms': 30.0,
+        'mongo_ops_per_request': 2.0, 'google_calls_per_request': 0.0,
+    }
+    args = benchmark.parse_args(['--mongo-uri', 'mongodb://127.0.0.1:1', '--scenarios', 'calendars'])
+    baselines = tmp_path / 'baselines.json'
+    baselines.write_text(json.dumps({benchmark.profile_key(args): {'calendars': result}}))
+    argv = ['--mongo-uri', 'mongodb://127.0.0.1:1', '--scenarios', 'calendars', '--baselines', str(baselines)]
+
+    monkeypatch.setattr(benchmark, 'run_benchmark', lambda args: {'calendars': result})
+    assert benchmark.main(argv) == 0
+
+    slower = dict(result, p95_ms=40.0)
+    monkeypatch.setattr(benchmark, 'run_benchmark', lambda args: {'calendars': slower})
+    assert benchmark.main(argv) == 1
@@ -0,0 +1,57 @@
+# Third-party package imports
+import pytest
+
+# Local imports
+import calendar_flags
+from calendar_flags import CalendarFlagWriter
+from fakes import FakeCollection
+
+class FlakyCollection(FakeCollection):
+    # Fails the next few bulk writes, like a primary stepping down
+    def __init__(self, docs=(), failures=0):
+        super().__init__(docs)
+        self.failures = failures
+
+    def bulk_write(self, requests, ordered=True):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("not primary")
+        return super().bulk_write(requests, ordered)
+
+@pytest.fixture
+def touched(monkeypatch):
+    touched = []
+    monkeypatch.setattr(calendar_flags, 'touch_users', lambda user_ids: touched.extend(user_ids))
+    return touched
+
+def writer_for(collection):
+    # A long window, so only the test flushes
+    return CalendarFlagWriter(collection, window_ms=60000)
+
+def stored_flag(collection, calendar_id):
+    return collection.find_one({'user_id': 'user-1', 'calendar_id': calendar_id})['enabled']
+
+def test_failed_flush_keeps_the_toggles_for_a_retry(touched):
+    collection = FlakyCollection([{'user_id': 'user-1', 'calendar_id': 'work', 'enabled': False}], failures=1)
+    writer = writer_for(collection)
+
+    assert writer.toggle('user-1', 'work') == {'calendar_id': 'work', 'enabled': True}
+    writer.flush()
+    assert stored_flag(collection, 'work') is False
+    assert writer.pending == {('user-1', 'work'): True}
+
+    writer.flush()
+    assert stored_flag(collection, 'work') is True
+    assert writer.pending == {}
+    assert touched == ['user-1']
+
+def test_toggle_after_a_failed_flush_builds_on_the_answered_state(touched):
+    collection = FlakyCollection([{'user_id': 'user-1', 'calendar_id': 'work', 'enabled': False}], failures=1)
+    writer = writer_for(collection)
+
+    writer.toggle('user-1', 'work')
+    writer.flush()
+    assert writer.toggle('user-1', 'work') == {'calendar_id': 'work', 'enabled': False}
+
+    writer.flush()
+    assert stored_flag(collection, 'work') is False
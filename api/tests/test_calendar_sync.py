@@ -0,0 +1,96 @@
+# Third-party package imports
+import httplib2
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# Local imports
+from calendar_sync import merge_calendar_changes, sync_user_calendars
+from fakes import FakeCollection
+
+def calendar(calendar_id, **fields):
+    return dict({'id': calendar_id, 'summary': calendar_id.title()}, **fields)
+
+def test_deleted_entries_are_dropped():
+    cached = [calendar('work'), calendar('home')]
+
+    merged = merge_calendar_changes(cached, [{'id': 'home', 'deleted': True}])
+
+    assert merged == [calendar('work')]
+
+def test_changed_entries_keep_the_local_enabled_flag():
+    cached = [calendar('work', enabled=True), calendar('home', enabled=False)]
+
+    merged = merge_calendar_changes(cached, [calendar('work', summary='Office'), calendar('team')])
+
+    assert merged == [calendar('work', summary='Office', enabled=True), calendar('home', enabled=False), calendar('team')]
+
+def test_full_listing_replaces_the_cache():
+    cached = [calendar('work', enabled=True), calendar('gone')]
+
+    merged = merge_calendar_changes(cached, [calendar('work')], replace=True)
+
+    assert merged == [calendar('work', enabled=True)]
+
+class FakeRequest:
+    method = 'GET'
+    body = None
+
+    def __init__(self, service, params):
+        self.service = service
+        self.params = params
+        self.uri = f"calendarList?{sorted(params.items())}"
+
+    def execute(self):
+        self.service.calls.append(self.params.get('syncToken'))
+        if self.params.get('syncToken') in self.service.expired_tokens:
+            raise HttpError(httplib2.Response({'status': 410}), b'{"error": {"code": 410}}')
+        return self.service.responses.pop(0)
+
+class FakeCalendarService:
+    def __init__(self, responses, expired_tokens=()):
+        self.responses = list(responses)
+        self.expired_tokens = set(expired_tokens)
+        self.calls = []
+
+    def calendarList(self):
+        return self
+
+    def list(self, **params):
+        return FakeRequest(self, params)
+
+def test_incremental_sync_applies_only_the_changes():
+    users = FakeCollection([{
+        'email': 'user@example.com',
+        'calendars': [calendar('work', enabled=True), calendar('home')],
+        'calendars_sync_token': 'token-1',
+    }])
+    service = FakeCalendarService([
+        {'items': [{'id': 'home', 'deleted': True}, calendar('team')], 'nextSyncToken': 'token-2'},
+    ])
+
+    calendars = sync_user_calendars(service, 'user@example.com', users)
+
+    assert service.calls == ['token-1']
+    assert calendars == [calendar('work', enabled=True), calendar('team')]
+    stored = users.find_one({'email': 'user@example.com'})
+    assert stored['calendars'] == calendars
+    assert stored['calendars_sync_token'] == 'token-2'
+
+def test_expired_sync_token_runs_a_full_resync():
+    users = FakeCollection([{
+        'email': 'user@example.com',
+        'calendars': [calendar('work', enabled=True), calendar('removed')],
+        'calendars_sync_token': 'expired',
+    }])
+    service = FakeCalendarService(
+        [{'items': [calendar('work'), calendar('new')], 'nextSyncToken': 'fresh'}],
+        expired_tokens={'expired'}
+    )
+
+    calendars = sync_user_calendars(service, 'user@example.com', users)
+
+    # The expired token is tried once, then everything is listed again without one
+    assert service.calls == ['expired', None]
+    assert calendars == [calendar('work', enabled=True), calendar('new')]
+    assert users.find_one({'email': 'user@example.com'})['calendars_sync_token'] == 'fresh'
@@ -0,0 +1,76 @@
+# Standard library imports
+import json
+
+# Third-party package imports
+import httplib2
+import pytest
+from flask import Flask
+
+# Google-related imports
+from googleapiclient.errors import HttpError
+
+# Local imports
+import calendars
+from fakes import FakeCollection
+
+class FakeCredentialManager:
+    def get_credentials(self, user_email):
+        return object() if user_email == 'user@example.com' else None
+
+def google_error(status, reason, headers=None):
+    content = json.dumps({'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}}).encode()
+    headers = dict({'status': status, 'content-type': 'application/json; charset=UTF-8'}, **(headers or {}))
+    return HttpError(httplib2.Response(headers), content)
+
+@pytest.fixture
+def calendars_client(monkeypatch):
+    users = FakeCollection([{'email': 'user@example.com'}, {'email': 'expired@example.com'}], name='users')
+    monkeypatch.setattr(calendars, 'get_credential_manager', FakeCredentialManager)
+    monkeypatch.setattr(calendars, 'get_users_collection', lambda: users)
+    monkeypatch.setattr(calendars, 'get_service', lambda *args, **kwargs: None)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(calendars.calendars_blueprint)
+    client = app.test_client()
+
+    def login(email):
+        with client.session_transaction() as session:
+            session['google_user'] = {'email': email}
+
+    def google_fails(error):
+        def sync_user_calendars(*args, **kwargs):
+            raise error
+        monkeypatch.setattr(calendars, 'sync_user_calendars', sync_user_calendars)
+
+    return client, login, google_fails
+
+def test_calendars_without_stored_credentials(calendars_client):
+    client, login, _ = calendars_client
+    login('expired@example.com')
+
+    assert client.get('/calendars').status_code == 401
+
+@pytest.mark.parametrize('error, retry_after', [
+    (google_error(429, 'rateLimitExceeded'), str(calendars.RATE_LIMIT_RETRY_AFTER_SECONDS)),
+    (google_error(403, 'userRateLimitExceeded', {'retry-after': '5'}), '5'),
+])
+def test_rate_limited_calendars_ask_the_client_to_retry(calendars_client, error, retry_after):
+    client, login, google_fails = calendars_client
+    login('user@example.com')
+    google_fails(error)
+
+    response = client.get('/calendars')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == retry_after
+    assert 'error' in response.json
+
+def test_other_google_errors_are_a_bad_gateway(calendars_client):
+    client, login, google_fails = calendars_client
+    login('user@example.com')
+    google_fails(google_error(403, 'forbidden'))
+
+    response = client.get('/calendars')
+
+    assert response.status_code == 502
+    assert 'error' in response.json
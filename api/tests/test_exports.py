@@ -0,0 +1,92 @@
+# Third-party package imports
+import pytest
+from flask import Flask
+
+# Local imports
+import calendars
+import exports
+
+@pytest.fixture
+def export_client(monkeypatch):
+    calls = []
+
+    def stream_hours_export(export_format, start_day, end_day, emails=None, domain=None, calendar_ids=None,
+                            scope=None):
+        calls.append({'emails': emails, 'domain': domain, 'scope': scope, 'range': (start_day, end_day)})
+        return iter(['user_email,calendar_id,day,hours\r\n']), 'text/csv; charset=utf-8'
+
+    monkeypatch.setattr(exports, 'stream_hours_export', stream_hours_export)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(calendars.calendars_blueprint)
+    client = app.test_client()
+
+    def login(email, hd=None):
+        with client.session_transaction() as session:
+            session['google_user'] = {'email': email, 'hd': hd} if hd else {'email': email}
+
+    return client, login, calls
+
+def test_export_needs_a_signed_in_user(export_client):
+    client, _, calls = export_client
+
+    assert client.get('/exports/hours?start=2024-03-01&end=2024-03-31').status_code == 401
+    assert calls == []
+
+def test_export_defaults_to_the_signed_in_user(export_client):
+    client, login, calls = export_client
+    login('me@gmail.com')
+
+    response = client.get('/exports/hours?start=2024-03-01&end=2024-03-31')
+    assert response.status_code == 200
+    assert calls == [{
+        'emails': ['me@gmail.com'], 'domain': None, 'scope': {'email': 'me@gmail.com'},
+        'range': ('2024-03-01', '2024-03-31'),
+    }]
+
+def test_export_is_limited_to_the_users_own_domain(export_client):
+    client, login, calls = export_client
+    login('me@example.com', 'example.com')
+
+    assert client.get('/exports/hours?start=2024-03-01&end=2024-03-31&domain=other.com').status_code == 403
+    assert client.get('/exports/hours?start=2024-03-01&end=2024-03-31&domain=example.com').status_code == 200
+    assert client.get('/exports/hours?start=2024-03-01&end=2024-03-31&user_email=a@other.com').status_code == 200
+    domain_scope = {'$or': [{'email': 'me@example.com'}, {'google_hd': 'example.com'}]}
+    assert [call['scope'] for call in calls] == [domain_scope, domain_scope]
+
+def test_export_needs_a_date_range(export_client):
+    client, login, calls = export_client
+    login('me@gmail.com')
+
+    assert client.get('/exports/hours?start=2024-03-01').status_code == 400
+    assert calls == []
+
+class FakeUsers:
+    def __init__(self):
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        return []
+
+def test_export_users_are_filtered_by_scope():
+    users = FakeUsers()
+    scope = {'email': 'me@gmail.com'}
+
+    exports.load_export_users(['a@other.com'], users=users, scope=scope)
+
+    assert users.queries == [{'$and': [{'email': {'$in': ['a@other.com']}}, scope]}]
+
+@pytest.mark.parametrize('method, path', [
+    ('GET', '/calendars'),
+    ('GET', '/hours?start=2024-03-01&end=2024-03-31'),
+    ('GET', '/hours/summary?start=2024-03-01&end=2024-03-31'),
+    ('PUT', '/calendars/work'),
+])
+def test_routes_ignore_a_query_string_identity(export_client, method, path):
+    client, _, _ = export_client
+    separator = '&' if '?' in path else '?'
+
+    response = client.open(f"{path}{separator}user_email=someone@example.com", method=method)
+
+    assert response.status_code == 401
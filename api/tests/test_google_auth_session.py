@@ -0,0 +1,47 @@
+# Third-party package imports
+import pytest
+from flask import Flask
+
+# Local imports
+import google_auth_session
+
+class FakeFlow:
+    def authorization_url(self):
+        return 'https://accounts.example.com/o/oauth2/auth?client_id=test', 'state'
+
+@pytest.fixture
+def auth_client(monkeypatch):
+    monkeypatch.setattr(google_auth_session, 'new_flow', lambda redirect_uri: FakeFlow())
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.config['REDIRECT_URIS'] = 'http://127.0.0.1/oauth_callback'
+    app.register_blueprint(google_auth_session.auth_blueprint)
+    return app.test_client()
+
+def sign_in(client):
+    with client.session_transaction() as session:
+        session['google_user'] = {'email': 'user@example.com'}
+        session['credentials'] = '{}'
+
+def test_login_starts_the_google_flow(auth_client):
+    response = auth_client.get('/login')
+
+    assert response.status_code == 302
+    assert response.headers['Location'].startswith('https://accounts.example.com/')
+
+def test_login_when_signed_in_goes_to_the_dashboard(auth_client):
+    sign_in(auth_client)
+
+    response = auth_client.get('/login')
+
+    assert response.status_code == 302
+    assert response.headers['Location'] == google_auth_session.DASHBOARD_URL
+
+def test_logout_clears_the_session(auth_client):
+    sign_in(auth_client)
+
+    response = auth_client.get('/logout')
+
+    assert response.status_code == 302
+    with auth_client.session_transaction() as session:
+        assert dict(session) == {}
@@ -0,0 +1,76 @@
+# Standard library imports
+from datetime import date
+
+# Third-party package imports
+import numpy as np
+
+# Local imports
+from hours import (
+    EventTable, busy_hours_by_day, busy_hours_by_calendar, cumulative_busy_seconds, day_edges, merge_intervals,
+    parse_timestamp
+)
+
+def intervals(*pairs):
+    starts, ends = zip(*pairs)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+def event(start, end, **fields):
+    return dict({'start': {'dateTime': start}, 'end': {'dateTime': end}}, **fields)
+
+def test_overlapping_intervals_are_merged():
+    starts, ends = merge_intervals(*intervals((30, 50), (0, 10), (5, 20), (40, 45)))
+
+    assert starts.tolist() == [0, 30]
+    assert ends.tolist() == [20, 50]
+
+def test_adjacent_intervals_merge_into_one_block():
+    starts, ends = merge_intervals(*intervals((0, 10), (10, 20), (25, 30)))
+
+    assert starts.tolist() == [0, 25]
+    assert ends.tolist() == [20, 30]
+
+def test_busy_curve_counts_overlaps_once():
+    starts, ends = intervals((0, 10), (5, 20), (30, 40))
+
+    busy = cumulative_busy_seconds(starts, ends, [-5, 0, 8, 20, 25, 35, 100])
+
+    assert busy.tolist() == [0, 0, 8, 20, 20, 25, 30]
+
+def test_busy_curve_without_events_is_flat():
+    busy = cumulative_busy_seconds(np.array([], dtype=np.int64), np.array([], dtype=np.int64), [0, 100])
+
+    assert busy.tolist() == [0, 0]
+
+def test_day_edges_follow_dst_changes():
+    dates, edges = day_edges(date(2024, 3, 30), date(2024, 4, 1), 'Europe/Berlin')
+
+    assert dates == [date(2024, 3, 30), date(2024, 3, 31), date(2024, 4, 1)]
+    assert np.diff(edges).tolist() == [24 * 3600, 23 * 3600, 24 * 3600]
+
+def test_event_over_a_dst_change_is_split_at_local_midnight():
+    # 22:00 on the 30th (CET) to 04:00 on the 31st (CEST) is five real hours
+    table = EventTable.from_events(
+        {'work': [event('2024-03-30T22:00:00+01:00', '2024-03-31T04:00:00+02:00')]},
+        parse_timestamp('2024-03-29T23:00:00Z'), parse_timestamp('2024-04-01T00:00:00Z')
+    )
+
+    hours = busy_hours_by_day(table, date(2024, 3, 30), date(2024, 3, 31), 'Europe/Berlin')
+
+    assert hours == {'2024-03-30': 2.0, '2024-03-31': 3.0}
+
+def test_calendars_are_unioned_separately_and_in_total():
+    table = EventTable.from_events({
+        'work': [
+            event('2024-05-06T09:00:00Z', '2024-05-06T11:00:00Z'),
+            event('2024-05-06T10:00:00Z', '2024-05-06T12:00:00Z'),
+        ],
+        'home': [
+            event('2024-05-06T11:00:00Z', '2024-05-06T13:00:00Z'),
+            event('2024-05-06T14:00:00Z', '2024-05-06T15:00:00Z', transparency='transparent'),
+            event('2024-05-06T15:00:00Z', '2024-05-06T16:00:00Z', status='cancelled'),
+        ],
+    }, parse_timestamp('2024-05-06T00:00:00Z'), parse_timestamp('2024-05-07T00:00:00Z'))
+
+    hours = busy_hours_by_calendar(table)
+
+    assert hours == {'work': 3.0, 'home': 2.0, 'total': 4.0}
@@ -0,0 +1,88 @@
+# Standard library imports
+from datetime import datetime, timedelta
+
+# Third-party package imports
+from flask import Flask
+
+# Local imports
+import calendars
+from config import app_config
+from fakes import FakeCollection
+from http_cache import conditional_json_response, not_modified_response, version_etag
+
+UPDATED_AT = '2024-03-01T12:00:00'
+
+def test_version_etag_follows_the_stored_version():
+    assert version_etag(UPDATED_AT, 'token-1') == version_etag(UPDATED_AT, 'token-1')
+    assert version_etag(UPDATED_AT, 'token-1') != version_etag(UPDATED_AT, 'token-2')
+
+def test_not_modified_response_answers_only_a_matching_etag():
+    etag = version_etag(UPDATED_AT, 'token-1')
+
+    status, headers, body = not_modified_response({'If-None-Match': etag}, etag, UPDATED_AT)
+    assert (status, body) == (304, b'')
+    assert headers['ETag'] == etag
+    assert not_modified_response({'If-None-Match': version_etag(UPDATED_AT, 'old')}, etag, UPDATED_AT) is None
+    assert not_modified_response({}, etag, UPDATED_AT) is None
+
+def test_conditional_json_response_uses_the_version_etag():
+    etag = version_etag(UPDATED_AT, 'token-1')
+
+    status, headers, body = conditional_json_response({}, [{'id': 'a'}], UPDATED_AT, etag)
+    assert status == 200
+    assert headers['ETag'] == etag
+    assert body == b'[{"id":"a"}]'
+
+class FakeCredentialManager:
+    def get_credentials(self, user_email):
+        return object()
+
+def calendars_client(monkeypatch, user):
+    users = FakeCollection([dict(user, email='user@example.com')], name='users')
+    monkeypatch.setattr(calendars, 'get_users_collection', lambda: users)
+    monkeypatch.setattr(app_config, 'CALENDARS_MAX_AGE_SECONDS', 60)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(calendars.calendars_blueprint)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['google_user'] = {'email': 'user@example.com'}
+    return client
+
+def test_calendars_revalidation_skips_the_google_sync(monkeypatch):
+    def sync_user_calendars(*args, **kwargs):
+        raise AssertionError("a matching ETag must not sync with Google")
+
+    monkeypatch.setattr(calendars, 'sync_user_calendars', sync_user_calendars)
+    client = calendars_client(monkeypatch, {
+        'calendars_updated_at': UPDATED_AT,
+        'calendars_synced_at': datetime.now().isoformat(),
+        'calendars_sync_token': 'token-1',
+        # A later login or token refresh doesn't change the calendar list
+        'updated_at': datetime.now().isoformat(),
+    })
+
+    response = client.get('/calendars', headers={'If-None-Match': version_etag(UPDATED_AT, 'token-1')})
+    assert response.status_code == 304
+
+def test_calendars_revalidation_syncs_a_stale_list_first(monkeypatch):
+    synced = []
+
+    def sync_user_calendars(*args, **kwargs):
+        synced.append(args[1])
+        return []
+
+    monkeypatch.setattr(calendars, 'sync_user_calendars', sync_user_calendars)
+    monkeypatch.setattr(calendars, 'get_credential_manager', FakeCredentialManager)
+    monkeypatch.setattr(calendars, 'get_service', lambda *args, **kwargs: None)
+    monkeypatch.setattr(calendars, 'initialize_calendar_enabled_flags', lambda *args: None)
+    client = calendars_client(monkeypatch, {
+        'calendars_updated_at': UPDATED_AT,
+        'calendars_synced_at': (datetime.now() - timedelta(minutes=5)).isoformat(),
+        'calendars_sync_token': 'token-1',
+    })
+
+    response = client.get('/calendars', headers={'If-None-Match': version_etag(UPDATED_AT, 'token-1')})
+    # The sync found nothing new, so the client's copy is still current
+    assert response.status_code == 304
+    assert synced == ['user@example.com']
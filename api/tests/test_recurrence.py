@@ -0,0 +1,78 @@
+# Standard library imports
+from datetime import datetime, timezone
+
+# Local imports
+from hours import event_intervals, parse_timestamp
+from recurrence import OccurrenceCache, compact_series, expand_series, series_bounds
+
+def utc(value):
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+def daily_standup(*recurrence, count=5):
+    # 10:00-10:30 New York time from Monday 2024-03-04
+    return {
+        'id': 'standup',
+        'start': {'dateTime': '2024-03-04T10:00:00-05:00', 'timeZone': 'America/New_York'},
+        'end': {'dateTime': '2024-03-04T10:30:00-05:00', 'timeZone': 'America/New_York'},
+        'recurrence': [f'RRULE:FREQ=DAILY;COUNT={count}', *recurrence],
+    }
+
+def test_series_keeps_its_local_time_across_dst():
+    series = compact_series(daily_standup(count=14))
+
+    starts = expand_series(series, parse_timestamp('2024-03-09T00:00:00Z'), parse_timestamp('2024-03-12T00:00:00Z'))
+
+    # Clocks go forward on 2024-03-10, so 10:00 local moves from 15:00 to 14:00 UTC
+    assert [utc(start) for start in starts] == [
+        '2024-03-09T15:00:00+00:00', '2024-03-10T14:00:00+00:00', '2024-03-11T14:00:00+00:00',
+    ]
+
+def test_exdates_are_left_out():
+    series = compact_series(daily_standup('EXDATE;TZID=America/New_York:20240305T100000'))
+
+    starts = expand_series(series, parse_timestamp('2024-03-04T00:00:00Z'), parse_timestamp('2024-03-09T00:00:00Z'))
+
+    assert [utc(start)[:10] for start in starts] == ['2024-03-04', '2024-03-06', '2024-03-07', '2024-03-08']
+    assert series_bounds(series) == (parse_timestamp('2024-03-04T15:00:00Z'), parse_timestamp('2024-03-08T15:30:00Z'))
+
+def test_cancelled_and_moved_instances_replace_their_occurrences():
+    events = [
+        daily_standup(),
+        {
+            'id': 'standup_20240305', 'recurringEventId': 'standup', 'status': 'cancelled',
+            'originalStartTime': {'dateTime': '2024-03-05T10:00:00-05:00'},
+        },
+        {
+            'id': 'standup_20240306', 'recurringEventId': 'standup',
+            'originalStartTime': {'dateTime': '2024-03-06T10:00:00-05:00'},
+            'start': {'dateTime': '2024-03-06T16:00:00-05:00'},
+            'end': {'dateTime': '2024-03-06T17:00:00-05:00'},
+        },
+    ]
+
+    found = event_intervals(
+        events, parse_timestamp('2024-03-04T00:00:00Z'), parse_timestamp('2024-03-09T00:00:00Z'), 'test-moved'
+    )
+
+    assert sorted((utc(start), end - start) for start, end in found) == [
+        ('2024-03-04T15:00:00+00:00', 1800),
+        ('2024-03-06T21:00:00+00:00', 3600),
+        ('2024-03-07T15:00:00+00:00', 1800),
+        ('2024-03-08T15:00:00+00:00', 1800),
+    ]
+
+def test_cache_serves_repeats_and_drops_invalidated_series():
+    cache = OccurrenceCache(max_size=2)
+    series = compact_series(daily_standup())
+    window = (parse_timestamp('2024-03-04T00:00:00Z'), parse_timestamp('2024-03-09T00:00:00Z'))
+
+    first = cache.occurrences('standup', series, *window)
+    assert cache.occurrences('standup', series, *window) is first
+    assert cache.get_stats() == {'hits': 1, 'misses': 1, 'entries': 1}
+
+    # An edited series has a new version, so the old expansion is never reused
+    changed = compact_series(daily_standup(count=3))
+    assert len(cache.occurrences('standup', changed, *window)) == 3
+
+    cache.invalidate('standup')
+    assert cache.get_stats()['entries'] == 0
@@ -0,0 +1,88 @@
+# Third-party package imports
+import pytest
+
+# Local imports
+import rollups
+from fakes import FakeCollection
+from rollups import ALL_CALENDARS, sync_calendar_rollups
+
+def event(event_id, start, end, **fields):
+    return dict({'id': event_id, 'start': {'dateTime': start}, 'end': {'dateTime': end}}, **fields)
+
+class FakeStore:
+    def __init__(self, monkeypatch):
+        self.rollups = FakeCollection(name='rollups')
+        self.events = FakeCollection(name='events')
+        self.user_calendars = FakeCollection(name='user_calendars')
+        self.users = FakeCollection([{
+            '_id': 'user-1',
+            'email': 'user@example.com',
+            'calendars': [{'id': 'work', 'primary': True, 'timeZone': 'America/New_York'}, {'id': 'home'}],
+        }], name='users')
+        self.pages = {}
+        monkeypatch.setattr(rollups, 'list_event_changes', self.list_event_changes)
+
+    def list_event_changes(self, cal_service, calendar_id, sync_token=None, time_min=None, user_key=None):
+        assert user_key == 'user@example.com'
+        return self.pages[calendar_id].pop(0), f"{calendar_id}-token"
+
+    def sync(self, calendar_id, *changes):
+        self.pages.setdefault(calendar_id, []).append(list(changes))
+        return sync_calendar_rollups(
+            None, 'user-1', calendar_id,
+            rollups=self.rollups, events=self.events, user_calendars=self.user_calendars, users=self.users
+        )
+
+    def hours(self, calendar_id):
+        return {doc['day']: doc['hours'] for doc in self.rollups.find({'user_id': 'user-1', 'calendar_id': calendar_id})}
+
+@pytest.fixture
+def store(monkeypatch):
+    return FakeStore(monkeypatch)
+
+def test_overlaps_across_calendars_count_once_in_the_union_row(store):
+    store.sync('work', event('review', '2024-05-06T09:00:00-04:00', '2024-05-06T11:00:00-04:00'))
+    store.sync('home', event('dentist', '2024-05-06T10:00:00-04:00', '2024-05-06T12:00:00-04:00'))
+
+    assert store.hours('work') == {'2024-05-06': 2.0}
+    assert store.hours('home') == {'2024-05-06': 2.0}
+    assert store.hours(ALL_CALENDARS) == {'2024-05-06': 3.0}
+
+def test_deleted_event_is_removed_from_both_rollups(store):
+    store.sync('work', event('review', '2024-05-06T09:00:00-04:00', '2024-05-06T11:00:00-04:00'))
+    store.sync('home', event('dentist', '2024-05-06T10:00:00-04:00', '2024-05-06T12:00:00-04:00'))
+
+    assert store.sync('work', {'id': 'review', 'status': 'cancelled'}) == 1
+
+    assert store.hours('work') == {'2024-05-06': 0.0}
+    assert store.hours(ALL_CALENDARS) == {'2024-05-06': 2.0}
+    assert store.events.find_one({'event_id': 'review'}) is None
+    assert store.user_calendars.find_one({'calendar_id': 'work'})['events_sync_token'] == 'work-token'
+
+def test_series_with_a_cancelled_and_a_moved_instance(store):
+    standup = {
+        'id': 'standup',
+        'start': {'dateTime': '2024-05-06T10:00:00-04:00', 'timeZone': 'America/New_York'},
+        'end': {'dateTime': '2024-05-06T10:30:00-04:00', 'timeZone': 'America/New_York'},
+        'recurrence': ['RRULE:FREQ=DAILY;COUNT=3'],
+    }
+    cancelled = {
+        'id': 'standup_0507', 'recurringEventId': 'standup', 'status': 'cancelled',
+        'originalStartTime': {'dateTime': '2024-05-07T10:00:00-04:00'},
+    }
+    moved = event(
+        'standup_0508', '2024-05-09T15:00:00-04:00', '2024-05-09T16:00:00-04:00',
+        recurringEventId='standup', originalStartTime={'dateTime': '2024-05-08T10:00:00-04:00'}
+    )
+
+    store.sync('work', standup, cancelled, moved)
+
+    expected = {'2024-05-06': 0.5, '2024-05-07': 0.0, '2024-05-08': 0.0, '2024-05-09': 1.0}
+    assert store.hours('work') == expected
+    assert store.hours(ALL_CALENDARS) == expected
+
+    # Deleting the series takes its exceptions with it
+    store.sync('work', {'id': 'standup', 'status': 'cancelled'})
+
+    assert store.hours('work') == {'2024-05-06': 0.0, '2024-05-07': 0.0, '2024-05-08': 0.0, '2024-05-09': 0.0}
+    assert store.events.find({'calendar_id': 'work'}) == []
@@ -0,0 +1,52 @@
+# Third-party package imports
+from flask import Flask, session
+
+# Local imports
+from fakes import FakeCollection
+from session_store import MongoSessionInterface
+
+def session_app(sessions):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = MongoSessionInterface(sessions, lifetime=3600, cache_size=10, cache_ttl=30)
+
+    @app.route('/visit')
+    def visit():
+        session['visits'] = session.get('visits', 0) + 1
+        return {'visits': session['visits']}
+
+    @app.route('/login')
+    def login():
+        session.regenerate()
+        session['google_user'] = {'email': 'user@example.com'}
+        return {}
+
+    @app.route('/whoami')
+    def whoami():
+        return {'user': session.get('google_user'), 'visits': session.get('visits')}
+
+    return app
+
+def session_cookie(response):
+    return response.headers['Set-Cookie'].split(';', 1)[0].split('=', 1)[1]
+
+def test_login_issues_a_new_session_id():
+    sessions = FakeCollection(name='sessions')
+    client = session_app(sessions).test_client()
+    planted = session_cookie(client.get('/visit'))
+    planted_sid = sessions.docs[0]['_id']
+
+    assert session_cookie(client.get('/login')) != planted
+    assert [doc['_id'] for doc in sessions.docs] != [planted_sid]
+    assert len(sessions.docs) == 1
+    assert client.get('/whoami').json == {'user': {'email': 'user@example.com'}, 'visits': 1}
+
+def test_planted_session_id_is_not_signed_in_after_login():
+    sessions = FakeCollection(name='sessions')
+    app = session_app(sessions)
+    attacker = app.test_client()
+    planted = session_cookie(attacker.get('/visit'))
+
+    app.test_client(use_cookies=False).get('/login', headers={'Cookie': f"session={planted}"})
+
+    assert attacker.get('/whoami').json == {'user': None, 'visits': None}
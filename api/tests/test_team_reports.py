@@ -0,0 +1,120 @@
+# Standard library imports
+from datetime import date
+
+# Third-party package imports
+import numpy as np
+import pytest
+from flask import Flask
+
+# Local imports
+import calendars
+import team_reports
+from fakes import FakeCollection
+from hours import busy_seconds_in_bins, day_edges
+from team_reports import load_team_members, member_busy_seconds, team_scope
+
+def test_member_busy_seconds_matches_each_member_on_their_own():
+    rng = np.random.default_rng(7)
+    _, edges = day_edges(date(2024, 3, 1), date(2024, 3, 14), 'Europe/Berlin')
+    member_count = 5
+
+    # Overlapping blocks, some running past either end of the window
+    count = 400
+    members = rng.integers(0, member_count, count)
+    starts = rng.integers(edges[0] - 86400, edges[-1], count)
+    ends = starts + rng.integers(900, 4 * 3600, count)
+
+    team = member_busy_seconds(members, starts, ends, member_count, edges)
+
+    assert team.shape == (member_count, len(edges) - 1)
+    for member in range(member_count):
+        mine = members == member
+        clipped_starts = np.clip(starts[mine], edges[0], edges[-1])
+        clipped_ends = np.clip(ends[mine], edges[0], edges[-1])
+        expected = busy_seconds_in_bins(clipped_starts, clipped_ends, edges)
+        np.testing.assert_allclose(team[member], expected)
+
+def test_member_without_busy_blocks_is_free():
+    _, edges = day_edges(date(2024, 3, 1), date(2024, 3, 2))
+    members = np.array([0], dtype=np.int64)
+    starts = np.array([edges[0] + 3600], dtype=np.int64)
+    ends = np.array([edges[0] + 7200], dtype=np.int64)
+
+    team = member_busy_seconds(members, starts, ends, 2, edges)
+
+    np.testing.assert_allclose(team, [[3600, 0], [0, 0]])
+
+class FakeCredentialManager:
+    def get_credentials(self, user_email):
+        return object() if user_email == 'manager@example.com' else None
+
+def test_team_report_route_rejects_bad_requests(monkeypatch):
+    monkeypatch.setattr(calendars, 'get_credential_manager', FakeCredentialManager)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(calendars.calendars_blueprint)
+    client = app.test_client()
+
+    # The requester comes from the session, never from the query string
+    assert client.get('/reports/team?user_email=manager@example.com&start=2024-03-01&end=2024-03-02').status_code == 401
+    with client.session_transaction() as session:
+        session['google_user'] = {'email': 'nobody@example.com'}
+    assert client.get('/reports/team?start=2024-03-01&end=2024-03-02').status_code == 401
+
+    with client.session_transaction() as session:
+        session['google_user'] = {'email': 'manager@example.com'}
+    assert client.get('/reports/team?start=2024-03-01').status_code == 400
+    assert client.get('/reports/team?start=2024-03-01&end=March').status_code == 400
+
+@pytest.fixture
+def team_client(monkeypatch):
+    calls = []
+
+    def build_team_report(credentials, start_date, end_date, tz_name='UTC', emails=None, domain=None, user_key=None,
+                          scope=None):
+        calls.append({'emails': emails, 'domain': domain, 'scope': scope})
+        return {'members': {}, 'by_day': {}, 'total': 0.0, 'errors': {}}
+
+    monkeypatch.setattr(calendars, 'get_credential_manager', FakeCredentialManager)
+    monkeypatch.setattr(team_reports, 'build_team_report', build_team_report)
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.register_blueprint(calendars.calendars_blueprint)
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['google_user'] = {'email': 'manager@example.com', 'hd': 'example.com'}
+    return client, calls
+
+def test_team_report_is_limited_to_the_managers_domain(team_client):
+    client, calls = team_client
+    dates = 'start=2024-03-01&end=2024-03-02'
+
+    assert client.get(f"/reports/team?{dates}&domain=other.com").status_code == 403
+    assert client.get(f"/reports/team?{dates}&member=a@example.com&member=b@other.com").status_code == 403
+    assert calls == []
+
+    assert client.get(f"/reports/team?{dates}&domain=example.com").status_code == 200
+    assert client.get(f"/reports/team?{dates}&member=a@example.com").status_code == 200
+    domain_scope = {'$or': [{'email': 'manager@example.com'}, {'google_hd': 'example.com'}]}
+    assert calls == [
+        {'emails': [], 'domain': 'example.com', 'scope': domain_scope},
+        {'emails': ['a@example.com'], 'domain': None, 'scope': domain_scope},
+    ]
+
+def test_users_without_a_workspace_domain_only_report_on_themselves():
+    requester = {'email': 'me@gmail.com'}
+
+    assert team_scope(requester, ['me@gmail.com']) == {'email': 'me@gmail.com'}
+    assert team_scope(requester, ['friend@gmail.com']) is None
+    assert team_scope(requester, domain='gmail.com') is None
+
+def test_team_members_are_loaded_within_the_scope():
+    users = FakeCollection([
+        {'email': 'a@example.com', 'google_hd': 'example.com'},
+        {'email': 'b@example.com', 'google_hd': 'other.com'},
+    ])
+    scope = team_scope({'email': 'manager@example.com', 'hd': 'example.com'}, ['a@example.com', 'b@example.com'])
+
+    members = load_team_members(['a@example.com', 'b@example.com'], users=users, scope=scope)
+
+    assert [member['email'] for member in members] == ['a@example.com']
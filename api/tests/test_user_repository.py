@@ -0,0 +1,27 @@
+# Local imports
+import user_repository
+from user_repository import UserRepository, invalidate_cached_users
+
+class FakeUsers:
+    full_name = 'test.users'
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.reads = 0
+
+    def find_one(self, query, projection=None):
+        self.reads += 1
+        return dict(self.doc)
+
+def test_writes_from_outside_a_repository_drop_cached_users(monkeypatch):
+    users = FakeUsers({'_id': 1, 'email': 'user@example.com', 'calendars': []})
+    repository = UserRepository(users, max_size=10, ttl=60)
+    monkeypatch.setitem(user_repository._repositories, users.full_name, repository)
+
+    repository.find_by_email('user@example.com', ('calendars',))
+    repository.find_by_email('user@example.com', ('calendars',))
+    assert users.reads == 1
+
+    invalidate_cached_users([1])
+    repository.find_by_email('user@example.com', ('calendars',))
+    assert users.reads == 2
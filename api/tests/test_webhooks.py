@@ -0,0 +1,132 @@
+# Standard library imports
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Third-party package imports
+import pytest
+
+# Local imports
+import webhooks
+from config import app_config
+from webhooks import NotificationHandler, ensure_calendar_watches, send_test_notification
+
+class FakeChannels:
+    # Just enough of a collection for the channel documents
+    def __init__(self, docs=()):
+        self.docs = [dict(doc, _id=index) for index, doc in enumerate(docs)]
+
+    def find(self, query):
+        return [doc for doc in self.docs if all(doc.get(key) == value for key, value in query.items())]
+
+    def find_one(self, query, projection=None):
+        return next(iter(self.find(query)), None)
+
+    def delete_one(self, query):
+        self.docs = [doc for doc in self.docs if doc['_id'] != query['_id']]
+
+def live_channel(calendar_id, expires_in=timedelta(days=7)):
+    return {
+        'user_id': 'user-1',
+        'calendar_id': calendar_id,
+        'channel_id': f"channel-{calendar_id}",
+        'resource_id': f"resource-{calendar_id}",
+        'token': f"token-{calendar_id}",
+        'expiration': datetime.utcnow() + expires_in,
+    }
+
+def test_only_channels_that_were_already_live_count_as_watched(monkeypatch):
+    monkeypatch.setattr(app_config, 'WEBHOOK_URL', 'https://example.com/webhooks/calendar')
+    registered = []
+    monkeypatch.setattr(webhooks, 'register_watch', lambda service, user_id, calendar_id, channels, user_key:
+                        registered.append(calendar_id))
+    monkeypatch.setattr(webhooks, 'stop_watch', lambda service, channel, user_key: None)
+    channels = FakeChannels([live_channel('live'), live_channel('expiring', expires_in=timedelta(seconds=1))])
+
+    watched = ensure_calendar_watches(None, 'user-1', ['live', 'expiring', 'new'], channels)
+
+    # The renewed and the new calendar still need this round's polled sync
+    assert watched == {'live'}
+    assert sorted(registered) == ['expiring', 'new']
+
+@pytest.fixture
+def webhook_url():
+    synced = []
+    done = threading.Event()
+
+    def sync_calendar(user_id, calendar_id):
+        synced.append((user_id, calendar_id))
+        done.set()
+
+    handler = NotificationHandler(sync_calendar, FakeChannels([live_channel('calendar-1')]), max_workers=1)
+
+    class WebhookRequestHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            self.send_response(handler.handle(self.headers))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/webhooks/calendar", synced, done
+    finally:
+        server.shutdown()
+        server.server_close()
+        handler.executor.shutdown(wait=True)
+
+def test_notifications_sync_the_channel_calendar(webhook_url):
+    url, synced, done = webhook_url
+
+    # The 'sync' message only confirms the channel; the worker syncs new channels itself
+    assert send_test_notification(url, 'channel-calendar-1', 'token-calendar-1', 'sync') == 200
+    assert synced == []
+
+    assert send_test_notification(url, 'channel-calendar-1', 'token-calendar-1', 'exists', 2) == 200
+    assert done.wait(5)
+    assert synced == [('user-1', 'calendar-1')]
+
+def test_notifications_are_verified(webhook_url):
+    url, synced, _ = webhook_url
+
+    assert send_test_notification(url, 'channel-calendar-1', 'wrong-token') == 403
+    assert send_test_notification(url, 'unknown-channel', 'token-calendar-1') == 404
+    assert synced == []
+
+def test_notification_during_a_sync_runs_it_again_afterwards():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+    active = []
+
+    def sync_calendar(user_id, calendar_id):
+        active.append(calendar_id)
+        calls.append(len(active))
+        if len(calls) == 1:
+            started.set()
+            release.wait(5)
+        active.pop()
+
+    handler = NotificationHandler(sync_calendar, FakeChannels([live_channel('calendar-1')]), max_workers=4)
+    headers = {
+        'X-Goog-Channel-ID': 'channel-calendar-1',
+        'X-Goog-Channel-Token': 'token-calendar-1',
+        'X-Goog-Resource-State': 'exists',
+    }
+    try:
+        assert handler.handle(headers) == 200
+        assert started.wait(5)
+        # Two notifications while the first sync runs fold into one more sync
+        assert handler.handle(headers) == 200
+        assert handler.handle(headers) == 200
+        release.set()
+    finally:
+        handler.executor.shutdown(wait=True)
+
+    # Never two syncs of the calendar at once
+    assert calls == [1, 1]
+    assert handler.running == set() and handler.rerun == set()
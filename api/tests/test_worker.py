@@ -0,0 +1,42 @@
+# Standard library imports
+import asyncio
+from datetime import datetime, timedelta
+
+# Local imports
+from fakes import FakeCollection
+from worker import ShardLeases, renew_leases
+
+class FakeClock:
+    # Time only moves when the heartbeat sleeps, and the cycle ends after a set time
+    def __init__(self, cycle_seconds):
+        self.now = datetime(2024, 3, 1, 12, 0)
+        self.cycle_ends_at = self.now + timedelta(seconds=cycle_seconds)
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        if self.now >= self.cycle_ends_at:
+            raise asyncio.CancelledError()
+        self.sleeps.append(seconds)
+        self.now += timedelta(seconds=seconds)
+
+async def heartbeat_until_cancelled(leases, clock):
+    try:
+        await renew_leases(leases, clock.sleep, clock)
+    except asyncio.CancelledError:
+        pass
+
+def test_leases_are_renewed_while_a_cycle_runs():
+    collection = FakeCollection([{'_id': 0, 'owner': 'me'}, {'_id': 1, 'owner': 'other'}], name='sync_leases')
+    leases = ShardLeases(collection, 'me', lease_seconds=30)
+    # A cycle three times longer than the lease
+    clock = FakeClock(cycle_seconds=90)
+
+    asyncio.run(heartbeat_until_cancelled(leases, clock))
+
+    # Renewed every third of the lease, each time a full lease past the time it ran at
+    assert clock.sleeps == [10.0] * 9
+    assert collection.find_one({'_id': 0})['expires_at'] == clock.cycle_ends_at + timedelta(seconds=30)
+    assert 'expires_at' not in collection.find_one({'_id': 1})
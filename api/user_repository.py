@@ -0,0 +1,169 @@
+# User documents read through a small in-process cache. Logins and dashboard
+# requests look the same user up by email several times; those lookups are served
+# from here for a few seconds, and every write this process makes to a user drops
+# the cached copy. Writes from other processes (the sync workers, other servers)
+# are only seen once the entry expires after USER_CACHE_TTL_SECONDS, so anything
+# that must be current, like the Last-Modified and ETag of /calendars, is read
+# from Mongo instead.
+#
+#   users = get_user_repository(collection)
+#   user = users.find_by_email(user_email, ('calendars', 'updated_at'))
+
+# Standard library imports
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+# Local imports
+from config import app_config
+from metrics import count_cache
+from mongodb import get_collection
+
+USERS_COLLECTION = 'users'
+
+class UserRepository:
+    # LRU of user documents keyed by _id, with an email -> _id index. Each entry
+    # remembers which fields it was loaded with; a lookup needing more fields is a
+    # miss and reloads the union, so the entry grows to cover every caller.
+    def __init__(self, collection=None, max_size=None, ttl=None):
+        self.collection = collection if collection is not None else get_collection(USERS_COLLECTION)
+        self.max_size = max_size or app_config.USER_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else app_config.USER_CACHE_TTL_SECONDS
+        # _id -> (document, loaded fields or None for the whole document, loaded at)
+        self.entries = OrderedDict()
+        self.ids_by_email = {}
+        # Bumped by every invalidation, so a read that raced a write isn't cached
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def cached(self, user_id, fields):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            doc, loaded, loaded_at = entry
+            if time.monotonic() - loaded_at > self.ttl:
+                self.remove(user_id)
+                return None
+            if loaded is not None and (fields is None or not set(fields) <= loaded):
+                return None
+            self.entries.move_to_end(user_id)
+        return select(doc, fields)
+
+    def loaded_fields(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+        return entry[1] if entry is not None else set()
+
+    def load(self, query, fields, known_fields=()):
+        projection = None
+        if fields is not None and known_fields is not None:
+            projection = dict.fromkeys(set(fields) | set(known_fields) | {'email'}, 1)
+
+        with self.lock:
+            generation = self.generation
+        doc = self.collection.find_one(query, projection)
+        if doc is None:
+            return None
+        self.put(doc, set(projection) if projection is not None else None, generation)
+        return select(doc, fields)
+
+    def find_by_email(self, email, fields=None):
+        # fields=None loads the whole document
+        if not email:
+            return None
+        with self.lock:
+            user_id = self.ids_by_email.get(email)
+
+        doc = self.cached(user_id, fields) if user_id is not None else None
+        count_cache('users', doc is not None)
+        if doc is not None:
+            return doc
+
+        known_fields = self.loaded_fields(user_id) if user_id is not None else ()
+        return self.load({'email': email}, fields, known_fields)
+
+    def find_by_id(self, user_id, fields=None):
+        doc = self.cached(user_id, fields)
+        count_cache('users', doc is not None)
+        if doc is not None:
+            return doc
+
+        return self.load({'_id': user_id}, fields, self.loaded_fields(user_id))
+
+    def get_user_id(self, email):
+        user = self.find_by_email(email, ())
+        return user['_id'] if user else None
+
+    def put(self, doc, fields, generation=None):
+        # Also the write-through path for callers that just wrote the user and got it back
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.remove(doc['_id'])
+            self.entries[doc['_id']] = (deepcopy(doc), fields, time.monotonic())
+            if doc.get('email'):
+                self.ids_by_email[doc['email']] = doc['_id']
+            while len(self.entries) > self.max_size:
+                evicted_id, (evicted, _, _) = self.entries.popitem(last=False)
+                self.forget_email(evicted_id, evicted.get('email'))
+
+    def remove(self, user_id):
+        # Caller holds the lock
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            self.forget_email(user_id, entry[0].get('email'))
+
+    def forget_email(self, user_id, email):
+        if email is not None and self.ids_by_email.get(email) == user_id:
+            del self.ids_by_email[email]
+
+    def invalidate(self, user_id=None, email=None):
+        self.invalidate_many([user_id] if user_id is not None else [], [email] if email is not None else [])
+
+    def invalidate_many(self, user_ids=(), emails=()):
+        with self.lock:
+            self.generation += 1
+            user_ids = list(user_ids) + [self.ids_by_email.get(email) for email in emails]
+            for user_id in user_ids:
+                if user_id is not None:
+                    self.remove(user_id)
+
+    def get_stats(self):
+        with self.lock:
+            return {'entries': len(self.entries)}
+
+def select(doc, fields):
+    # A private copy, so callers can't change what is cached
+    if fields is None:
+        return deepcopy(doc)
+    return {field: deepcopy(doc[field]) for field in ('_id',) + tuple(fields) if field in doc}
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+def get_user_repository(collection=None):
+    # One cache per users collection, shared across requests
+    if collection is None:
+        collection = get_collection(USERS_COLLECTION)
+
+    with _repositories_lock:
+        repository = _repositories.get(collection.full_name)
+        if repository is None:
+            repository = UserRepository(collection)
+            _repositories[collection.full_name] = repository
+    return repository
+
+def invalidate_cached_users(user_ids=(), emails=()):
+    # For writes that don't go through a repository, e.g. motor in the aiohttp app;
+    # only repositories this process already created hold anything to drop
+    with _repositories_lock:
+        repositories = list(_repositories.values())
+    for repository in repositories:
+        repository.invalidate_many(user_ids, emails)
+
+def get_user_cache_stats():
+    with _repositories_lock:
+        repositories = list(_repositories.values())
+    return {'entries': sum(repository.get_stats()['entries'] for repository in repositories)}
@@ -0,0 +1,232 @@
+# Google Calendar push notifications. Each enabled calendar gets an events().watch
+# channel pointing at POST /webhooks/calendar; a notification triggers an incremental
+# sync of just that calendar instead of polling every calendar of every user.
+#
+# A local stand-in can post fake notifications to a running server:
+#
+#   python webhooks.py --url http://localhost:8000/webhooks/calendar --channel-id <id>
+
+# Standard library imports
+import argparse
+import base64
+import hmac
+import os
+import threading
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Local imports
+from app_logging import get_logger
+from api_scheduler import BACKGROUND, execute_request
+from config import app_config
+from mongodb import get_collection
+
+logger = get_logger(__name__)
+
+WATCH_CHANNELS_COLLECTION = 'watch_channels'
+
+def get_channels_collection():
+    return get_collection(WATCH_CHANNELS_COLLECTION)
+
+def register_watch(cal_service, user_id, calendar_id, channels=None, user_key=None):
+    channels = channels if channels is not None else get_channels_collection()
+    channel_id = str(uuid.uuid4())
+    channel_token = base64.urlsafe_b64encode(os.urandom(24)).decode()
+
+    response = execute_request(cal_service.events().watch(calendarId=calendar_id, body={
+        'id': channel_id,
+        'type': 'web_hook',
+        'address': app_config.WEBHOOK_URL,
+        'token': channel_token,
+        'params': {'ttl': str(app_config.WATCH_TTL_SECONDS)},
+    }), user_key, BACKGROUND)
+
+    # Google reports the expiration in milliseconds since the epoch
+    expiration = datetime.utcfromtimestamp(int(response['expiration']) / 1000)
+    channels.update_one(
+        {'user_id': user_id, 'calendar_id': calendar_id},
+        {'$set': {
+            'channel_id': channel_id,
+            'resource_id': response['resourceId'],
+            'token': channel_token,
+            'expiration': expiration,
+        }},
+        upsert=True
+    )
+    return channel_id
+
+def stop_watch(cal_service, channel, user_key=None):
+    try:
+        execute_request(cal_service.channels().stop(body={
+            'id': channel['channel_id'],
+            'resourceId': channel['resource_id'],
+        }), user_key, BACKGROUND)
+    except Exception as e:
+        # An already expired channel can't be stopped, which is fine
+        logger.info("Could not stop channel: %s", e, extra={'channel_id': channel['channel_id']})
+
+def ensure_calendar_watches(cal_service, user_id, calendar_ids, channels=None, user_key=None):
+    # Register missing channels and renew ones close to expiry. Returns the ids of calendars
+    # whose channel was already live; Google only reports changes made after a channel is
+    # created, so new and renewed ones still need a sync from the caller this time round.
+    # Quota is keyed by user_key, the user's email, like every other Google call.
+    if not app_config.WEBHOOK_URL:
+        return set()
+
+    channels = channels if channels is not None else get_channels_collection()
+    existing = {
+        channel['calendar_id']: channel
+        for channel in channels.find({'user_id': user_id})
+    }
+    renew_before = datetime.utcnow() + timedelta(seconds=app_config.WATCH_RENEW_MARGIN_SECONDS)
+
+    watched = set()
+    for calendar_id in calendar_ids:
+        channel = existing.pop(calendar_id, None)
+        if channel is not None and channel['expiration'] > renew_before:
+            watched.add(calendar_id)
+            continue
+        try:
+            register_watch(cal_service, user_id, calendar_id, channels, user_key)
+        except Exception as e:
+            logger.warning("Could not watch calendar: %s", e, extra={'calendar_id': calendar_id})
+            continue
+        if channel is not None:
+            stop_watch(cal_service, channel, user_key)
+
+    # Calendars that were disabled don't need notifications any more
+    for calendar_id, channel in existing.items():
+        stop_watch(cal_service, channel, user_key)
+        channels.delete_one({'_id': channel['_id']})
+
+    return watched
+
+class NotificationHandler:
+    # Verifies notifications and syncs the affected calendar on a small thread pool.
+    # Notifications arriving while a calendar's sync is queued are folded into it; ones
+    # arriving while it runs make it run once more afterwards, never a second sync alongside.
+    def __init__(self, sync_calendar, channels=None, max_workers=None):
+        self.sync_calendar = sync_calendar
+        self.channels = channels
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or app_config.WEBHOOK_SYNC_THREADS)
+        self.pending = set()
+        self.running = set()
+        self.rerun = set()
+        self.lock = threading.Lock()
+
+    def get_channels(self):
+        if self.channels is None:
+            self.channels = get_channels_collection()
+        return self.channels
+
+    def handle(self, headers):
+        # Returns the HTTP status to answer Google with
+        channel_id = headers.get('X-Goog-Channel-ID')
+        resource_state = headers.get('X-Goog-Resource-State')
+        if not channel_id:
+            return 400
+
+        channel = self.get_channels().find_one(
+            {'channel_id': channel_id},
+            {'user_id': 1, 'calendar_id': 1, 'token': 1, 'resource_id': 1}
+        )
+        if channel is None:
+            # Unknown or replaced channel; a 404 doesn't make Google retry
+            return 404
+        if not hmac.compare_digest(headers.get('X-Goog-Channel-Token', ''), channel['token']):
+            return 403
+
+        # 'sync' only confirms the channel was created
+        if resource_state == 'sync':
+            return 200
+
+        key = (channel['user_id'], channel['calendar_id'])
+        with self.lock:
+            if key in self.pending:
+                return 200
+            if key in self.running:
+                # The running sync may have listed changes before this one landed
+                self.rerun.add(key)
+                return 200
+            self.pending.add(key)
+        self.executor.submit(self.run_sync, key)
+        return 200
+
+    def run_sync(self, key):
+        with self.lock:
+            self.pending.discard(key)
+            self.running.add(key)
+        while True:
+            try:
+                self.sync_calendar(*key)
+            except Exception:
+                logger.exception("Webhook sync failed", extra={'calendar_id': key[1]})
+            with self.lock:
+                if key not in self.rerun:
+                    self.running.discard(key)
+                    return
+                self.rerun.discard(key)
+
+def sync_watched_calendar(user_id, calendar_id):
+    # Imported here so the webhook module doesn't pull in the sync stack on import
+    from credentials_manager import get_credential_manager
+    from rollups import sync_calendar_rollups
+    from services import get_service
+
+    from user_repository import get_user_repository
+
+    # Notifications for the same user arrive in bursts, so the user is usually cached
+    user = get_user_repository().find_by_id(user_id, ('email', 'calendars'))
+    if not user:
+        return None
+    credentials = get_credential_manager().get_credentials(user['email'])
+    if credentials is None:
+        return None
+
+    cal_service = get_service('calendar', 'v3', credentials=credentials)
+    return sync_calendar_rollups(cal_service, user_id, calendar_id)
+
+_notification_handler = None
+_notification_handler_lock = threading.Lock()
+
+def get_notification_handler():
+    global _notification_handler
+
+    with _notification_handler_lock:
+        if _notification_handler is None:
+            _notification_handler = NotificationHandler(sync_watched_calendar)
+    return _notification_handler
+
+def send_test_notification(url, channel_id, channel_token='', resource_state='exists', message_number=1):
+    # Posts a notification shaped like Google's: everything is in the headers
+    request = urllib.request.Request(url, data=b'', method='POST', headers={
+        'X-Goog-Channel-ID': channel_id,
+        'X-Goog-Channel-Token': channel_token,
+        'X-Goog-Resource-ID': 'test-resource',
+        'X-Goog-Resource-State': resource_state,
+        'X-Goog-Message-Number': str(message_number),
+    })
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+def main():
+    parser = argparse.ArgumentParser(description="Post a fake Google Calendar push notification.")
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--channel-id', required=True)
+    parser.add_argument('--token', default='')
+    parser.add_argument('--state', default='exists')
+    parser.add_argument('--count', type=int, default=1)
+    args = parser.parse_args()
+
+    for message_number in range(1, args.count + 1):
+        status = send_test_notification(args.url, args.channel_id, args.token, args.state, message_number)
+        print(f"Notification {message_number}: HTTP {status}")
+
+if __name__ == '__main__':
+    main()
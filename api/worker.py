@@ -0,0 +1,209 @@
+# Background sync worker, run next to app.py:
+#
+#   python worker.py [--processes 4]
+#
+# Keeps every user's calendar list and hour rollups fresh in Mongo so dashboard
+# requests can be served from stored data. Users are split into SYNC_SHARDS shards;
+# each worker process leases a few shards at a time from the sync_leases collection,
+# so any number of processes on any number of nodes share the work without overlap.
+
+# Standard library imports
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import socket
+from datetime import datetime, timedelta
+
+# MongoDB-related imports
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Local imports
+from app_logging import configure_logging, get_logger
+from api_scheduler import BACKGROUND
+from calendar_flags import get_user_calendars_collection, load_calendar_flags
+from calendar_sync import sync_user_calendars
+from config import app_config
+from credentials_manager import get_credential_manager
+from mongodb import MongoDBClient, get_collection, sync_shard_for
+from rollups import sync_calendar_rollups
+from services import get_service
+from webhooks import ensure_calendar_watches
+
+logger = get_logger(__name__)
+
+SYNC_LEASES_COLLECTION = 'sync_leases'
+IDLE_SECONDS = 5
+
+class ShardLeases:
+    def __init__(self, collection, owner, lease_seconds=None, max_shards=None):
+        self.collection = collection
+        self.owner = owner
+        self.lease = timedelta(seconds=lease_seconds or app_config.SYNC_LEASE_SECONDS)
+        self.max_shards = max_shards or app_config.SYNC_SHARDS_PER_WORKER
+
+    def renew(self, now=None):
+        # Push out the expiry of the shards we hold, without claiming new ones
+        expires_at = (now or datetime.utcnow()) + self.lease
+        self.collection.update_many({'owner': self.owner}, {'$set': {'expires_at': expires_at}})
+        return expires_at
+
+    def refresh(self):
+        # Renew the shards we hold, then claim free or expired ones up to our share
+        now = datetime.utcnow()
+        expires_at = self.renew(now)
+        owned = [doc['_id'] for doc in self.collection.find({'owner': self.owner}, {'_id': 1})]
+
+        candidates = [shard for shard in range(app_config.SYNC_SHARDS) if shard not in owned]
+        random.shuffle(candidates)
+        for shard in candidates:
+            if len(owned) >= self.max_shards:
+                break
+            try:
+                # Matches only a free or expired lease; a live lease makes the upsert collide
+                self.collection.find_one_and_update(
+                    {'_id': shard, '$or': [{'owner': self.owner}, {'expires_at': {'$lte': now}}]},
+                    {'$set': {'owner': self.owner, 'expires_at': expires_at}},
+                    upsert=True
+                )
+                owned.append(shard)
+            except DuplicateKeyError:
+                continue
+
+        return owned
+
+    def release(self):
+        self.collection.update_many(
+            {'owner': self.owner},
+            {'$set': {'expires_at': datetime.utcnow()}}
+        )
+
+def claim_due_users(users, shards, batch_size=None):
+    # Pick users whose next sync is due and push their next sync out right away,
+    # so a slow sync isn't picked up again by the next cycle
+    now = datetime.utcnow()
+    due_users = list(users.find(
+        {
+            'sync_shard': {'$in': shards},
+            'refresh_token': {'$exists': True},
+            '$or': [{'next_sync_at': {'$lte': now}}, {'next_sync_at': {'$exists': False}}],
+        },
+        {'_id': 1, 'email': 1}
+    ).sort('next_sync_at', 1).limit(batch_size or app_config.SYNC_BATCH_SIZE))
+
+    if due_users:
+        users.update_many(
+            {'_id': {'$in': [user['_id'] for user in due_users]}},
+            {'$set': {'next_sync_at': now + timedelta(seconds=app_config.SYNC_INTERVAL_SECONDS)}}
+        )
+    return due_users
+
+def sync_user(users, user):
+    credentials = get_credential_manager().get_credentials(user['email'])
+    if credentials is None:
+        return None
+
+    cal_service = get_service('calendar', 'v3', credentials=credentials)
+    sync_user_calendars(cal_service, user['email'], users, BACKGROUND)
+
+    calendar_flags = load_calendar_flags(get_user_calendars_collection(), user['_id'])
+    enabled_calendar_ids = [calendar_id for calendar_id, enabled in calendar_flags.items() if enabled]
+
+    # Calendars with a channel that was already live are synced when Google notifies us, not polled
+    watched = ensure_calendar_watches(cal_service, user['_id'], enabled_calendar_ids, user_key=user['email'])
+    for calendar_id in enabled_calendar_ids:
+        if calendar_id not in watched:
+            sync_calendar_rollups(cal_service, user['_id'], calendar_id, users=users)
+    return None
+
+async def sync_with_limit(semaphore, users, user):
+    async with semaphore:
+        try:
+            # The Google and Mongo clients block, so each sync runs on a worker thread
+            await asyncio.to_thread(sync_user, users, user)
+        except Exception:
+            logger.exception("Sync failed", extra={'user_email': user['email']})
+
+async def renew_leases(leases, sleep=asyncio.sleep, clock=datetime.utcnow):
+    # A cycle can outlast the lease, so the leases are kept alive while it runs
+    interval = leases.lease.total_seconds() / 3
+    while True:
+        await sleep(interval)
+        try:
+            await asyncio.to_thread(leases.renew, clock())
+        except Exception:
+            logger.exception("Could not renew shard leases")
+
+async def worker_loop(owner, stop_event):
+    users = get_collection('users')
+    leases = ShardLeases(get_collection(SYNC_LEASES_COLLECTION), owner)
+    semaphore = asyncio.Semaphore(app_config.SYNC_CONCURRENCY)
+    get_credential_manager().start()
+    heartbeat = asyncio.create_task(renew_leases(leases))
+
+    try:
+        while not stop_event.is_set():
+            shards = await asyncio.to_thread(leases.refresh)
+            due_users = await asyncio.to_thread(claim_due_users, users, shards) if shards else []
+
+            if due_users:
+                await asyncio.gather(*(sync_with_limit(semaphore, users, user) for user in due_users))
+            else:
+                await asyncio.sleep(IDLE_SECONDS)
+    finally:
+        # Stopped before the release, so a last renewal can't land after it
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+        await asyncio.to_thread(leases.release)
+        get_credential_manager().stop()
+
+def run_worker(stop_event):
+    # Spawned processes start without the parent's logging setup
+    configure_logging()
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info("Sync worker %s started", owner)
+    try:
+        asyncio.run(worker_loop(owner, stop_event))
+    except KeyboardInterrupt:
+        pass
+
+def backfill_sync_shards(users):
+    # Users saved before sharding existed get their shard assigned once
+    requests = [
+        UpdateOne({'_id': user['_id']}, {'$set': {'sync_shard': sync_shard_for(user['email'])}})
+        for user in users.find({'sync_shard': {'$exists': False}}, {'email': 1})
+    ]
+    if requests:
+        users.bulk_write(requests, ordered=False)
+    return len(requests)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the background calendar sync workers.")
+    parser.add_argument('--processes', type=int, default=app_config.SYNC_PROCESSES)
+    args = parser.parse_args()
+    configure_logging()
+
+    # Creating the client also makes sure every index exists
+    mongo_client = MongoDBClient(None)
+    backfilled = backfill_sync_shards(mongo_client.connect_to_mongodb())
+    logger.info("Assigned sync shards to %d users", backfilled)
+
+    # Spawned workers start with clean Mongo pools and no inherited threads
+    context = multiprocessing.get_context('spawn')
+    stop_event = context.Event()
+    processes = [context.Process(target=run_worker, args=(stop_event,)) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop_event.set()
+        for process in processes:
+            process.join()
+
+if __name__ == '__main__':
+    main()